@@ -1,50 +1,270 @@
-from fastapi import APIRouter, Depends
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 
 from app.api.auth.dependencies import get_current_active_user
-from app.core.exceptions import ResourceNotFoundException, PermissionDeniedException
+from app.api.datasets.dependencies import (
+    check_queryable, get_queryable_dataset, join_source, resolve_join_sources
+)
+from app.core.exceptions import (
+    ResourceNotFoundException, PermissionDeniedException, InvalidQueryException
+)
 from app.db.session import get_db
 from app.models.query import SavedQuery
 from app.models.dataset import Dataset
 from app.models.user import User
+from app.models.visualization import Visualization
 from app.schemas.query import (
-    QueryRequest, QueryResult, SavedQueryCreate, SavedQueryUpdate, 
-    SavedQueryResponse, SavedQueryList
+    QueryRequest, QueryResult, QuerySpec, SavedQueryCreate, SavedQueryUpdate, 
+    SavedQueryResponse, SavedQueryList, BatchItem, BatchRequest, BatchResult
+)
+from app.core.config import settings
+from app.utils.cache import result_cache
+from app.utils.data_processor import iter_query_batches, iter_frame_batches, query_sample
+from app.utils.executor import run_heavy, heavy_jobs
+from app.utils.joins import JoinSource
+from app.utils.pagination import keyset_page
+from app.utils.query_engine import QueryError, parse_query
+from app.utils.serializers import (
+    negotiate_format, render_query, render_batch, cached_response, make_etag, etag_matches,
+    query_key, chart_key, batch_result, batch_error, sampling_headers, BatchTask,
+    ROWS_JSON_MEDIA_TYPE, ARROW_STREAM_MEDIA_TYPE
 )
-from app.utils.data_processor import execute_query
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.post("/query", response_model=QueryResult)
 async def run_query(
     query_req: QueryRequest,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    # 检查数据集是否存在
-    dataset = db.query(Dataset).filter(Dataset.id == query_req.dataset_id).first()
-    
-    if not dataset:
-        raise ResourceNotFoundException("Dataset")
-    # 检查权限
-    if dataset.owner_id != current_user.id:
-        raise PermissionDeniedException()
-    
-    # 执行查询
-    result = execute_query(dataset.file_path, dataset.file_type.lower())
-    columns, data, row_count = result['columns'], result['data'], result['row_count']
-    
-    return {
-        "columns": columns,
-        "data": data,
-        "row_count": row_count
-    }
+    """执行查询，根据Accept请求头返回按行JSON（默认）、按列JSON或Arrow IPC流；
+    结果按数据集内容、规范化的查询和输出格式缓存，If-None-Match匹配时返回304"""
+    dataset, spec, join_sources = await run_in_threadpool(resolve_query, db, query_req, current_user)
+    result_format = negotiate_format(accept)
+    key = query_key(
+        dataset.file_path, spec, query_req.offset, query_req.page_size, result_format, query_req.sampling, join_sources
+    )
+    etag = make_etag(key)
+    if etag_matches(if_none_match, etag):
+        return cached_response(None, etag)
+
+    entry = await run_in_threadpool(result_cache.get, key)
+    if entry is None:
+        # 执行查询，结果在进程池中直接编码为响应内容，跳过逐行构造字典和pydantic校验
+        try:
+            entry = await run_heavy(
+                render_query, dataset.file_path, dataset.file_type.lower(), query_req.query_string,
+                query_req.offset, query_req.page_size, result_format, query_req.sampling, join_sources
+            )
+        except QueryError as e:
+            raise InvalidQueryException(str(e))
+        await run_in_threadpool(result_cache.put, key, entry)
+
+    return cached_response(entry, etag, accept_encoding)
+
+@router.post("/batch", response_model=BatchResult)
+async def run_batch(
+    batch_req: BatchRequest,
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """一次获取仪表盘上的多个图表和查询结果，按请求顺序返回每项的状态和内容：
+    每个数据集只读取一次，不同数据集并发计算，已缓存的结果直接复用"""
+    items = batch_req.items
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise InvalidQueryException(f"A batch can contain at most {settings.BATCH_MAX_ITEMS} items")
+    result_format = negotiate_format(accept)
+    if result_format == ARROW_STREAM_MEDIA_TYPE:
+        # 多项结果合并在一个JSON响应中
+        result_format = ROWS_JSON_MEDIA_TYPE
+
+    visualizations, datasets = await run_in_threadpool(load_batch_objects, db, items)
+
+    parts: List[Optional[bytes]] = [None] * len(items)
+    resolved: List[Tuple[int, Dataset, Tuple[str, str], BatchTask]] = []
+    for index, item in enumerate(items):
+        try:
+            resolved.append((index, *resolve_batch_item(item, visualizations, datasets, current_user, result_format)))
+        except HTTPException as e:
+            parts[index] = batch_error(e.status_code, e.detail)
+
+    # 先查结果缓存，未命中的按数据集分组（相同的项只计算一次）
+    cached = await run_in_threadpool(result_cache.get_many, [key for _, _, key, _ in resolved])
+    pending: Dict[str, Dict[Tuple[str, str], Tuple[BatchTask, List[int]]]] = {}
+    file_types: Dict[str, str] = {}
+    for (index, dataset, key, task), entry in zip(resolved, cached):
+        if entry is not None:
+            parts[index] = batch_result(entry)
+            continue
+        file_types[dataset.file_path] = dataset.file_type.lower()
+        group = pending.setdefault(dataset.file_path, {})
+        group.setdefault(key, (task, []))[1].append(index)
+
+    groups = [(file_path, list(group.items())) for file_path, group in pending.items()]
+    outcomes = await asyncio.gather(*(
+        run_heavy(render_batch, file_path, file_types[file_path], [task for _, (task, _) in entries])
+        for file_path, entries in groups
+    ), return_exceptions=True)
+
+    computed = []
+    for (file_path, entries), outcome in zip(groups, outcomes):
+        if isinstance(outcome, BaseException) and not isinstance(outcome, Exception):
+            # 请求被取消等情况
+            raise outcome
+        if isinstance(outcome, Exception) and not isinstance(outcome, HTTPException):
+            # 意外错误只影响该数据集上的各项
+            logger.error("Batch computation failed for %s", file_path, exc_info=outcome)
+        for position, (key, (_, indexes)) in enumerate(entries):
+            if isinstance(outcome, HTTPException):
+                # 并发计算已满等情况，该数据集上的各项都返回相同的错误
+                part = batch_error(outcome.status_code, outcome.detail)
+            elif isinstance(outcome, Exception):
+                part = batch_error(status.HTTP_500_INTERNAL_SERVER_ERROR, "Internal server error")
+            elif isinstance(outcome[position], QueryError):
+                part = batch_error(status.HTTP_400_BAD_REQUEST, str(outcome[position]))
+            else:
+                part = batch_result(outcome[position])
+                computed.append((key, outcome[position]))
+            for index in indexes:
+                parts[index] = part
+    await run_in_threadpool(result_cache.put_many, computed)
+
+    return Response(b'{"results":[' + b",".join(parts) + b"]}", media_type="application/json")
+
+def resolve_query(db: Session, query_req: QueryRequest, current_user: User) -> Tuple[Dataset, QuerySpec, List[JoinSource]]:
+    """查出要查询的数据集和连接的数据集并检查权限，解析查询；在线程池中调用，数据库查询不阻塞事件循环"""
+    dataset = get_queryable_dataset(db, query_req.dataset_id, current_user)
+    try:
+        spec = parse_query(query_req.query_string)
+    except QueryError as e:
+        raise InvalidQueryException(str(e))
+    return dataset, spec, resolve_join_sources(db, spec, current_user)
+
+def load_batch_objects(db: Session, items: List[BatchItem]) -> Tuple[Dict[int, Visualization], Dict[int, Dataset]]:
+    """一次查出批量请求涉及的所有可视化和数据集；在线程池中调用"""
+    visualization_ids = {item.visualization_id for item in items if item.visualization_id is not None}
+    visualizations = {
+        v.id: v for v in db.query(Visualization).filter(Visualization.id.in_(visualization_ids))
+    } if visualization_ids else {}
+    dataset_ids = {item.dataset_id for item in items if item.visualization_id is None and item.dataset_id is not None}
+    dataset_ids |= {v.dataset_id for v in visualizations.values()}
+    dataset_ids |= joined_dataset_ids(items)
+    datasets = {
+        d.id: d for d in db.query(Dataset).filter(Dataset.id.in_(dataset_ids))
+    } if dataset_ids else {}
+    return visualizations, datasets
+
+def resolve_batch_item(
+    item: BatchItem, visualizations: Dict[int, Visualization], datasets: Dict[int, Dataset],
+    current_user: User, result_format: str
+) -> Tuple[Dataset, Tuple[str, str], BatchTask]:
+    """检查批量请求中一项的权限和数据集状态，返回数据集、结果缓存键和计算任务；不满足时抛出与单独请求相同的异常"""
+    visualization = None
+    if item.visualization_id is not None:
+        visualization = visualizations.get(item.visualization_id)
+        if not visualization:
+            raise ResourceNotFoundException("Visualization")
+        if visualization.owner_id != current_user.id:
+            raise PermissionDeniedException()
+        dataset = datasets.get(visualization.dataset_id)
+    elif item.dataset_id is not None and item.query_string is not None:
+        dataset = datasets.get(item.dataset_id)
+    else:
+        raise InvalidQueryException("Batch item requires visualization_id, or dataset_id and query_string")
+    check_queryable(dataset, current_user)
+
+    if visualization is not None:
+        args = (visualization.id, visualization.visualization_type, visualization.config, item.width)
+        return dataset, chart_key(dataset.file_path, *args), BatchTask("chart", args)
+
+    try:
+        spec = parse_query(item.query_string)
+    except QueryError as e:
+        raise InvalidQueryException(str(e))
+    join_sources = [join_source(datasets.get(join.dataset_id), current_user) for join in spec.joins]
+    key = query_key(dataset.file_path, spec, item.offset, item.page_size, result_format, item.sampling, join_sources)
+    args = (item.query_string, item.offset, item.page_size, result_format, item.sampling, join_sources)
+    return dataset, key, BatchTask("query", args)
+
+def joined_dataset_ids(items: List[BatchItem]) -> Set[int]:
+    """批量请求中的查询连接的数据集，与其他数据集一起查出；无法解析的查询留给resolve_batch_item报错"""
+    dataset_ids = set()
+    for item in items:
+        if item.visualization_id is None and item.query_string is not None:
+            try:
+                dataset_ids |= {join.dataset_id for join in parse_query(item.query_string).joins}
+            except QueryError:
+                pass
+    return dataset_ids
+
+@router.post("/query/stream")
+async def stream_query(
+    query_req: QueryRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """以NDJSON格式流式返回全部查询结果，每行一条记录；抽样查询的抽样比例在响应头中"""
+    dataset, spec, join_sources = await run_in_threadpool(resolve_query, db, query_req, current_user)
+
+    # 流式查询在整个响应期间占用一个重任务名额，批次在线程池中读取
+    await heavy_jobs.acquire()
+    headers = {}
+    try:
+        if query_req.sampling is not None:
+            # 样本很小，一次计算完再分批编码
+            result, sampling_ratio = await run_in_threadpool(
+                query_sample, dataset.file_path, dataset.file_type.lower(), spec, query_req.sampling
+            )
+            headers = sampling_headers(sampling_ratio)
+            batches = iter_frame_batches(result)
+        else:
+            batches = iter_query_batches(
+                dataset.file_path, dataset.file_type.lower(), query_req.query_string, join_sources=join_sources
+            )
+        # 先取出第一批，查询错误可以在响应开始前以400返回
+        first = await run_in_threadpool(next, batches, None)
+    except QueryError as e:
+        heavy_jobs.release()
+        raise InvalidQueryException(str(e))
+    except BaseException:
+        heavy_jobs.release()
+        raise
+
+    return StreamingResponse(
+        iter_ndjson(first, batches),
+        media_type="application/x-ndjson",
+        headers=headers
+    )
+
+async def iter_ndjson(first, batches) -> AsyncIterator[str]:
+    """将DataFrame批次逐批编码为NDJSON，结束（或客户端断开）后释放重任务名额"""
+    try:
+        batch = first
+        while batch is not None:
+            yield await run_in_threadpool(encode_ndjson, batch)
+            batch = await run_in_threadpool(next, batches, None)
+    finally:
+        heavy_jobs.release()
+
+def encode_ndjson(batch) -> str:
+    return batch.to_json(orient="records", lines=True, date_format="iso", force_ascii=False)
 
 @router.get("/saved-queries", response_model=SavedQueryList)
-async def get_saved_queries(
-    skip: int = 0,
-    limit: int = 100,
+def get_saved_queries(
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
     dataset_id: int = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
@@ -55,13 +275,11 @@ async def get_saved_queries(
     if dataset_id:
         query = query.filter(SavedQuery.dataset_id == dataset_id)
     
-    saved_queries = query.offset(skip).limit(limit).all()
-    total = query.count()
-    
-    return {"items": saved_queries, "total": total}
+    # 一条SQL返回当前页和总数
+    return keyset_page(query, SavedQuery, cursor, limit)
 
 @router.post("/saved-queries", response_model=SavedQueryResponse)
-async def create_saved_query(
+def create_saved_query(
     query_in: SavedQueryCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
@@ -1,35 +1,109 @@
+import threading
+import time
+from datetime import datetime, timezone
+from cachetools import TLRUCache, TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import NamedTuple, Optional
 
 from app.core.config import settings
 from app.core.exceptions import CredentialsException, UserNotFoundException
-from app.db.session import get_db
+from app.core.security import token_id
+from app.db.session import get_db, SessionLocal
+from app.models.token import RevokedToken
 from app.models.user import User
-from app.schemas.user import TokenData
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
-async def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
-) -> User:
+# 令牌subject（用户ID）-> 用户各列的值；用户状态变化最多延迟USER_CACHE_TTL秒生效
+_user_cache: TTLCache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+_user_cache_lock = threading.Lock()
+
+class TokenPrincipal(NamedTuple):
+    """验证通过的令牌：所属用户、吊销标识和过期时间（Unix时间戳）"""
+    user_id: int
+    jti: str
+    expires_at: float
+
+def token_expiry(token: str, principal: TokenPrincipal, now: float) -> float:
+    # 缓存条目在令牌过期时失效，且最多保留TOKEN_CACHE_TTL秒
+    return min(principal.expires_at, now + settings.TOKEN_CACHE_TTL)
+
+# 令牌 -> TokenPrincipal，命中时跳过签名校验和吊销查询；条目数超出上限时淘汰最久未使用的
+_token_cache: TLRUCache = TLRUCache(maxsize=settings.TOKEN_CACHE_SIZE, ttu=token_expiry, timer=time.time)
+_token_cache_lock = threading.Lock()
+
+def load_user(db: Session, user_id: int) -> Optional[User]:
+    """按ID读取用户，优先使用短时缓存；返回的是不属于任何会话的User对象，只能读取列属性"""
+    with _user_cache_lock:
+        values = _user_cache.get(user_id)
+    if values is None:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            return None
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        with _user_cache_lock:
+            _user_cache[user_id] = values
+    return User(**values)
+
+def verify_token(db: Session, token: str) -> TokenPrincipal:
+    """校验令牌签名、过期时间和吊销状态，结果缓存到令牌过期"""
+    with _token_cache_lock:
+        principal = _token_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id: Optional[int] = int(payload.get("sub"))
-        if user_id is None:
-            raise CredentialsException()
-        token_data = TokenData(user_id=user_id)
-    except JWTError:
+        principal = TokenPrincipal(int(payload["sub"]), token_id(token, payload), float(payload["exp"]))
+    except (JWTError, KeyError, TypeError, ValueError):
         raise CredentialsException()
-    
-    user = db.query(User).filter(User.id == token_data.user_id).first()
+    if db.query(RevokedToken.jti).filter(RevokedToken.jti == principal.jti).first() is not None:
+        raise CredentialsException()
+
+    with _token_cache_lock:
+        _token_cache[token] = principal
+    return principal
+
+def revoke_token(db: Session, token: str) -> None:
+    """吊销令牌并移出缓存，同时清理已过期的吊销记录"""
+    principal = verify_token(db, token)
+    now = datetime.now(timezone.utc)
+    db.query(RevokedToken).filter(RevokedToken.expires_at < now).delete(synchronize_session=False)
+    db.merge(RevokedToken(
+        jti=principal.jti,
+        user_id=principal.user_id,
+        expires_at=datetime.fromtimestamp(principal.expires_at, timezone.utc),
+    ))
+    db.commit()
+    with _token_cache_lock:
+        _token_cache.pop(token, None)
+
+def get_current_user(
+    db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
+) -> User:
+    principal = verify_token(db, token)
+    user = load_user(db, principal.user_id)
     if not user:
         raise UserNotFoundException()
     return user
 
-async def get_current_active_user(
+def is_admin(user: User) -> bool:
+    return user.email == settings.FIRST_SUPERUSER or user.email in settings.ADMIN_EMAILS
+
+def authorize_admin(token: str) -> bool:
+    """令牌有效且属于已启用的管理员时返回True，用于中间件中的诊断功能（不抛出认证异常）"""
+    with SessionLocal() as db:
+        try:
+            principal = verify_token(db, token)
+        except HTTPException:
+            return False
+        user = load_user(db, principal.user_id)
+    return user is not None and user.is_active and is_admin(user)
+
+def get_current_active_user(
     current_user: User = Depends(get_current_user),
 ) -> User:
     if not current_user.is_active:
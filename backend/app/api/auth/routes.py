@@ -1,26 +1,31 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from datetime import timedelta
+from typing import Optional
 
-from app.api.auth.dependencies import get_current_active_user
+from app.api.auth.dependencies import get_current_active_user, oauth2_scheme, revoke_token
 from app.core.config import settings
 from app.core.exceptions import CredentialsException, DuplicateResourceException
-from app.core.security import create_access_token, get_password_hash, verify_password
+from app.core.security import create_access_token, get_password_hash_async, verify_password_async
 from app.db.session import get_db
 from app.models.user import User
 from app.schemas.user import UserCreate, UserResponse, Token
 
 router = APIRouter()
 
+def find_user(db: Session, email: str) -> Optional[User]:
+    return db.query(User).filter(User.email == email).first()
+
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
-    # 查找用户
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    # 查找用户；密码校验在受限的线程中执行，不阻塞事件循环也不占满线程池
+    user = await run_in_threadpool(find_user, db, form_data.username)
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise CredentialsException()
 
     # 创建访问令牌
@@ -32,6 +37,11 @@ async def login(
 
 @router.post("/register", response_model=UserResponse)
 async def register(user_in: UserCreate, db: Session = Depends(get_db)):
+    await run_in_threadpool(check_new_user, db, user_in)
+    hashed_password = await get_password_hash_async(user_in.password)
+    return await run_in_threadpool(create_user, db, user_in, hashed_password)
+
+def check_new_user(db: Session, user_in: UserCreate) -> None:
     # 检查邮箱是否已存在
     existing_user = db.query(User).filter(User.email == user_in.email).first()
     if existing_user:
@@ -41,9 +51,8 @@ async def register(user_in: UserCreate, db: Session = Depends(get_db)):
     existing_username = db.query(User).filter(User.username == user_in.username).first()
     if existing_username:
         raise DuplicateResourceException(detail="Username already taken")
-    
-    # 创建新用户
-    hashed_password = get_password_hash(user_in.password)
+
+def create_user(db: Session, user_in: UserCreate, hashed_password: str) -> User:
     db_user = User(
         email=user_in.email,
         username=user_in.username,
@@ -56,11 +65,15 @@ async def register(user_in: UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 @router.post("/logout")
-async def logout(current_user: User = Depends(get_current_active_user)):
-    # FastAPI JWT实现中，服务器不保存令牌状态
-    # 客户端应删除令牌实现登出
+def logout(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    # 吊销当前令牌，之后使用该令牌的请求返回401
+    revoke_token(db, token)
     return {"detail": "Successfully logged out"}
 
 @router.get("/profile", response_model=UserResponse)
-async def get_user_profile(current_user: User = Depends(get_current_active_user)):
+def get_user_profile(current_user: User = Depends(get_current_active_user)):
     return current_user
\ No newline at end of file
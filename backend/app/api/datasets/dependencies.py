@@ -0,0 +1,52 @@
+from sqlalchemy.orm import Session
+from typing import List, Optional
+
+from app.core.exceptions import ResourceNotFoundException, PermissionDeniedException, DatasetNotReadyException
+from app.models.dataset import Dataset
+from app.models.rollup import Rollup
+from app.models.user import User
+from app.schemas.dataset import RollupResponse
+from app.schemas.query import QuerySpec
+from app.utils.data_processor import get_columnar_path
+from app.utils.ingestion import DATASET_READY
+from app.utils.joins import JoinSource
+from app.utils.rollups import stored_rollup, rollup_rows
+
+def check_queryable(dataset: Optional[Dataset], current_user: User) -> Dataset:
+    """检查要查询的数据集存在、属于当前用户且已导入完成，不满足时抛出异常"""
+    if not dataset:
+        raise ResourceNotFoundException("Dataset")
+    if dataset.owner_id != current_user.id:
+        raise PermissionDeniedException()
+    if dataset.status != DATASET_READY:
+        raise DatasetNotReadyException()
+    return dataset
+
+def get_queryable_dataset(db: Session, dataset_id: int, current_user: User) -> Dataset:
+    """按ID查出要查询的数据集并检查，不满足时抛出异常"""
+    return check_queryable(db.query(Dataset).filter(Dataset.id == dataset_id).first(), current_user)
+
+def join_source(dataset: Optional[Dataset], current_user: User) -> JoinSource:
+    """检查连接的数据集，不满足时抛出与直接查询该数据集相同的异常"""
+    dataset = check_queryable(dataset, current_user)
+    return JoinSource(dataset.file_path, dataset.file_type.lower())
+
+def resolve_join_sources(db: Session, spec: QuerySpec, current_user: User) -> List[JoinSource]:
+    """查询中连接的数据集的存储位置，顺序与spec.joins一致"""
+    if not spec.joins:
+        return []
+    dataset_ids = {join.dataset_id for join in spec.joins}
+    datasets = {d.id: d for d in db.query(Dataset).filter(Dataset.id.in_(dataset_ids))}
+    return [join_source(datasets.get(join.dataset_id), current_user) for join in spec.joins]
+
+def rollup_response(dataset: Dataset, rollup: Rollup) -> RollupResponse:
+    """预聚合的定义和它在数据集当前版本上的物化状态"""
+    definition = stored_rollup(rollup)
+    return RollupResponse(
+        id=rollup.id,
+        dataset_id=rollup.dataset_id,
+        dimensions=definition.dimensions,
+        measures=definition.measures,
+        row_count=rollup_rows(get_columnar_path(dataset.file_path), rollup.digest),
+        created_at=rollup.created_at,
+    )
@@ -1,31 +1,58 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
+from fastapi.responses import StreamingResponse
 from pydantic import ValidationError, parse_raw_as
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple
 
 from app.api.auth.dependencies import get_current_active_user
-from app.core.exceptions import ResourceNotFoundException, PermissionDeniedException
+from app.api.datasets.dependencies import get_queryable_dataset, resolve_join_sources, rollup_response
+from app.core.exceptions import (
+    ResourceNotFoundException, PermissionDeniedException, DatasetNotReadyException,
+    DuplicateResourceException, InvalidQueryException
+)
 from app.db.session import get_db
 from app.models.dataset import Dataset
+from app.models.job import IngestionJob
+from app.models.rollup import Rollup
 from app.models.user import User
 from app.schemas.dataset import (
-    DatasetCreate, DatasetUpdate, DatasetResponse, DatasetList
+    DatasetCreate, DatasetUpdate, DatasetResponse, DatasetList, DatasetStats, IngestionJobResponse,
+    DerivedDatasetCreate, RollupCreate, RollupResponse
+)
+from app.utils.executor import run_heavy
+from app.utils.file_handler import (
+    validate_file_extension, save_upload_file, release_stored_file, derive_dataset, get_derived_path,
+    materialize_rollup, release_rollup, DERIVED_FILE_TYPE
+)
+from app.utils.query_engine import QueryError, parse_query
+from app.utils.pagination import keyset_page
+from app.utils.joins import JoinSource
+from app.utils.readers import with_sheet
+from app.utils.data_processor import get_columnar_path
+from app.utils.rollups import normalize_rollup, rollup_digest, rollup_rows, invalidate_rollups
+from app.utils.ingestion import (
+    ingestion_queue, create_job, create_completed_job, create_append_job, get_latest_job, iter_job_events,
+    DATASET_READY, DATASET_PROCESSING
 )
-from app.utils.file_handler import validate_file_extension, save_upload_file, get_file_info
 
 router = APIRouter()
 
 @router.get("", response_model=DatasetList)
-async def get_datasets(
+def get_datasets(
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    datasets = db.query(Dataset).filter(Dataset.owner_id == current_user.id).all()
-    total = db.query(Dataset).filter(Dataset.owner_id == current_user.id).count()
-    return {"items": datasets, "total": total}
+    """按创建顺序分页列出数据集，下一页传入上一页返回的next_cursor"""
+    query = db.query(Dataset).filter(Dataset.owner_id == current_user.id)
+    return keyset_page(query, Dataset, cursor, limit)
 
 @router.get("/{id}", response_model=DatasetResponse)
-async def get_dataset(
+def get_dataset(
     id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
@@ -41,6 +68,31 @@ async def get_dataset(
     
     return dataset
 
+@router.get("/{id}/stats", response_model=DatasetStats)
+def get_dataset_stats(
+    id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """返回上传时预先计算的列统计信息，不读取数据文件"""
+    dataset = db.query(Dataset).filter(Dataset.id == id).first()
+
+    if not dataset:
+        raise ResourceNotFoundException("Dataset")
+
+    # 检查权限
+    if dataset.owner_id != current_user.id:
+        raise PermissionDeniedException()
+    if dataset.status != DATASET_READY:
+        raise DatasetNotReadyException()
+
+    columns_info = json.loads(dataset.columns_info) if dataset.columns_info else []
+    return {
+        "dataset_id": dataset.id,
+        "row_count": dataset.row_count,
+        "columns": columns_info
+    }
+
 @router.post("", response_model=DatasetResponse)
 async def create_dataset(
     # 1. 先以字符串形式接收 dataset_in 字段
@@ -59,30 +111,279 @@ async def create_dataset(
     if not validate_file_extension(file.filename):
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    # 保存文件
-    file_path = await save_upload_file(file)
+    # 保存文件（按内容去重）
+    file_path, content_hash = await save_upload_file(file)
     file_type = file.filename.split('.')[-1].lower()
-    
-#     # 获取文件信息
-    row_count, columns_info = get_file_info(file_path,file_type)
-    
-    # 创建数据集记录（现在包含文件信息）
+    if file_type in ('xlsx', 'xls'):
+        file_path = with_sheet(file_path, dataset_in.sheet)
+
     db_dataset = Dataset(
         name=dataset_in.name,
         description=dataset_in.description,
         owner_id=current_user.id,
         file_path=file_path,
         file_type=file_type,
-        row_count=row_count,
-        columns_info=columns_info
+        content_hash=content_hash
     )
+    job = await run_in_threadpool(register_dataset, db, db_dataset)
+    if job is not None:
+        ingestion_queue.submit(job.id)
+    
+    return db_dataset
+
+def register_dataset(db: Session, db_dataset: Dataset) -> Optional[IngestionJob]:
+    """保存上传的数据集，返回需要执行的导入任务；在线程池中调用，数据库操作不阻塞事件循环"""
+    # 相同内容已经导入过时直接复用列信息和统计，不再解析
+    existing = db.query(Dataset).filter(
+        Dataset.file_path == db_dataset.file_path, Dataset.status == DATASET_READY
+    ).first()
+    job = None
+    if existing:
+        db_dataset.row_count = existing.row_count
+        db_dataset.columns_info = existing.columns_info
+        db_dataset.status = DATASET_READY
+        create_completed_job(db, db_dataset)
+    else:
+        # 解析、转换为列式存储和统计由后台导入任务完成
+        job = create_job(db, db_dataset)
     
     db.add(db_dataset)
     db.commit()
     db.refresh(db_dataset)
-    
+    return job
+
+@router.post("/derived", response_model=DatasetResponse)
+async def create_derived_dataset(
+    dataset_in: DerivedDatasetCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """把数据集上的查询（可以包含与其他数据集的连接）的完整结果保存为新数据集，
+    之后可以像上传的数据集一样查询、绘图和追加，不必每次重新连接"""
+    source, join_sources, db_dataset = await run_in_threadpool(start_derived_dataset, db, dataset_in, current_user)
+
+    file_path = get_derived_path(db_dataset.id)
+    try:
+        row_count, columns_info = await run_heavy(
+            derive_dataset, source.file_path, source.file_type.lower(), dataset_in.query_string, join_sources, file_path
+        )
+    except QueryError as e:
+        await run_in_threadpool(discard_dataset, db, db_dataset)
+        raise InvalidQueryException(str(e))
+    except BaseException:
+        # 计算失败或请求被取消时不保留未完成的数据集；删除不随请求一起被取消
+        await asyncio.shield(run_in_threadpool(discard_dataset, db, db_dataset))
+        raise
+
+    db_dataset.file_path = file_path
+    db_dataset.row_count = row_count
+    db_dataset.columns_info = columns_info
+    db_dataset.status = DATASET_READY
+    await run_in_threadpool(save_dataset, db, db_dataset)
     return db_dataset
 
+def start_derived_dataset(
+    db: Session, dataset_in: DerivedDatasetCreate, current_user: User
+) -> Tuple[Dataset, List[JoinSource], Dataset]:
+    """检查查询的数据集和连接的数据集，先创建记录取得ID（文件写在数据集自己的目录中）；在线程池中调用"""
+    source = get_queryable_dataset(db, dataset_in.dataset_id, current_user)
+    try:
+        spec = parse_query(dataset_in.query_string)
+    except QueryError as e:
+        raise InvalidQueryException(str(e))
+    join_sources = resolve_join_sources(db, spec, current_user)
+
+    db_dataset = Dataset(
+        name=dataset_in.name,
+        description=dataset_in.description,
+        owner_id=current_user.id,
+        file_path="",
+        file_type=DERIVED_FILE_TYPE,
+        status=DATASET_PROCESSING
+    )
+    save_dataset(db, db_dataset)
+    return source, join_sources, db_dataset
+
+def save_dataset(db: Session, db_dataset: Dataset) -> None:
+    db.add(db_dataset)
+    db.commit()
+    db.refresh(db_dataset)
+
+def discard_dataset(db: Session, db_dataset: Dataset) -> None:
+    db.delete(db_dataset)
+    db.commit()
+
+@router.post("/{id}/append", response_model=IngestionJobResponse)
+async def append_dataset(
+    id: int,
+    file: UploadFile = File(...),
+    sheet: Optional[str] = Form(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """把文件中的行追加到数据集：后台任务只解析新增的行并写成新的列式分片，完成后数据集版本号加1；
+    文件的列须是数据集已有的列（缺少的列为空值）"""
+    dataset = await run_in_threadpool(check_appendable, db, id, current_user)
+
+    if not validate_file_extension(file.filename):
+        raise HTTPException(status_code=400, detail="Invalid file type")
+
+    append_path, _ = await save_upload_file(file)
+    append_type = file.filename.split('.')[-1].lower()
+    if append_type in ('xlsx', 'xls'):
+        append_path = with_sheet(append_path, sheet)
+
+    job = await run_in_threadpool(register_append, db, dataset, append_path, append_type)
+    ingestion_queue.submit(job.id)
+    return job
+
+def check_appendable(db: Session, id: int, current_user: User) -> Dataset:
+    """检查数据集可以追加数据；在线程池中调用"""
+    dataset = get_queryable_dataset(db, id, current_user)
+    # 同一数据集的追加依次进行，每次都基于上一个版本
+    running = db.query(IngestionJob).filter(
+        IngestionJob.dataset_id == dataset.id, IngestionJob.finished_at.is_(None)
+    ).first()
+    if running:
+        raise DuplicateResourceException("Dataset already has an ingestion job in progress")
+    return dataset
+
+def register_append(db: Session, dataset: Dataset, append_path: str, append_type: str) -> IngestionJob:
+    """创建追加任务；在线程池中调用"""
+    job = create_append_job(db, dataset, append_path, append_type)
+    db.commit()
+    db.refresh(job)
+    return job
+
+@router.get("/{id}/rollups", response_model=List[RollupResponse])
+def get_rollups(
+    id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """列出数据集声明的预聚合，row_count为空表示当前版本上尚未物化（查询时回退为扫描数据集）"""
+    dataset = db.query(Dataset).filter(Dataset.id == id).first()
+
+    if not dataset:
+        raise ResourceNotFoundException("Dataset")
+
+    # 检查权限
+    if dataset.owner_id != current_user.id:
+        raise PermissionDeniedException()
+
+    return [rollup_response(dataset, rollup) for rollup in dataset.rollups]
+
+@router.post("/{id}/rollups", response_model=RollupResponse)
+async def create_rollup(
+    id: int,
+    rollup_in: RollupCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """声明数据集的预聚合（维度 × 度量的sum/count/min/max）并立即物化，之后每次追加数据时随新版本重新计算；
+    分组列和过滤列都在维度中的查询和柱状图、饼图直接在预聚合表上计算。
+    相同的定义只保存一次，重复声明时补建当前版本缺少的预聚合表"""
+    dataset = await run_in_threadpool(get_queryable_dataset, db, id, current_user)
+    try:
+        rollup = normalize_rollup(rollup_in)
+    except QueryError as e:
+        raise InvalidQueryException(str(e))
+    digest = rollup_digest(rollup)
+
+    # 其他数据集共享同一文件并声明过相同的预聚合时已经物化
+    if await run_in_threadpool(rollup_rows, get_columnar_path(dataset.file_path), digest) is None:
+        try:
+            await run_heavy(materialize_rollup, dataset.file_path, dataset.file_type.lower(), rollup)
+        except QueryError as e:
+            raise InvalidQueryException(str(e))
+        # 物化可能在进程池中执行，本进程缓存的列表需要单独清除
+        invalidate_rollups(get_columnar_path(dataset.file_path))
+    return await run_in_threadpool(save_rollup, db, dataset, rollup, digest)
+
+def save_rollup(db: Session, dataset: Dataset, rollup: RollupCreate, digest: str) -> RollupResponse:
+    """保存预聚合的定义（已有相同定义时复用）；在线程池中调用"""
+    db_rollup = db.query(Rollup).filter(Rollup.dataset_id == dataset.id, Rollup.digest == digest).first()
+    if db_rollup is None:
+        db_rollup = Rollup(
+            dataset_id=dataset.id,
+            dimensions=json.dumps(rollup.dimensions),
+            measures=json.dumps([measure.dict() for measure in rollup.measures]),
+            digest=digest
+        )
+        db.add(db_rollup)
+        db.commit()
+        db.refresh(db_rollup)
+    return rollup_response(dataset, db_rollup)
+
+@router.delete("/{id}/rollups/{rollup_id}")
+def delete_rollup(
+    id: int,
+    rollup_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    dataset = db.query(Dataset).filter(Dataset.id == id).first()
+
+    if not dataset:
+        raise ResourceNotFoundException("Dataset")
+
+    # 检查权限
+    if dataset.owner_id != current_user.id:
+        raise PermissionDeniedException()
+
+    rollup = db.query(Rollup).filter(Rollup.id == rollup_id, Rollup.dataset_id == dataset.id).first()
+    if not rollup:
+        raise ResourceNotFoundException("Rollup")
+    db.delete(rollup)
+    db.commit()
+
+    # 其他数据集共享同一文件并声明了相同的预聚合时保留文件
+    release_rollup(db, dataset.file_path, rollup.digest)
+    return {"detail": "Rollup deleted successfully"}
+
+@router.get("/{id}/job", response_model=IngestionJobResponse)
+def get_dataset_job(
+    id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """查询数据集导入任务的状态、进度和错误信息"""
+    dataset = db.query(Dataset).filter(Dataset.id == id).first()
+
+    if not dataset:
+        raise ResourceNotFoundException("Dataset")
+
+    # 检查权限
+    if dataset.owner_id != current_user.id:
+        raise PermissionDeniedException()
+
+    job = get_latest_job(dataset.id)
+    if job is None:
+        raise ResourceNotFoundException("Ingestion job")
+    return job
+
+@router.get("/{id}/job/events")
+def stream_dataset_job(
+    id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """以Server-Sent Events推送导入任务的进度，任务完成或失败后结束"""
+    dataset = db.query(Dataset).filter(Dataset.id == id).first()
+
+    if not dataset:
+        raise ResourceNotFoundException("Dataset")
+
+    # 检查权限
+    if dataset.owner_id != current_user.id:
+        raise PermissionDeniedException()
+
+    return StreamingResponse(
+        iter_job_events(dataset.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # @router.post("", response_model=DatasetResponse)
 # async def create_dataset(
 #     dataset_in: DatasetCreate,
@@ -141,7 +442,7 @@ async def create_dataset(
 #     return dataset
 
 @router.put("/{id}", response_model=DatasetResponse)
-async def update_dataset(
+def update_dataset(
     id: int,
     dataset_in: DatasetUpdate,
     db: Session = Depends(get_db),
@@ -167,7 +468,7 @@ async def update_dataset(
     return dataset
 
 @router.delete("/{id}")
-async def delete_dataset(
+def delete_dataset(
     id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
@@ -181,9 +482,17 @@ async def delete_dataset(
     if dataset.owner_id != current_user.id:
         raise PermissionDeniedException()
     
-    # 删除数据集
+    # 删除数据集（未完成的追加任务一并删除）
+    append_paths = [job.append_path for job in dataset.jobs if job.append_path and job.finished_at is None]
+    rollup_digests = [rollup.digest for rollup in dataset.rollups]
     db.delete(dataset)
     db.commit()
+
+    # 文件由内容相同的数据集共享，最后一个引用删除后才删除文件并清除缓存
+    for digest in rollup_digests:
+        release_rollup(db, dataset.file_path, digest)
+    for path in [dataset.file_path] + append_paths:
+        release_stored_file(db, path)
     
     return {"detail": "Dataset deleted successfully"}
 
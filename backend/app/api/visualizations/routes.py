@@ -5,26 +5,37 @@ from typing import List
 from app.api.auth.dependencies import get_current_active_user
 from app.core.exceptions import ResourceNotFoundException, PermissionDeniedException
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Query
 from sqlalchemy.orm import Session
-from typing import List
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 
 from app.api.auth.dependencies import get_current_active_user
-from app.core.exceptions import ResourceNotFoundException, PermissionDeniedException
+from app.core.exceptions import (
+    ResourceNotFoundException, PermissionDeniedException, InvalidQueryException,
+    DatasetNotReadyException
+)
 from app.db.session import get_db
 from app.models.visualization import Visualization
 from app.models.dataset import Dataset
 from app.models.user import User
 from app.schemas.visualization import (
-    VisualizationCreate, VisualizationUpdate, VisualizationResponse, VisualizationList
+    VisualizationCreate, VisualizationUpdate, VisualizationResponse, VisualizationList,
+    VisualizationData
 )
+from app.utils.cache import result_cache
+from app.utils.executor import run_heavy
+from app.utils.ingestion import DATASET_READY
+from app.utils.pagination import keyset_page
+from app.utils.query_engine import QueryError
+from app.utils.serializers import render_chart, chart_key, cached_response, make_etag, etag_matches
 
 router = APIRouter()
 
 @router.get("", response_model=VisualizationList)
-async def get_visualizations(
-    skip: int = 0,
-    limit: int = 100,
+def get_visualizations(
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
     dataset_id: int = None,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
@@ -35,13 +46,11 @@ async def get_visualizations(
     if dataset_id:
         query = query.filter(Visualization.dataset_id == dataset_id)
     
-    visualizations = query.offset(skip).limit(limit).all()
-    total = query.count()
-    
-    return {"items": visualizations, "total": total}
+    # 一条SQL返回当前页和总数
+    return keyset_page(query, Visualization, cursor, limit)
 
 @router.get("/{id}", response_model=VisualizationResponse)
-async def get_visualization(
+def get_visualization(
     id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
@@ -57,8 +66,53 @@ async def get_visualization(
     
     return visualization
 
+@router.get("/{id}/data", response_model=VisualizationData)
+async def get_visualization_data(
+    id: int,
+    width: Optional[int] = Query(None, ge=1, le=20000),
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """在服务端按可视化配置聚合/降采样数据，width为图表像素宽度；结果按数据集内容和配置缓存"""
+    visualization = db.query(Visualization).filter(Visualization.id == id).first()
+
+    if not visualization:
+        raise ResourceNotFoundException("Visualization")
+
+    # 检查权限
+    if visualization.owner_id != current_user.id:
+        raise PermissionDeniedException()
+
+    dataset = visualization.dataset
+    if not dataset:
+        raise ResourceNotFoundException("Dataset")
+    if dataset.status != DATASET_READY:
+        raise DatasetNotReadyException()
+
+    key = chart_key(
+        dataset.file_path, visualization.id, visualization.visualization_type, visualization.config, width
+    )
+    etag = make_etag(key)
+    if etag_matches(if_none_match, etag):
+        return cached_response(None, etag)
+
+    entry = await run_in_threadpool(result_cache.get, key)
+    if entry is None:
+        try:
+            entry = await run_heavy(
+                render_chart, dataset.file_path, dataset.file_type.lower(), visualization.id,
+                visualization.visualization_type, visualization.config, width
+            )
+        except QueryError as e:
+            raise InvalidQueryException(str(e))
+        await run_in_threadpool(result_cache.put, key, entry)
+
+    return cached_response(entry, etag, accept_encoding)
+
 @router.post("", response_model=VisualizationResponse)
-async def create_visualization(
+def create_visualization(
     visualization_in: VisualizationCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
@@ -89,7 +143,7 @@ async def create_visualization(
     return db_visualization
 
 @router.put("/{id}", response_model=VisualizationResponse)
-async def update_visualization(
+def update_visualization(
     id: int,
     visualization_in: VisualizationUpdate,
     db: Session = Depends(get_db),
@@ -123,7 +177,7 @@ async def update_visualization(
     return visualization
 
 @router.delete("/{id}")
-async def delete_visualization(
+def delete_visualization(
     id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
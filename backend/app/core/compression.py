@@ -0,0 +1,98 @@
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.utils.codecs import CODECS, StreamCompressor, is_compressible, negotiate_encoding
+from app.utils.tracing import span
+
+class CompressionMiddleware:
+    """按Accept-Encoding压缩响应（zstd/br/gzip，取决于客户端和已安装的包）：
+    - 已带Content-Encoding的响应（预先压缩的缓存结果）原样发送
+    - 单块响应小于 COMPRESSION_MIN_SIZE 时不压缩
+    - 流式响应（NDJSON、SSE）逐块压缩并立即刷新，客户端可以边收边解压
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressionResponder(send, encoding)
+        await self.app(scope, receive, responder.send)
+
+class CompressionResponder:
+    def __init__(self, send: Send, encoding: str):
+        self._send = send
+        self.encoding = encoding
+        self.start: Optional[Message] = None
+        self.compressor: Optional[StreamCompressor] = None
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # 响应头要等到第一块响应体，确定是否压缩后再发送
+            self.start = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        if self.start is not None:
+            start, self.start = message_start(self.start), None
+            message = self.decide(start, message)
+            await self._send(start)
+
+        if self.compressor is None:
+            await self._send(message)
+            return
+
+        # 每块的压缩耗时分别计入同一阶段，避免把等待下一块的时间算进去
+        with span("encode.compress"):
+            body = self.compressor.compress(message.get("body", b""))
+            if not message.get("more_body", False):
+                body += self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": body, "more_body": message.get("more_body", False)})
+
+    def decide(self, start: Message, first: Message) -> Message:
+        """根据响应头和第一块响应体决定是否压缩，需要压缩时改写响应头；返回要发送的第一块响应体"""
+        headers = MutableHeaders(scope=start)
+        if not is_compressible(headers.get("content-type")):
+            return first
+        # 压缩与否取决于Accept-Encoding，缓存必须区分
+        vary = [value.strip().lower() for value in headers.get("vary", "").split(",")]
+        if "accept-encoding" not in vary:
+            headers.add_vary_header("Accept-Encoding")
+        if "content-encoding" in headers or start["status"] in (204, 304):
+            return first
+        body = first.get("body", b"")
+        more_body = first.get("more_body", False)
+        if not more_body and len(body) < settings.COMPRESSION_MIN_SIZE:
+            return first
+        if "content-length" in headers and int(headers["content-length"]) < settings.COMPRESSION_MIN_SIZE:
+            return first
+
+        headers["Content-Encoding"] = self.encoding
+        if "content-length" in headers:
+            del headers["content-length"]
+        # 压缩后的字节与原ETag对应的字节不同，改为弱ETag
+        if "etag" in headers and not headers["etag"].startswith("W/"):
+            headers["ETag"] = "W/" + headers["etag"]
+        if more_body:
+            self.compressor = CODECS[self.encoding].stream()
+            return first
+        # 单块响应一次压缩完毕，可以给出准确的Content-Length
+        with span("encode.compress"):
+            compressed = CODECS[self.encoding].compress(body)
+        headers["Content-Length"] = str(len(compressed))
+        return {"type": "http.response.body", "body": compressed, "more_body": False}
+
+def message_start(message: Message) -> Message:
+    """复制响应头，避免修改应用持有的消息"""
+    return {**message, "headers": list(message.get("headers", []))}
@@ -7,21 +7,100 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
     # 默认为60分钟
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    USER_CACHE_TTL: int = 30  # 已认证用户信息的缓存秒数，期间的请求不再查询users表
+    USER_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_SIZE: int = 10000  # 已验证令牌的缓存条数
+    TOKEN_CACHE_TTL: int = 300  # 已验证令牌的最长缓存秒数（不超过令牌过期时间），多进程部署时其他进程的吊销最多延迟这么久生效
+    PASSWORD_HASH_CONCURRENCY: int = 2  # 同时计算bcrypt的线程数上限
     
     # CORS设置
     BACKEND_CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://localhost:8000"]
 
     # SQLite数据库URL
     SQLALCHEMY_DATABASE_URI: str = "sqlite:///./app.db"
+
+    # 数据库连接池设置（内存SQLite数据库不使用连接池）
+    DB_POOL_SIZE: int = 10  # 保持的连接数
+    DB_MAX_OVERFLOW: int = 20  # 连接池满时最多再临时创建的连接数
+    DB_POOL_TIMEOUT: int = 30  # 等待空闲连接的秒数
+    DB_POOL_RECYCLE: int = 1800  # 连接使用超过该秒数后重建，避免被数据库端断开
+    DB_POOL_PRE_PING: bool = True  # 取出连接时检查是否仍然可用
+
+    # SQLite设置
+    SQLITE_BUSY_TIMEOUT: int = 30  # 等待其他连接释放写锁的秒数
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024  # 内存映射读取的字节数
+    SQLITE_CACHE_SIZE: int = -64 * 1024  # 每个连接的页缓存，负数表示KiB
     
     # 初始管理员用户
     FIRST_SUPERUSER: str = "admin@example.com"
     FIRST_SUPERUSER_PASSWORD: str = "admin"
+    ADMIN_EMAILS: List[str] = []  # 其他管理员用户的邮箱，管理员可以使用 ?profile=1 等诊断功能
     
     # 文件上传设置
     UPLOAD_FOLDER: str = "./uploads"
     ALLOWED_EXTENSIONS: set = {"csv", "xlsx", "xls", "json"}
     MAX_CONTENT_LENGTH: int = 16 * 1024 * 1024  # 16MB
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # 上传文件每次读取和写入磁盘的字节数
+    CSV_BLOCK_SIZE: int = 16 * 1024 * 1024  # CSV逐块解析时每块的字节数
+    READER_CHUNK_ROWS: int = 50000  # Excel和JSON逐块读取时每块的行数
+
+    # 列式存储设置（上传时转换为Parquet）
+    COLUMNAR_ROW_GROUP_SIZE: int = 64 * 1024  # 每个行组的行数
+
+    # 数据集缓存设置
+    CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 每个worker进程内缓存的DataFrame总字节数上限
+    SHARED_CACHE_DIR: str = "./cache"  # 各worker共享的内存映射Arrow文件目录
+    SHARED_CACHE_MAX_BYTES: int = 8 * 1024 * 1024 * 1024  # 共享目录总字节数上限
+
+    # 查询结果缓存设置（保存编码后的响应，内存中淘汰的结果写入磁盘）
+    RESULT_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    RESULT_CACHE_DIR: str = "./cache/results"
+    RESULT_CACHE_DISK_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    # 后台导入任务设置
+    INGESTION_WORKERS: int = 2  # 同时处理导入任务的协程数
+    INGESTION_EVENT_INTERVAL: float = 0.5  # SSE推送导入进度时查询任务状态的间隔（秒）
+
+    # 解析和查询等重任务的执行设置
+    PROCESS_POOL_WORKERS: int = 2  # 执行重任务的进程数（每个进程有独立的进程内缓存），为0时改用线程池
+    HEAVY_JOB_LIMIT: int = 4  # 同时执行的重任务上限
+    HEAVY_JOB_QUEUE_SIZE: int = 16  # 排队等待的重任务上限，超出时返回429
+
+    # 查询结果分页与流式响应设置
+    QUERY_DEFAULT_PAGE_SIZE: int = 1000
+    QUERY_MAX_PAGE_SIZE: int = 10000  # 单次响应的最大行数，超出部分需要翻页或使用流式接口
+    QUERY_STREAM_BATCH_SIZE: int = 5000  # 流式响应每批读取和输出的行数
+
+    # 抽样查询设置
+    SAMPLE_SIZES: List[int] = [10000, 100000, 1000000]  # 导入时预先计算的均匀样本行数，只生成小于数据集行数的样本
+    SAMPLE_SEED: int = 0  # 预计算样本的随机种子
+    STRATIFIED_SAMPLE_ROWS: int = 10000  # 分层样本中每层保留的行数，首次按某列分层抽样时生成
+    STRATIFIED_MAX_STRATA: int = 100  # 分层列的不同取值数上限（空值算一层），超出时不能在样本上分层抽样
+
+    # 图表数据服务端聚合与降采样设置
+    CHART_DEFAULT_WIDTH: int = 1000  # 未指定图表像素宽度时使用
+    CHART_POINTS_PER_PIXEL: int = 2  # 折线图每像素保留的点数
+    CHART_MIN_BAR_WIDTH: int = 8  # 柱状图每根柱子的最小像素宽度
+    CHART_PIE_MAX_SLICES: int = 12  # 饼图最多扇区数，其余合并为"Other"
+    BATCH_MAX_ITEMS: int = 50  # 批量获取仪表盘数据时单次请求的最大项数
+
+    # 上传时的列统计信息设置
+    PROFILE_HISTOGRAM_BINS: int = 20  # 数值列直方图的分箱数
+    PROFILE_TOP_VALUES: int = 20  # 类别列保存的高频值个数
+    PROFILE_MAX_CATEGORIES: int = 1000  # 基数超过该值的文本列不保存高频值
+    PROFILE_SAMPLE_SIZE: int = 100000  # 计算分位数和直方图的均匀抽样行数
+    CATEGORY_MAX_RATIO: float = 0.5  # 不同取值数不超过非空行数的该比例时，文本列按类别（字典编码）存储
+
+    # 监控与性能分析设置
+    SLOW_REQUEST_SECONDS: float = 1.0  # 耗时超过该秒数的请求在日志中记录各阶段耗时
+    REQUEST_PROFILE_TOP_FUNCTIONS: int = 40  # ?profile=1 时每段性能分析输出的函数个数
+
+    # 响应压缩设置（zstd和br需要安装zstandard、brotli包，否则只使用gzip）
+    COMPRESSION_MIN_SIZE: int = 1024  # 小于该字节数的响应不压缩
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_ZSTD_LEVEL: int = 3
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    RESULT_CACHE_ENCODING: str = "gzip"  # 缓存结果预先压缩的编码，为空时缓存未压缩的结果
 
     class Config:
         case_sensitive = True
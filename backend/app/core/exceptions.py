@@ -34,4 +34,33 @@ class DuplicateResourceException(HTTPException):
         super().__init__(
             status_code=status.HTTP_409_CONFLICT,
             detail=detail,
+        )
+
+class TooManyRequestsException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": "1"},
+        )
+
+class InvalidQueryException(HTTPException):
+    def __init__(self, detail: str):
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=detail,
+        )
+
+class FileTooLargeException(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the maximum upload size of {max_bytes} bytes",
+        )
+
+class DatasetNotReadyException(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Dataset is not ready yet",
         )
\ No newline at end of file
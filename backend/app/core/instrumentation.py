@@ -0,0 +1,162 @@
+import cProfile
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.db.session import get_pool_status
+from app.utils.cache import result_cache
+from app.utils.executor import heavy_jobs
+from app.utils.ingestion import ingestion_queue
+from app.utils.metrics import (
+    CallbackMetric, REQUEST_LATENCY, REQUESTS, RESPONSE_BYTES, registry
+)
+from app.utils.tracing import Trace, start_trace, end_trace, profile_summary
+
+logger = logging.getLogger(__name__)
+
+# Prometheus文本格式的媒体类型
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4"
+
+class InstrumentationMiddleware:
+    """记录每个请求的耗时、状态码和响应字节数，并为请求建立追踪：
+    - 响应头Server-Timing给出各阶段的累计耗时，慢请求在日志中记录同样的信息
+    - 管理员请求带 ?profile=1 时，用cProfile分析事件循环和进程池中的执行，返回文本报告代替原响应
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes: Optional[Dict[Callable, str]] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(profile=await profile_requested(scope))
+        token = start_trace(trace)
+        started = time.perf_counter()
+        status_code, body_bytes = 500, 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, body_bytes
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("Server-Timing", trace.server_timing(time.perf_counter() - started))
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            # 性能分析时原响应只统计不发送，结束后发送分析报告
+            if not trace.profile:
+                await send(message)
+
+        # 事件循环中的分析会同时包含并发执行的其他请求，只用于诊断
+        profiler = cProfile.Profile() if trace.profile else None
+        try:
+            if profiler is not None:
+                profiler.enable()
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            duration = time.perf_counter() - started
+            end_trace(token)
+            route = self.route_template(scope)
+            REQUEST_LATENCY.observe(duration, method=scope["method"], route=route)
+            REQUESTS.inc(method=scope["method"], route=route, status=status_code)
+            RESPONSE_BYTES.inc(body_bytes, route=route)
+            if duration >= settings.SLOW_REQUEST_SECONDS:
+                logger.warning(
+                    "Slow request %s %s %d %.3fs [%s]", scope["method"], scope["path"], status_code, duration,
+                    trace.server_timing(duration)
+                )
+
+        if profiler is not None:
+            await send_profile_report(send, scope, trace, profiler, status_code, body_bytes, duration)
+
+    def route_template(self, scope: Scope) -> str:
+        """路由模板（如/api/datasets/{id}），避免按实际路径产生大量标签；未匹配路由时为unmatched"""
+        if self._routes is None:
+            self._routes = {}
+            for route in scope["app"].routes:
+                endpoint = getattr(route, "endpoint", None)
+                if endpoint is not None:
+                    self._routes.setdefault(endpoint, route.path)
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+async def profile_requested(scope: Scope) -> bool:
+    """查询参数profile=1且令牌属于管理员；非管理员的请求忽略该参数，按正常请求处理"""
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if query.get("profile", [""])[-1] not in ("1", "true"):
+        return False
+    scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    # 延迟导入，避免认证模块与中间件相互依赖
+    from app.api.auth.dependencies import authorize_admin
+    return await run_in_threadpool(authorize_admin, token)
+
+async def send_profile_report(
+    send: Send, scope: Scope, trace: Trace, profiler: cProfile.Profile,
+    status_code: int, body_bytes: int, duration: float
+) -> None:
+    spans, _, profiles = trace.export()
+    lines = [
+        f"{scope['method']} {scope['path']} -> {status_code}, {duration * 1000:.1f} ms, {body_bytes} bytes",
+        "",
+        "spans:",
+    ]
+    lines += [
+        f"  {name:<24} {seconds * 1000:>10.1f} ms  x{int(count)}"
+        for name, (count, seconds) in sorted(spans.items(), key=lambda item: -item[1][1])
+    ]
+    lines += ["", "== event loop ==", profile_summary(profiler)]
+    for summary in profiles:
+        lines += [f"== worker: {summary}"]
+    body = "\n".join(lines).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"cache-control", b"no-store"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def collect_result_cache() -> List:
+    stats = result_cache.stats()
+    return [
+        ({"result": "hit"}, stats["hits"]),
+        ({"result": "disk_hit"}, stats["disk_hits"]),
+        ({"result": "miss"}, stats["misses"]),
+    ]
+
+def collect_pool() -> List:
+    status = get_pool_status()
+    return [({"state": key}, value) for key, value in status.items() if isinstance(value, (int, float))]
+
+registry.register(CallbackMetric(
+    "numina_result_cache_requests", "Result cache lookups by outcome (hit, disk_hit, miss)", "counter",
+    collect_result_cache, ["result"]
+))
+registry.register(CallbackMetric(
+    "numina_result_cache_bytes", "Bytes held in the in-memory result cache", "gauge",
+    lambda: [({}, result_cache.stats()["bytes"])]
+))
+registry.register(CallbackMetric(
+    "numina_ingestion_queue_depth", "Ingestion jobs waiting for a worker", "gauge",
+    lambda: [({}, ingestion_queue.depth)]
+))
+registry.register(CallbackMetric(
+    "numina_heavy_jobs", "Heavy query/ingestion tasks by state", "gauge",
+    lambda: [({"state": "running"}, heavy_jobs.running), ({"state": "queued"}, heavy_jobs.queued)], ["state"]
+))
+registry.register(CallbackMetric(
+    "numina_db_pool", "Database connection pool state and cumulative counts", "gauge", collect_pool, ["state"]
+))
@@ -0,0 +1,31 @@
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.exceptions import FileTooLargeException
+
+# multipart表单中文件以外的部分（边界、字段头和其他字段）的余量
+FORM_OVERHEAD = 64 * 1024
+
+class RequestSizeLimitMiddleware:
+    """Content-Length超出 MAX_CONTENT_LENGTH 的请求在读取请求体之前直接返回413：
+    表单在进入路由之前就会被完整接收，只在保存文件时检查大小，超大的上传仍会先被全部接收。
+    没有Content-Length的请求由save_upload_file在保存时检查
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            content_length = Headers(scope=scope).get("content-length")
+            if content_length and content_length.isdigit() \
+                    and int(content_length) > settings.MAX_CONTENT_LENGTH + FORM_OVERHEAD:
+                error = FileTooLargeException(settings.MAX_CONTENT_LENGTH)
+                # 不读取请求体，响应后关闭连接
+                response = JSONResponse({"detail": error.detail}, status_code=error.status_code,
+                                        headers={"Connection": "close"})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -1,12 +1,18 @@
+import hashlib
+import uuid
 from datetime import datetime, timedelta
-from typing import Any, Union, Optional
+from typing import Any, Callable, Dict, Union, Optional
 
+import anyio
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt计算专用的并发上限，在事件循环中首次使用时创建
+_hash_limiter: Optional[anyio.CapacityLimiter] = None
+
 def create_access_token(
     subject: Union[str, Any], expires_delta: Optional[timedelta] = None
 ) -> str:
@@ -16,12 +22,31 @@ def create_access_token(
         expire = datetime.utcnow() + timedelta(
             minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
         )
-    to_encode = {"exp": expire, "sub": str(subject)}
+    # jti唯一标识每个令牌，登出时据此吊销
+    to_encode = {"exp": expire, "sub": str(subject), "jti": uuid.uuid4().hex}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
+def token_id(token: str, payload: Dict[str, Any]) -> str:
+    """令牌的吊销标识：jti；没有jti的旧令牌使用令牌内容的哈希"""
+    return payload.get("jti") or hashlib.sha256(token.encode("utf-8")).hexdigest()
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
+
+async def run_password_hash(func: Callable[..., Any], *args: Any) -> Any:
+    """在线程中执行bcrypt，同时最多PASSWORD_HASH_CONCURRENCY个；
+    等待名额时不占用线程，登录高峰不会耗尽其他同步接口使用的线程池"""
+    global _hash_limiter
+    if _hash_limiter is None:
+        _hash_limiter = anyio.CapacityLimiter(settings.PASSWORD_HASH_CONCURRENCY)
+    return await anyio.to_thread.run_sync(func, *args, limiter=_hash_limiter)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_hash(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await run_password_hash(get_password_hash, password)
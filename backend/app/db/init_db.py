@@ -1,11 +1,16 @@
 import logging
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
 
 from app.core.config import settings
 from app.core.security import get_password_hash
 from app.db.base import Base
 from app.db.session import engine
 from app.models.user import User
+from app.models.dataset import Dataset
+from app.models.job import IngestionJob
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -13,6 +18,9 @@ logger = logging.getLogger(__name__)
 def init_db(db: Session) -> None:
     # 创建所有表
     Base.metadata.create_all(bind=engine)
+    # 已有数据库中的表补齐新增的列和索引
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
     
     # 创建初始超级用户
     user = db.query(User).filter(User.email == settings.FIRST_SUPERUSER).first()
@@ -27,4 +35,32 @@ def init_db(db: Session) -> None:
         db.commit()
         logger.info("Initial superuser created")
     else:
-        logger.info("Superuser already exists")
\ No newline at end of file
+        logger.info("Superuser already exists")
+
+def add_missing_columns(engine: Engine) -> None:
+    """create_all不会修改已存在的表，这里为已有的表补上模型中新增的列（新增列须可为空或有server_default）"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                logger.info("Added column %s.%s", table.name, column.name)
+
+
+def add_missing_indexes(engine: Engine) -> None:
+    """为已有的表创建模型中新增的索引"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                logger.info("Created index %s", index.name)
@@ -1,12 +1,95 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.engine.url import URL
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from typing import Any, Dict
 
 from app.core.config import settings
 
-engine = create_engine(
-    settings.SQLALCHEMY_DATABASE_URI, connect_args={"check_same_thread": False}
-)
+class PoolMetrics:
+    """连接池事件计数：新建连接数、取出次数、当前借出数和失效的连接数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checked_out = 0
+        self.invalidated = 0
+
+    def attach(self, engine: Engine) -> None:
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception) -> None:
+        with self._lock:
+            self.invalidated += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "invalidated": self.invalidated,
+            }
+
+def create_db_engine(url: str, **kwargs: Any) -> Engine:
+    """按数据库类型创建同步引擎：SQLite开启WAL并设置pragma，文件数据库和其他数据库使用可配置的连接池"""
+    return create_engine(url, **engine_options(make_url(url)), **kwargs)
+
+def engine_options(url: URL) -> Dict[str, Any]:
+    if url.get_backend_name() != "sqlite":
+        return pool_options()
+    options: Dict[str, Any] = {"connect_args": {"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT}}
+    if url.database and url.database != ":memory:":
+        # 文件数据库默认每次新建连接，改用连接池以保留每个连接的页缓存和内存映射
+        options.update(pool_options(), poolclass=QueuePool)
+    return options
+
+def pool_options() -> Dict[str, Any]:
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """WAL模式下读写互不阻塞，写事务只在提交时短暂持有锁；synchronous=NORMAL在WAL下仍保证数据库不损坏"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT * 1000}")
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={settings.SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+def instrument_engine(engine: Engine, metrics: PoolMetrics) -> None:
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    metrics.attach(engine)
+
+engine = create_db_engine(settings.SQLALCHEMY_DATABASE_URI)
+pool_metrics = PoolMetrics()
+instrument_engine(engine, pool_metrics)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
@@ -14,4 +97,17 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_pool_status() -> Dict[str, Any]:
+    """连接池当前状态和累计计数，用于监控连接是否耗尽"""
+    status = {"pool": engine.pool.__class__.__name__, **pool_metrics.snapshot()}
+    pool = engine.pool
+    if hasattr(pool, "size") and hasattr(pool, "overflow"):
+        status.update({
+            "size": pool.size(),
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+        })
+    return status
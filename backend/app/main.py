@@ -1,12 +1,18 @@
 import logging
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 
 from app.api import api_router
+from app.core.compression import CompressionMiddleware
 from app.core.config import settings
-from app.db.session import get_db
+from app.core.limits import RequestSizeLimitMiddleware
+from app.core.instrumentation import InstrumentationMiddleware, METRICS_MEDIA_TYPE
+from app.db.session import get_db, get_pool_status
 from app.db.init_db import init_db
+from app.utils.executor import shutdown_process_pool
+from app.utils.ingestion import ingestion_queue
+from app.utils.metrics import render_metrics
 
 # 配置日志
 logging.basicConfig(
@@ -33,6 +39,15 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+# 按Accept-Encoding压缩响应
+app.add_middleware(CompressionMiddleware)
+
+# 请求体过大时在接收之前拒绝
+app.add_middleware(RequestSizeLimitMiddleware)
+
+# 请求耗时、响应字节数和阶段追踪（在压缩之外，统计实际发送的字节数）
+app.add_middleware(InstrumentationMiddleware)
+
 # 包含API路由
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -40,8 +55,25 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 async def startup_event():
     db = next(get_db())
     init_db(db)
+    # 启动后台导入任务，继续处理上次未完成的任务
+    await ingestion_queue.start()
     logger.info("Application startup complete")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingestion_queue.stop()
+    shutdown_process_pool()
+
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to Data Analysis & Visualization API"}
\ No newline at end of file
+    return {"message": "Welcome to Data Analysis & Visualization API"}
+
+@app.get("/health")
+def health():
+    """服务状态和数据库连接池使用情况"""
+    return {"status": "ok", "db_pool": get_pool_status()}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus格式的监控指标"""
+    return Response(render_metrics(), media_type=METRICS_MEDIA_TYPE)
\ No newline at end of file
@@ -0,0 +1,8 @@
+# 导入全部模型，保证在任意进程中使用其中一个模型时关系都能解析
+from app.models.user import User
+from app.models.dataset import Dataset
+from app.models.job import IngestionJob
+from app.models.rollup import Rollup
+from app.models.query import SavedQuery
+from app.models.visualization import Visualization
+from app.models.token import RevokedToken
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.base import Base
@@ -11,11 +11,21 @@ class Dataset(Base):
     description = Column(Text, nullable=True)
     file_path = Column(String, nullable=False)
     file_type = Column(String, nullable=False)  # csv, excel, etc.
+    content_hash = Column(String, index=True, nullable=True)  # 文件内容的SHA-256，相同内容的数据集共享同一文件
     row_count = Column(Integer, nullable=True)
     columns_info = Column(Text, nullable=True)  # JSON string with column info
+    status = Column(String, nullable=False, default="ready", server_default="ready")  # pending, processing, ready, failed
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # 每次追加数据后加1
     owner_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     owner = relationship("User", back_populates="datasets")
-    visualizations = relationship("Visualization", back_populates="dataset", cascade="all, delete-orphan")
\ No newline at end of file
+    visualizations = relationship("Visualization", back_populates="dataset", cascade="all, delete-orphan")
+    jobs = relationship("IngestionJob", back_populates="dataset", cascade="all, delete-orphan")
+    rollups = relationship("Rollup", back_populates="dataset", cascade="all, delete-orphan")
+
+    # 列表接口按所有者筛选、按id做keyset分页
+    __table_args__ = (
+        Index("ix_datasets_owner_id_key", "owner_id", "id"),
+    )
\ No newline at end of file
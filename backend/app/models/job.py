@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from app.db.base import Base
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"), index=True)
+    status = Column(String, nullable=False, default="pending", index=True)  # pending, running, completed, failed
+    progress = Column(Float, nullable=False, default=0.0)  # 0到1之间
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    append_path = Column(String, nullable=True)  # 追加数据的文件路径，为空表示首次导入
+    append_type = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    dataset = relationship("Dataset", back_populates="jobs")
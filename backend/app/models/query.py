@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.base import Base
@@ -16,4 +16,10 @@ class SavedQuery(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     dataset = relationship("Dataset")
-    owner = relationship("User")
\ No newline at end of file
+    owner = relationship("User")
+
+    # 列表接口按所有者（和数据集）筛选、按id做keyset分页
+    __table_args__ = (
+        Index("ix_saved_queries_owner_id_key", "owner_id", "id"),
+        Index("ix_saved_queries_owner_dataset_id_key", "owner_id", "dataset_id", "id"),
+    )
\ No newline at end of file
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from app.db.base import Base
+
+class Rollup(Base):
+    __tablename__ = "rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"), index=True)
+    dimensions = Column(Text, nullable=False)  # JSON list of dimension columns
+    measures = Column(Text, nullable=False)  # JSON list of {"column", "funcs"}
+    digest = Column(String, index=True, nullable=False)  # 规范化定义的哈希，决定物化文件名，相同定义共享文件
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    dataset = relationship("Dataset", back_populates="rollups")
@@ -0,0 +1,11 @@
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey
+from sqlalchemy.sql import func
+from app.db.base import Base
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)  # 令牌过期后记录可以删除
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.db.base import Base
@@ -17,4 +17,10 @@ class Visualization(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     dataset = relationship("Dataset", back_populates="visualizations")
-    owner = relationship("User")
\ No newline at end of file
+    owner = relationship("User")
+
+    # 列表接口按所有者（和数据集）筛选、按id做keyset分页
+    __table_args__ = (
+        Index("ix_visualizations_owner_id_key", "owner_id", "id"),
+        Index("ix_visualizations_owner_dataset_id_key", "owner_id", "dataset_id", "id"),
+    )
\ No newline at end of file
@@ -7,7 +7,12 @@ class DatasetBase(BaseModel):
     description: Optional[str] = None
 
 class DatasetCreate(DatasetBase):
-    pass
+    sheet: Optional[str] = None  # Excel文件要导入的工作表（名称或从0开始的序号），默认第一个
+
+class DerivedDatasetCreate(DatasetBase):
+    """把查询（可以包含连接）的完整结果保存为新数据集"""
+    dataset_id: int
+    query_string: str
 
 class DatasetUpdate(DatasetBase):
     name: Optional[str] = None
@@ -16,8 +21,11 @@ class DatasetInDB(DatasetBase):
     id: int
     file_path: str
     file_type: str
+    content_hash: Optional[str] = None
     row_count: Optional[int] = None
     columns_info: Optional[str] = None
+    status: str = "ready"
+    version: int = 1
     owner_id: int
     created_at: datetime
     updated_at: Optional[datetime] = None
@@ -30,4 +38,45 @@ class DatasetResponse(DatasetInDB):
 
 class DatasetList(BaseModel):
     items: List[DatasetResponse]
-    total: int
\ No newline at end of file
+    total: int
+    next_cursor: Optional[int] = None  # 下一页请求时传入的cursor，没有更多数据时为空
+
+class ColumnStats(BaseModel):
+    name: str
+    type: str
+    stats: Dict[str, Any] = {}
+
+class DatasetStats(BaseModel):
+    dataset_id: int
+    row_count: Optional[int] = None
+    columns: List[ColumnStats]
+
+class RollupMeasure(BaseModel):
+    column: str
+    funcs: List[str] = ["sum", "count", "min", "max"]
+
+class RollupCreate(BaseModel):
+    """预聚合：按dimensions分组，预先计算每个度量列的funcs聚合和每组的行数；
+    分组列和过滤列都是这些维度、聚合都能由这些度量合并得到的查询直接在预聚合表上计算"""
+    dimensions: List[str]
+    measures: List[RollupMeasure] = []
+
+class RollupResponse(RollupCreate):
+    id: int
+    dataset_id: int
+    row_count: Optional[int] = None  # 当前版本的预聚合表行数，为空表示尚未物化
+    created_at: datetime
+
+class IngestionJobResponse(BaseModel):
+    id: int
+    dataset_id: int
+    status: str
+    progress: float
+    error: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
\ No newline at end of file
@@ -1,13 +1,78 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, List, Dict, Any, Union
 
+class QueryFilter(BaseModel):
+    column: str
+    op: str = "=="
+    value: Any = None
+
+class QueryAggregate(BaseModel):
+    func: str
+    column: Optional[str] = None  # count 可省略列名，表示计数行数
+    alias: Optional[str] = None
+
+class QueryOrder(BaseModel):
+    column: str
+    desc: bool = False
+
+class QueryJoin(BaseModel):
+    """与当前用户的另一个数据集等值连接；连接后该数据集的列名为 "{alias}.{列名}"，
+    left_on可以引用之前连接的数据集的列"""
+    dataset_id: int
+    alias: str
+    left_on: List[str]
+    right_on: List[str]
+    how: str = "inner"  # inner 或 left
+
+class QuerySpec(BaseModel):
+    """query_string 解析后的查询结构（JSON格式），为空表示返回整个数据集"""
+    joins: List[QueryJoin] = []
+    select: List[str] = []
+    filters: List[QueryFilter] = []
+    group_by: List[str] = []
+    aggregates: List[QueryAggregate] = []
+    order_by: List[QueryOrder] = []
+    limit: Optional[int] = None
+
+class SamplingSpec(BaseModel):
+    """抽样查询：uniform按比例均匀抽样，reservoir抽取固定行数，stratified按列分层后按各层行数比例抽取固定行数；
+    相同的seed得到相同的样本"""
+    method: str = "uniform"
+    fraction: Optional[float] = Field(None, gt=0, le=1)  # uniform的抽样比例
+    size: Optional[int] = Field(None, ge=1)  # reservoir和stratified的抽样行数
+    column: Optional[str] = None  # stratified的分层列
+    seed: int = 0
+
 class QueryBase(BaseModel):
     query_string: str
     dataset_id: int
 
 class QueryRequest(QueryBase):
-    pass
+    offset: int = Field(0, ge=0)
+    page_size: Optional[int] = Field(None, ge=1)  # 为空时使用默认分页大小，超过上限会被截断
+    sampling: Optional[SamplingSpec] = None  # 在数据集的样本上执行查询
+
+class BatchItem(BaseModel):
+    """批量请求中的一项：visualization_id表示获取图表数据，dataset_id和query_string表示执行查询"""
+    visualization_id: Optional[int] = None
+    width: Optional[int] = Field(None, ge=1, le=20000)  # 图表像素宽度
+    dataset_id: Optional[int] = None
+    query_string: Optional[str] = None
+    offset: int = Field(0, ge=0)
+    page_size: Optional[int] = Field(None, ge=1)
+    sampling: Optional[SamplingSpec] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+
+class BatchItemResult(BaseModel):
+    status: int  # 该项的HTTP状态码
+    result: Optional[Dict[str, Any]] = None  # 与单独请求该图表或查询时的响应内容相同
+    detail: Optional[str] = None  # 出错时的错误信息
+
+class BatchResult(BaseModel):
+    results: List[BatchItemResult]  # 与请求中items的顺序一致
 
 class SavedQueryBase(BaseModel):
     name: str
@@ -39,8 +104,13 @@ class SavedQueryResponse(SavedQueryInDB):
 class SavedQueryList(BaseModel):
     items: List[SavedQueryResponse]
     total: int
+    next_cursor: Optional[int] = None  # 下一页请求时传入的cursor，没有更多数据时为空
 
 class QueryResult(BaseModel):
     columns: List[str]
     data: List[Dict[str, Any]]
-    row_count: int
\ No newline at end of file
+    row_count: int  # 查询命中的总行数，data 只包含当前页
+    offset: int = 0
+    next_offset: Optional[int] = None  # 下一页的偏移量，没有更多数据时为空
+    sampled: bool = False  # 是否为抽样查询的结果
+    sampling_ratio: Optional[float] = None  # 样本行数占数据集总行数的比例
\ No newline at end of file
@@ -33,4 +33,13 @@ class VisualizationResponse(VisualizationInDB):
 
 class VisualizationList(BaseModel):
     items: List[VisualizationResponse]
-    total: int
\ No newline at end of file
+    total: int
+    next_cursor: Optional[int] = None  # 下一页请求时传入的cursor，没有更多数据时为空
+
+class VisualizationData(BaseModel):
+    visualization_id: int
+    visualization_type: str
+    columns: List[str]
+    data: List[Dict[str, Any]]
+    point_count: int  # 返回给前端的点数
+    source_row_count: Optional[int] = None  # 降采样前参与计算的行数
\ No newline at end of file
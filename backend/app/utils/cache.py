@@ -0,0 +1,390 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+import orjson
+import pandas as pd
+import pyarrow as pa
+from cachetools import LRUCache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+class ByteLRUCache(LRUCache):
+    """按字节数计量容量的LRU缓存，记录淘汰次数"""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize=maxsize, getsizeof=dataframe_nbytes)
+        self.evictions = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+def dataframe_nbytes(df: pd.DataFrame) -> int:
+    """DataFrame实际占用的内存（包括object列中的字符串）"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+class DatasetCache:
+    """两级数据集缓存：
+    - 进程内：按实际内存字节数限制容量的LRU缓存，保存解析后的DataFrame
+    - 跨进程：共享目录中的Arrow IPC文件，各worker通过内存映射读取，不必重复解码Parquet；
+      转换为DataFrame时没有空值的数值列直接引用映射的内存，其他列（文本、类别、含空值的列）仍会复制
+    进程内的条目记录放入时列式文件的版本（见file_version），读取时版本不同即视为过期：
+    文件可能在其他进程中被重写或删除后重建，invalidate只能清除调用它的进程中的条目
+    """
+
+    def __init__(self, max_bytes: int, shared_dir: str, shared_max_bytes: int):
+        self._memory = ByteLRUCache(max_bytes)
+        self._versions: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self.shared_dir = shared_dir
+        self.shared_max_bytes = shared_max_bytes
+        # 后台写入共享目录的线程（按需创建）和等待写入的键
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._pending_shared = set()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._memory
+
+    def get(self, key: str, version: Any = None) -> Optional[pd.DataFrame]:
+        """从进程内缓存读取DataFrame，放入时的版本与version不同时丢弃"""
+        with self._lock:
+            df = self._memory.get(key)
+            if df is not None and self._versions.get(key) != version:
+                self._memory.pop(key, None)
+                df = None
+            if df is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return df
+
+    def put(self, key: str, df: pd.DataFrame, version: Any = None) -> None:
+        """放入进程内缓存；超出字节预算的单个数据集不缓存"""
+        with self._lock:
+            try:
+                self._memory[key] = df
+            except ValueError:
+                # 单个DataFrame大于整个缓存容量
+                return
+            self._versions[key] = version
+            # 清除已被淘汰的条目的版本
+            for evicted in self._versions.keys() - self._memory.keys():
+                del self._versions[evicted]
+
+    def get_shared(self, key: str) -> Optional[pa.Table]:
+        """通过内存映射打开共享目录中的Arrow文件，表数据不复制到进程内存"""
+        path = self.shared_path(key)
+        try:
+            source = pa.memory_map(path, "r")
+            table = pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        # 更新修改时间，供共享目录按最近使用淘汰
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.shared_hits += 1
+        return table
+
+    def put_shared(self, key: str, table: pa.Table) -> None:
+        """写入共享目录（先写临时文件再原子替换），随后按总大小淘汰最久未使用的文件"""
+        os.makedirs(self.shared_dir, exist_ok=True)
+        path = self.shared_path(key)
+        # 临时文件名各不相同，同时写入同一个键的线程或进程互不干扰
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        # 合并为单个记录批次写出：映射后每列只有一块连续内存，转换为DataFrame时才能不复制；
+        # 文本列超过单个数组的容量时保持分块
+        try:
+            table = table.combine_chunks()
+        except pa.ArrowCapacityError:
+            pass
+        try:
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        except BaseException:
+            remove_file(tmp_path)
+            raise
+        self._prune_shared()
+
+    def put_shared_later(self, key: str, table: pa.Table) -> None:
+        """在后台线程写入共享目录，请求不必等待写文件和淘汰；同一个键已在等待写入时跳过"""
+        with self._lock:
+            if key in self._pending_shared:
+                return
+            self._pending_shared.add(key)
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+        self._writer.submit(self._write_shared, key, table)
+
+    def _write_shared(self, key: str, table: pa.Table) -> None:
+        try:
+            with self._lock:
+                if key not in self._pending_shared:
+                    # 等待期间数据集已被删除
+                    return
+            self.put_shared(key, table)
+        except Exception:
+            logger.exception("Failed to write shared cache entry for %s", key)
+        finally:
+            with self._lock:
+                self._pending_shared.discard(key)
+
+    def invalidate(self, key: str) -> None:
+        """删除数据集在两级缓存中的条目"""
+        with self._lock:
+            self._memory.pop(key, None)
+            self._versions.pop(key, None)
+            self._pending_shared.discard(key)
+        try:
+            os.remove(self.shared_path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self) -> None:
+        """清空进程内缓存（不计入淘汰次数）"""
+        with self._lock:
+            evictions = self._memory.evictions
+            self._memory = ByteLRUCache(self._memory.maxsize)
+            self._memory.evictions = evictions
+            self._versions = {}
+
+    def shared_path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.shared_dir, f"{digest}.arrow")
+
+    def _prune_shared(self) -> None:
+        # 其他worker已映射的文件删除后仍可继续读取
+        prune_directory(self.shared_dir, self.shared_max_bytes, ".arrow")
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存命中、未命中、淘汰次数和当前占用"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared_hits": self.shared_hits,
+                "evictions": self._memory.evictions,
+                "entries": len(self._memory),
+                "bytes": int(self._memory.currsize),
+                "max_bytes": int(self._memory.maxsize),
+            }
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def prune_directory(directory: str, max_bytes: int, suffix: str) -> int:
+    """目录（含子目录）中指定后缀的文件总大小超出上限时，按修改时间删除最久未使用的文件；返回剩余文件的总大小"""
+    entries = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+class CachedResult(NamedTuple):
+    """编码完成的响应：内容、媒体类型和附加响应头；encoding不为空时content是按该编码压缩后的字节"""
+    content: bytes
+    media_type: str
+    headers: Dict[str, str]
+    encoding: Optional[str] = None
+
+class SpillingLRUCache(LRUCache):
+    """按结果字节数计量容量的LRU缓存，淘汰的条目暂存在spilled中等待写入磁盘"""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize=maxsize, getsizeof=lambda entry: len(entry.content))
+        self.spilled = []
+
+    def popitem(self):
+        item = super().popitem()
+        self.spilled.append(item)
+        return item
+
+class ResultCache:
+    """查询结果缓存，保存编码后的响应字节：
+    - 内存：按字节数限制容量的LRU，被淘汰的条目写入磁盘
+    - 磁盘：按数据源分目录保存，供重启后和其他worker进程复用，总大小超出上限时按最近使用淘汰
+    键由数据源（内容寻址的文件路径）和规范化的请求参数组成，数据源内容变化时键随之变化
+    """
+
+    def __init__(self, max_bytes: int, directory: str, disk_max_bytes: int):
+        self._memory = SpillingLRUCache(max_bytes)
+        self._lock = threading.RLock()
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        # 磁盘占用的估计值：扫描目录时得到实际值，之后累加本进程写入的字节数，超出上限时才再次扫描淘汰
+        self._disk_bytes = 0
+        self._disk_scanned = False
+        self._prune_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(source: str, *parts: Any) -> Tuple[str, str]:
+        """返回(数据源摘要, 请求摘要)；请求摘要同时用作ETag"""
+        source_digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        request = orjson.dumps([source, *parts], option=orjson.OPT_SORT_KEYS)
+        return source_digest, hashlib.sha256(request).hexdigest()
+
+    def get(self, key: Tuple[str, str]) -> Optional[CachedResult]:
+        with span("result_cache.get"):
+            with self._lock:
+                entry = self._memory.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+
+            entry = self._read_disk(key)
+            with self._lock:
+                if entry is None:
+                    self.misses += 1
+                    return None
+                self.disk_hits += 1
+                spilled = self._put_memory(key, entry)
+            self._spill(spilled)
+            return entry
+
+    def put(self, key: Tuple[str, str], entry: CachedResult) -> None:
+        with self._lock:
+            spilled = self._put_memory(key, entry)
+        self._spill(spilled)
+
+    def get_many(self, keys: List[Tuple[str, str]]) -> List[Optional[CachedResult]]:
+        return [self.get(key) for key in keys]
+
+    def put_many(self, entries: List[Tuple[Tuple[str, str], CachedResult]]) -> None:
+        for key, entry in entries:
+            self.put(key, entry)
+
+    def invalidate(self, source: str) -> None:
+        """删除数据源的全部缓存结果（内存和磁盘）"""
+        source_digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        with self._lock:
+            for key in [key for key in self._memory if key[0] == source_digest]:
+                del self._memory[key]
+        shutil.rmtree(os.path.join(self.directory, source_digest), ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._memory),
+                "bytes": int(self._memory.currsize),
+                "max_bytes": int(self._memory.maxsize),
+            }
+
+    def _put_memory(self, key: Tuple[str, str], entry: CachedResult) -> List[Tuple[Tuple[str, str], CachedResult]]:
+        """放入内存（调用方持有锁），返回需要写入磁盘的条目"""
+        try:
+            self._memory[key] = entry
+        except ValueError:
+            # 单个结果大于内存容量，直接写入磁盘
+            return [(key, entry)]
+        spilled, self._memory.spilled = self._memory.spilled, []
+        return spilled
+
+    def _spill(self, entries: List[Tuple[Tuple[str, str], CachedResult]]) -> None:
+        """在锁外把条目写入磁盘，其他读写不必等待文件写入和目录扫描"""
+        written = sum(self._write_disk(key, entry) for key, entry in entries)
+        if not written:
+            return
+        with self._lock:
+            self._disk_bytes += written
+            if self._disk_scanned and self._disk_bytes <= self.disk_max_bytes:
+                return
+            before = self._disk_bytes
+        # 同一时间只由一个线程扫描
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            # 淘汰到上限的90%，留出余量，避免之后每次写入都要扫描
+            remaining = prune_directory(self.directory, int(self.disk_max_bytes * 0.9), ".result")
+            with self._lock:
+                # 扫描期间其他线程写入的字节数仍然计入
+                self._disk_bytes = remaining + self._disk_bytes - before
+                self._disk_scanned = True
+        finally:
+            self._prune_lock.release()
+
+    def _disk_path(self, key: Tuple[str, str]) -> str:
+        return os.path.join(self.directory, key[0], f"{key[1]}.result")
+
+    def _write_disk(self, key: Tuple[str, str], entry: CachedResult) -> int:
+        """写入磁盘，返回写入的字节数（文件已存在时为0）"""
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        content = orjson.dumps({"media_type": entry.media_type, "headers": entry.headers, "encoding": entry.encoding})
+        content += b"\n" + entry.content
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            remove_file(tmp_path)
+            raise
+        return len(content)
+
+    def _read_disk(self, key: Tuple[str, str]) -> Optional[CachedResult]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                meta, content = f.read().split(b"\n", 1)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        meta = orjson.loads(meta)
+        return CachedResult(content, meta["media_type"], meta["headers"], meta.get("encoding"))
+
+dataset_cache = DatasetCache(
+    max_bytes=settings.CACHE_MAX_BYTES,
+    shared_dir=settings.SHARED_CACHE_DIR,
+    shared_max_bytes=settings.SHARED_CACHE_MAX_BYTES,
+)
+
+result_cache = ResultCache(
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+    directory=settings.RESULT_CACHE_DIR,
+    disk_max_bytes=settings.RESULT_CACHE_DISK_MAX_BYTES,
+)
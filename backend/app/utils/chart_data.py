@@ -0,0 +1,210 @@
+import json
+import numpy as np
+import pandas as pd
+from pydantic import ValidationError
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.schemas.query import QuerySpec, QueryAggregate, QueryFilter
+from app.utils.data_processor import query_dataframe
+from app.utils.query_engine import QueryError, AGGREGATE_FUNCS, comparable
+
+# 合并到"其他"扇区时可以直接相加的聚合函数
+ADDITIVE_FUNCS = {"sum", "count"}
+
+def render_chart_data(
+    file_path: str, file_type: str, visualization_type: str, config_str: str, width: Optional[int] = None
+) -> Dict[str, Any]:
+    """按可视化配置在服务端计算图表数据：柱状图/饼图分组聚合，折线图降采样到与像素宽度相当的点数"""
+    config = parse_config(config_str)
+    width = width or settings.CHART_DEFAULT_WIDTH
+    filters = parse_filters(config)
+    chart_type = visualization_type.lower()
+    x, ys = chart_axes(chart_type, config, visualization_type)
+
+    if chart_type == "line":
+        method = config.get("downsample", "lttb")
+        df, source_rows = line_chart_data(file_path, file_type, x, ys, filters, width * settings.CHART_POINTS_PER_PIXEL, method)
+    elif chart_type == "pie":
+        df, source_rows = pie_chart_data(file_path, file_type, x, ys[0], config.get("aggregate", "sum"), filters)
+    else:
+        max_bars = max(1, width // settings.CHART_MIN_BAR_WIDTH)
+        df, source_rows = bar_chart_data(file_path, file_type, x, ys, config.get("aggregate", "sum"), filters, max_bars)
+
+    return {"result": df, "source_row_count": source_rows}
+
+def chart_columns(visualization_type: str, config_str: str) -> List[str]:
+    """图表计算会读取的列，批量计算时用于合并扫描；配置无效时返回空列表，计算时再报告错误"""
+    try:
+        config = parse_config(config_str)
+        filters = parse_filters(config)
+        x, ys = chart_axes(visualization_type.lower(), config, visualization_type)
+    except QueryError:
+        return []
+    return list(dict.fromkeys([x] + ys + [f.column for f in filters]))
+
+def chart_query(visualization_type: str, config_str: str) -> Optional[QuerySpec]:
+    """柱状图和饼图首先计算的分组聚合查询，批量计算时用于判断能否由预聚合表回答；其他图表或配置无效时返回None"""
+    chart_type = visualization_type.lower()
+    if chart_type not in ("bar", "pie"):
+        return None
+    try:
+        config = parse_config(config_str)
+        x, ys = chart_axes(chart_type, config, visualization_type)
+        return grouped_query(x, ys, config.get("aggregate", "sum"), parse_filters(config))
+    except QueryError:
+        return None
+
+def parse_config(config_str: str) -> Dict[str, Any]:
+    try:
+        config = json.loads(config_str) if config_str else {}
+    except ValueError:
+        raise QueryError("Visualization config must be a JSON object")
+    if not isinstance(config, dict):
+        raise QueryError("Visualization config must be a JSON object")
+    return config
+
+def parse_filters(config: Dict[str, Any]) -> List[QueryFilter]:
+    try:
+        return QuerySpec.parse_obj({"filters": config.get("filters", [])}).filters
+    except ValidationError:
+        raise QueryError("Invalid filters in visualization config")
+
+def chart_axes(chart_type: str, config: Dict[str, Any], visualization_type: str) -> Tuple[str, List[str]]:
+    """x轴（饼图为名称）列和数值序列列"""
+    if chart_type == "line":
+        return require_key(config, "xKey"), series_keys(config, "yKey", "additionalLines")
+    if chart_type == "pie":
+        x = config.get("nameKey") or require_key(config, "xKey")
+        return x, [config.get("valueKey") or require_key(config, "yKey")]
+    if chart_type == "bar":
+        return require_key(config, "xKey"), series_keys(config, "yKey", "additionalBars")
+    raise QueryError(f"Unsupported visualization type: {visualization_type}")
+
+def require_key(config: Dict[str, Any], key: str) -> str:
+    if not config.get(key):
+        raise QueryError(f"Visualization config requires '{key}'")
+    return config[key]
+
+def series_keys(config: Dict[str, Any], key: str, additional_key: str) -> List[str]:
+    """主序列和附加序列的列名"""
+    keys = [require_key(config, key)]
+    keys += [item["key"] for item in config.get(additional_key, []) if item.get("key")]
+    return list(dict.fromkeys(keys))
+
+def grouped_query(x: str, ys: List[str], agg: str, filters: List[QueryFilter]) -> QuerySpec:
+    if agg not in AGGREGATE_FUNCS:
+        raise QueryError(f"Unsupported aggregate function: {agg}")
+    return QuerySpec(
+        filters=filters,
+        group_by=[x],
+        aggregates=[QueryAggregate(func=agg, column=y, alias=y) for y in ys],
+    )
+
+def bar_chart_data(file_path, file_type, x, ys, agg, filters, max_bars):
+    """按x分组聚合；分组数超出可显示的柱子数时，数值型x等宽分箱，类别型x保留最大的若干项"""
+    grouped = query_dataframe(file_path, file_type, grouped_query(x, ys, agg, filters))
+    if len(grouped) <= max_bars:
+        return grouped.sort_values(x, kind="stable", key=comparable).reset_index(drop=True), None
+
+    if pd.api.types.is_numeric_dtype(grouped[x]):
+        raw = query_dataframe(file_path, file_type, QuerySpec(select=[x] + ys, filters=filters))
+        return bin_aggregate(raw, x, ys, agg, max_bars), len(raw)
+    return grouped.nlargest(max_bars, ys[0]).reset_index(drop=True), None
+
+def bin_aggregate(df: pd.DataFrame, x: str, ys: List[str], agg: str, bins: int) -> pd.DataFrame:
+    """数值列等宽分箱后聚合，分箱以左边界作为x值"""
+    values = df[x].to_numpy(dtype="float64")
+    valid = ~np.isnan(values)
+    df, values = df[valid], values[valid]
+    edges = np.linspace(values.min(), values.max(), bins + 1)
+    codes = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, bins - 1)
+
+    binned = df[ys].groupby(codes).agg(AGGREGATE_FUNCS[agg])
+    binned.insert(0, x, edges[binned.index])
+    return binned.reset_index(drop=True)
+
+def pie_chart_data(file_path, file_type, x, y, agg, filters):
+    """按名称分组聚合，超出扇区上限的部分合并为"其他"（仅对可相加的聚合）"""
+    grouped = query_dataframe(file_path, file_type, grouped_query(x, [y], agg, filters))
+    grouped = grouped.sort_values(y, ascending=False, kind="stable").reset_index(drop=True)
+    max_slices = settings.CHART_PIE_MAX_SLICES
+    if len(grouped) <= max_slices:
+        return grouped, None
+
+    if agg not in ADDITIVE_FUNCS:
+        return grouped.head(max_slices), None
+    top = grouped.head(max_slices - 1)
+    other = pd.DataFrame({x: ["Other"], y: [grouped[y].iloc[max_slices - 1:].sum()]})
+    return pd.concat([top.astype({x: object}), other], ignore_index=True), None
+
+def line_chart_data(file_path, file_type, x, ys, filters, max_points, method):
+    """按x排序后对每个序列降采样，保留各序列选中点的并集"""
+    if method not in ("lttb", "minmax"):
+        raise QueryError(f"Unsupported downsample method: {method}")
+
+    df = query_dataframe(file_path, file_type, QuerySpec(select=[x] + ys, filters=filters))
+    if not comparable(df[x]).is_monotonic_increasing:
+        df = df.sort_values(x, kind="stable", key=comparable).reset_index(drop=True)
+    source_rows = len(df)
+    if source_rows <= max_points:
+        return df, source_rows
+
+    xs = axis_values(df[x])
+    # 多个序列共享x轴，每个序列分到的点数按序列数均分
+    threshold = max(3, max_points // len(ys))
+    selected = []
+    for y in ys:
+        values = df[y].to_numpy(dtype="float64")
+        valid = np.flatnonzero(~np.isnan(values))
+        if method == "lttb":
+            picked = lttb_indices(xs[valid], values[valid], threshold)
+        else:
+            picked = minmax_indices(values[valid], threshold)
+        selected.append(valid[picked])
+
+    indices = np.unique(np.concatenate(selected)) if selected else np.arange(0)
+    return df.iloc[indices].reset_index(drop=True), source_rows
+
+def axis_values(series: pd.Series) -> np.ndarray:
+    """x轴转换为浮点数组：时间列取时间戳，非数值列按位置"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(dtype="datetime64[ns]").astype("int64").astype("float64")
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype="float64")
+    return np.arange(len(series), dtype="float64")
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets降采样，返回保留点的下标；每个桶内的面积计算是向量化的"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # 首尾点固定保留，中间n-2个点均分为threshold-2个桶
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x, bucket_y = x[start:end], y[start:end]
+        area = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def minmax_indices(y: np.ndarray, threshold: int) -> np.ndarray:
+    """分桶后保留每个桶的最小值和最大值点"""
+    n = len(y)
+    if threshold >= n:
+        return np.arange(n)
+
+    buckets = np.arange(n) * max(1, threshold // 2) // n
+    series = pd.Series(y)
+    grouped = series.groupby(buckets)
+    return np.unique(np.concatenate([grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy()]))
@@ -0,0 +1,153 @@
+import gzip
+import zlib
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+
+class StreamCompressor(ABC):
+    """流式压缩：每块压缩后立即刷新输出，客户端可以逐块解压，不必等待整个响应"""
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        """压缩一块数据，返回到这块为止可以解压的输出"""
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        """结束压缩流，返回剩余的输出"""
+
+class Codec(NamedTuple):
+    name: str  # Content-Encoding中的名称
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+    stream: Callable[[], StreamCompressor]
+
+class GzipStream(StreamCompressor):
+    def __init__(self):
+        # wbits=31 表示带gzip头的deflate流
+        self._compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+# 可用的编码，按服务端偏好排序：zstd和brotli在安装了对应的包时启用
+CODECS: Dict[str, Codec] = {}
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if zstandard is not None:
+    class ZstdStream(StreamCompressor):
+        def __init__(self):
+            self._compressor = zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compressobj()
+
+        def compress(self, data: bytes) -> bytes:
+            return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+        def finish(self) -> bytes:
+            return self._compressor.flush()
+
+    CODECS["zstd"] = Codec(
+        "zstd",
+        lambda data: zstandard.ZstdCompressor(level=settings.COMPRESSION_ZSTD_LEVEL).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+        ZstdStream,
+    )
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+if brotli is not None:
+    class BrotliStream(StreamCompressor):
+        def __init__(self):
+            self._compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+        def compress(self, data: bytes) -> bytes:
+            return self._compressor.process(data) + self._compressor.flush()
+
+        def finish(self) -> bytes:
+            return self._compressor.finish()
+
+    CODECS["br"] = Codec(
+        "br",
+        lambda data: brotli.compress(data, quality=settings.COMPRESSION_BROTLI_QUALITY),
+        brotli.decompress,
+        BrotliStream,
+    )
+
+# mtime=0使相同内容的压缩结果相同
+CODECS["gzip"] = Codec(
+    "gzip",
+    lambda data: gzip.compress(data, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0),
+    gzip.decompress,
+    GzipStream,
+)
+
+# 值得压缩的媒体类型（图片、压缩包等已压缩的内容不再压缩）
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "application/vnd.apache.arrow.stream",
+    "image/svg+xml",
+}
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    if not content_type:
+        return False
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type.startswith("text/") or media_type.endswith("+json") or media_type in COMPRESSIBLE_TYPES
+
+def parse_accept_encoding(accept_encoding: Optional[str]) -> List[Tuple[str, float]]:
+    """解析Accept-Encoding为 (编码, q值) 列表"""
+    result = []
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result.append((name, q))
+    return result
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """选择客户端接受的q值最高的编码，q值相同时按服务端偏好；没有可用编码时返回None"""
+    accepted = dict(parse_accept_encoding(accept_encoding))
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for name in CODECS:
+        q = accepted.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    accepted = dict(parse_accept_encoding(accept_encoding))
+    return accepted.get(encoding, accepted.get("*", 0.0)) > 0
+
+def cache_encoding() -> Optional[str]:
+    """缓存结果预先压缩使用的编码：配置的编码不可用时退回gzip，配置为空时不压缩"""
+    if not settings.RESULT_CACHE_ENCODING:
+        return None
+    return settings.RESULT_CACHE_ENCODING if settings.RESULT_CACHE_ENCODING in CODECS else "gzip"
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return CODECS[encoding].compress(data)
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    return CODECS[encoding].decompress(data)
@@ -1,54 +1,492 @@
-import csv
+import os
+import threading
 import pandas as pd
-from cachetools import cached, TTLCache
-from typing import Dict, List, Any, Tuple
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from typing import Dict, List, Any, Tuple, Iterator, Optional, Callable
 import json
+import uuid
+from contextlib import contextmanager
 
+from app.core.config import settings
 from app.models.dataset import Dataset
+from app.schemas.query import QuerySpec, SamplingSpec
+from app.utils.cache import dataset_cache, result_cache
+from app.utils.readers import read_batches, detect_delimiter, split_sheet, source_suffix
+from app.utils.joins import JoinSource, side_columns, side_filters, join_frames
+from app.utils.sampling import (
+    check_sampling, sample_rows, sample_path, count_rows, write_samples, read_sample, draw_sample,
+    strata_sample_path, write_strata_sample, draw_strata_sample, STRATUM_ROWS_COLUMN
+)
+from app.utils.rollups import match_rollup, apply_rollup, source_columns, invalidate_rollups
+from app.utils.tracing import span, timed_iter, add
+from app.utils.query_engine import (
+    QueryError, parse_query, referenced_columns, validate_query, split_filters,
+    to_arrow_expression, apply_query, build_mask
+)
 
-# 初始化缓存，限制最大条目和存活时间
-file_cache = TTLCache(maxsize=50, ttl=3600)  # 示例：最多缓存50个文件，存活1小时
+# 列式缓存文件后缀，与原始上传文件放在同一目录
+COLUMNAR_SUFFIX = ".parquet"
 
-def execute_query(file_path: str, file_type: str) -> Tuple[List[str], List[Dict[str, Any]], int]:
-    """执行查询并返回结果"""
-    delimiter = detect_delimiter(file_path)
+# 追加过数据的数据集，每个版本是一个存放Parquet分片的目录：{UPLOAD_FOLDER}/datasets/{id}/v{version}.fragments
+FRAGMENTS_SUFFIX = ".fragments"
 
-    result = ''
+# 当前线程中进行的共享扫描：file_path -> (读取的DataFrame, 是否包含全部列)
+_shared_scans = threading.local()
 
-    if file_path in file_cache:
-        result = file_cache[file_path]
+def execute_query(
+    file_path: str, file_type: str, query_string: str = "",
+    offset: int = 0, page_size: Optional[int] = None, as_records: bool = True,
+    sampling: Optional[SamplingSpec] = None, join_sources: Optional[List[JoinSource]] = None
+) -> Dict[str, Any]:
+    """执行查询并返回一页结果，每页行数受 QUERY_MAX_PAGE_SIZE 限制；as_records为False时不生成字典列表。
+    指定sampling时在数据集的样本上执行，sampling_ratio为样本行数占总行数的比例；
+    join_sources是查询中连接的数据集，顺序与spec.joins一致"""
+    spec = parse_query(query_string)
+    if sampling is None:
+        result, sampling_ratio = query_result(file_path, file_type, spec, join_sources), None
     else:
-        # 读取数据到DataFrame
-        if file_type == 'csv':
-            result = pd.read_csv(file_path,sep=delimiter,)
-            file_cache[file_path] = result
-        elif file_type in ['xlsx', 'xls']:
-            result = pd.read_csv(file_path)
-            file_cache[file_path] = result
-        elif file_type == 'json':
-            result = pd.read_csv(file_path)
-            file_cache[file_path] = result
-        else:
-            raise ValueError(f"Unsupported file type: {file_type}")
-    
-    # 将结果转换为字典列表
+        result, sampling_ratio = query_sample(file_path, file_type, spec, sampling)
+
+    page_size = min(page_size or settings.QUERY_DEFAULT_PAGE_SIZE, settings.QUERY_MAX_PAGE_SIZE)
+    page = result.iloc[offset:offset + page_size]
+
+    # 只把当前页转换为字典列表
     columns = result.columns.tolist()
-    data = result.to_dict(orient='records')
-    row_count = len(data)
-    
+    data = None
+    if as_records:
+        with span("query.to_dict"):
+            data = page.to_dict(orient='records')
+    row_count = len(result)
+    end = offset + len(page)
+
     return {
-        'result':result,
+        'page':page,
         'columns':columns,
         'data':data,
-        'row_count':row_count
+        'row_count':row_count,
+        'offset':offset,
+        'next_offset':end if end < row_count else None,
+        'sampling_ratio':sampling_ratio
     }
 
-def detect_delimiter(file_path, sample_lines=5):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        # 读取前几行内容（跳过可能的注释行）
-        sample = ''.join([f.readline() for _ in range(sample_lines)])
-        
-    # 使用 csv.Sniffer 检测分隔符
-    sniffer = csv.Sniffer()
-    delimiter = sniffer.sniff(sample).delimiter
-    return delimiter
\ No newline at end of file
+def iter_query_batches(
+    file_path: str, file_type: str, query_string: str = "", batch_size: Optional[int] = None,
+    join_sources: Optional[List[JoinSource]] = None
+) -> Iterator[pd.DataFrame]:
+    """按批生成查询结果；不含分组、聚合、排序和连接的查询直接从Parquet流式扫描，峰值内存只与批大小有关"""
+    batch_size = batch_size or settings.QUERY_STREAM_BATCH_SIZE
+    spec = parse_query(query_string)
+    columnar_path = get_columnar_path(file_path)
+
+    streamable = not (spec.group_by or spec.aggregates or spec.order_by or spec.joins)
+    if not streamable or file_path in dataset_cache or not os.path.exists(columnar_path):
+        yield from iter_frame_batches(query_result(file_path, file_type, spec, join_sources), batch_size)
+        return
+
+    dataset = open_dataset(file_path)
+    validate_query(spec, dataset.schema.names)
+    scanner, remaining = build_scanner(dataset, spec, batch_size=batch_size)
+
+    rows_left = spec.limit
+    for record_batch in timed_iter("query.scan", scanner.to_batches()):
+        add("numina_rows_scanned", record_batch.num_rows)
+        df = record_batch.to_pandas()
+        if remaining:
+            df = df[build_mask(df, remaining)]
+        if spec.select:
+            df = df[spec.select]
+        if rows_left is not None:
+            df = df.head(rows_left)
+            rows_left -= len(df)
+        if len(df):
+            yield df
+        if rows_left == 0:
+            break
+
+def iter_frame_batches(df: pd.DataFrame, batch_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """把已计算好的结果按批生成"""
+    batch_size = batch_size or settings.QUERY_STREAM_BATCH_SIZE
+    for start in range(0, len(df), batch_size):
+        yield df.iloc[start:start + batch_size]
+
+def query_sample(file_path: str, file_type: str, spec: QuerySpec, sampling: SamplingSpec) -> Tuple[pd.DataFrame, float]:
+    """在数据集的样本上执行查询，返回查询结果和抽样比例"""
+    if spec.joins:
+        raise QueryError("Sampling is not supported for queries with joins")
+    columns = referenced_columns(spec)
+    if columns is not None and sampling.column:
+        columns = list(dict.fromkeys(columns + [sampling.column]))
+    df, total = sample_dataframe(file_path, file_type, sampling, columns)
+    validate_query(spec, df.columns)
+    add("numina_rows_scanned", len(df))
+    with span("query.compute"):
+        return apply_query(df, spec), len(df) / total if total else 1.0
+
+def sample_dataframe(
+    file_path: str, file_type: str, sampling: SamplingSpec, columns: Optional[List[str]]
+) -> Tuple[pd.DataFrame, int]:
+    """抽取数据集的样本，返回样本和数据集总行数：从行数足够的最小预计算样本中按seed再抽样，
+    分层抽样使用按该列分层的样本；没有足够大的预计算样本时（数据集较小或抽样比例较大）从全部数据中抽样"""
+    check_sampling(sampling)
+    columnar_path = get_columnar_path(file_path)
+    if os.path.exists(columnar_path):
+        sources = list_fragments(file_path)
+        total = count_rows(sources)
+        needed = sample_rows(sampling, total)
+        size = next((size for size in sorted(settings.SAMPLE_SIZES) if needed <= size < total), None)
+        if size is not None and sampling.method == "stratified":
+            df = stratified_sample(columnar_path, sources, sampling, columns)
+            if df is not None:
+                return df, total
+        elif size is not None:
+            path = sample_path(columnar_path, size)
+            if not os.path.exists(path):
+                # 早于抽样功能导入的数据集没有预计算样本，首次抽样时补建
+                write_samples(columnar_path, sources)
+            return draw_sample(read_sample(path, columns), sampling, total), total
+
+    df = load_dataframe(file_path, file_type)
+    return draw_sample(df, sampling, len(df)), len(df)
+
+def stratified_sample(
+    columnar_path: str, sources: List[str], sampling: SamplingSpec, columns: Optional[List[str]]
+) -> Optional[pd.DataFrame]:
+    """在按分层列预先计算的样本上分层抽样，首次按该列分层时生成样本；
+    样本中某层的行数不够分配时返回None，改为从全部数据中抽样"""
+    path = strata_sample_path(columnar_path, sampling.column)
+    if not os.path.exists(path):
+        write_strata_sample(columnar_path, sources, sampling.column)
+    if columns is not None:
+        columns = columns + [STRATUM_ROWS_COLUMN]
+    return draw_strata_sample(read_sample(path, columns), sampling)
+
+def query_result(
+    file_path: str, file_type: str, spec: QuerySpec, join_sources: Optional[List[JoinSource]] = None
+) -> pd.DataFrame:
+    """完整的查询结果（不分页）"""
+    if spec.joins:
+        return query_joined(file_path, file_type, spec, join_sources or [])
+    return query_dataframe(file_path, file_type, spec)
+
+def query_joined(file_path: str, file_type: str, spec: QuerySpec, join_sources: List[JoinSource]) -> pd.DataFrame:
+    """执行包含连接的查询：每个数据集只读取引用的列并先计算各自的过滤条件（与单表查询一样利用缓存和下推），
+    再依次哈希连接，最后在连接结果上计算其余的过滤、分组聚合和排序"""
+    if len(join_sources) != len(spec.joins):
+        raise QueryError("Joined datasets are not available")
+    columns = side_columns(spec)
+    pushed, remaining = side_filters(spec)
+
+    def side_spec(alias: Optional[str]) -> QuerySpec:
+        return QuerySpec(select=columns[alias] if columns is not None else [], filters=pushed[alias])
+
+    df = query_dataframe(file_path, file_type, side_spec(None))
+    for join, source in zip(spec.joins, join_sources):
+        right = query_dataframe(source.file_path, source.file_type, side_spec(join.alias))
+        with span("query.join"):
+            df = join_frames(df, right, join.left_on, join.right_on, join.how, join.alias)
+
+    validate_query(spec, df.columns)
+    with span("query.compute"):
+        return apply_query(df, spec, filters=remaining)
+
+def query_dataframe(file_path: str, file_type: str, spec: QuerySpec) -> pd.DataFrame:
+    """执行查询：能由预聚合表回答时不读取数据集；已缓存的数据集直接在内存中计算，否则把列投影和过滤条件下推到存储层"""
+    rolled_up = query_rollup(file_path, spec)
+    if rolled_up is not None:
+        return rolled_up
+
+    shared = getattr(_shared_scans, "frames", {}).get(file_path)
+    if shared is not None:
+        df, complete = shared
+        columns = referenced_columns(spec)
+        if complete or (columns is not None and set(columns) <= set(df.columns)):
+            validate_query(spec, df.columns)
+            add("numina_rows_scanned", len(df))
+            with span("query.compute"):
+                return apply_query(df, spec)
+
+    columnar_path = get_columnar_path(file_path)
+    pushed, _ = split_filters(spec.filters)
+    full_scan = referenced_columns(spec) is None and not pushed
+    if full_scan or file_path in dataset_cache or not os.path.exists(columnar_path):
+        # 需要整个数据集时顺便放入进程内缓存
+        df = load_dataframe(file_path, file_type)
+        validate_query(spec, df.columns)
+        add("numina_rows_scanned", len(df))
+        with span("query.compute"):
+            return apply_query(df, spec)
+
+    dataset = open_dataset(file_path)
+    validate_query(spec, dataset.schema.names)
+    scanner, remaining = build_scanner(dataset, spec)
+    with span("query.scan"):
+        df = scanner.to_table().to_pandas()
+    add("numina_rows_scanned", len(df))
+    with span("query.compute"):
+        return apply_query(df, spec, filters=remaining)
+
+def query_rollup(file_path: str, spec: QuerySpec) -> Optional[pd.DataFrame]:
+    """在能回答查询的最小预聚合表上计算，没有可用的预聚合表时返回None；预聚合表很小，放入进程内缓存"""
+    table = match_rollup(get_columnar_path(file_path), spec)
+    if table is None:
+        return None
+    validate_query(spec, source_columns(table.rollup))
+    version = file_version(table.path)
+    df = dataset_cache.get(table.path, version)
+    if df is None:
+        try:
+            with span("rollup.load"):
+                df = pq.read_table(table.path).to_pandas()
+        except FileNotFoundError:
+            # 其他进程刚删除了该预聚合，缓存的列表尚未更新
+            invalidate_rollups(get_columnar_path(file_path))
+            return None
+        dataset_cache.put(table.path, df, version)
+    add("numina_rollup_queries")
+    add("numina_rows_scanned", len(df))
+    with span("query.rollup"):
+        return apply_rollup(df, spec)
+
+@contextmanager
+def shared_scan(file_path: str, file_type: str, columns: Optional[List[str]]) -> Iterator[None]:
+    """上下文中同一数据集上的多个查询共用一次扫描：columns为各查询引用列的并集（None表示全部列），
+    读取时不下推过滤条件，各查询在内存中分别计算"""
+    columnar_path = get_columnar_path(file_path)
+    if columns is None or file_path in dataset_cache or not os.path.exists(columnar_path):
+        frame = (load_dataframe(file_path, file_type), True)
+    else:
+        dataset = open_dataset(file_path)
+        available = set(dataset.schema.names)
+        with span("query.scan"):
+            table = dataset.to_table(columns=[col for col in columns if col in available])
+            frame = (table.to_pandas(), False)
+        if not table.num_columns:
+            # 只计数时没有需要读取的列，保留行数
+            frame = (pd.DataFrame(index=pd.RangeIndex(table.num_rows)), False)
+
+    frames = getattr(_shared_scans, "frames", None)
+    if frames is None:
+        frames = _shared_scans.frames = {}
+    frames[file_path] = frame
+    try:
+        yield
+    finally:
+        frames.pop(file_path, None)
+
+def open_dataset(file_path: str) -> ds.Dataset:
+    """优先使用共享缓存中内存映射的Arrow表，否则直接扫描Parquet文件"""
+    table = dataset_cache.get_shared(file_path)
+    if table is not None:
+        return ds.dataset(table)
+    return ds.dataset(get_columnar_path(file_path), format="parquet")
+
+def build_scanner(dataset: ds.Dataset, spec: QuerySpec, batch_size: Optional[int] = None) -> Tuple[ds.Scanner, List]:
+    """只读取查询引用的列，并下推比较条件（Parquet按行组统计信息跳过不满足条件的行组）；
+    返回扫描器和仍需在内存中计算的过滤条件"""
+    columns = referenced_columns(spec)
+    pushed, remaining = split_filters(spec.filters)
+    options = {"batch_size": batch_size} if batch_size else {}
+    try:
+        scanner = dataset.scanner(
+            columns=columns,
+            filter=to_arrow_expression(pushed) if pushed else None,
+            **options
+        )
+    except pa.ArrowException:
+        # 过滤值与列类型不兼容等情况，退回到内存中计算全部过滤条件
+        scanner = dataset.scanner(columns=columns, **options)
+        remaining = spec.filters
+    return scanner, remaining
+
+def get_columnar_path(file_path: str) -> str:
+    """返回原始文件（或其中某个工作表）对应的列式缓存文件路径；分片目录本身就是列式数据"""
+    if is_fragmented(file_path):
+        return file_path
+    raw_path, _ = split_sheet(file_path)
+    return f"{raw_path}{source_suffix(file_path)}{COLUMNAR_SUFFIX}"
+
+def is_fragmented(file_path: str) -> bool:
+    return file_path.endswith(FRAGMENTS_SUFFIX)
+
+def list_fragments(file_path: str) -> List[str]:
+    """数据集的全部Parquet分片，按追加顺序排列（以_或.开头的文件不是分片）"""
+    columnar_path = get_columnar_path(file_path)
+    if not is_fragmented(file_path):
+        return [columnar_path]
+    return [
+        os.path.join(columnar_path, name) for name in sorted(os.listdir(columnar_path))
+        if name.endswith(COLUMNAR_SUFFIX) and not name.startswith(("_", "."))
+    ]
+
+def load_dataframe(file_path: str, file_type: str) -> pd.DataFrame:
+    """加载数据集：依次尝试进程内缓存、共享缓存和列式文件，都不存在时解析原始文件并补建列式文件"""
+    version = file_version(get_columnar_path(file_path))
+    with span("dataset_cache.get"):
+        df = dataset_cache.get(file_path, version)
+    if df is not None:
+        add("numina_dataset_cache_requests", result="hit")
+        return df
+
+    if version is None:
+        # 旧数据集没有列式文件，首次读取时转换一次
+        add("numina_dataset_cache_requests", result="miss")
+        return convert_to_columnar(file_path, file_type)
+
+    with span("dataset.load"):
+        table = dataset_cache.get_shared(file_path)
+        if table is None:
+            add("numina_dataset_cache_requests", result="miss")
+            table = pq.read_table(get_columnar_path(file_path))
+            # 在后台写入共享缓存，其他worker直接映射，不必再解码Parquet
+            dataset_cache.put_shared_later(file_path, table)
+        else:
+            add("numina_dataset_cache_requests", result="shared_hit")
+        # 不合并同类型的列：没有空值的数值列直接引用Arrow的内存（共享缓存中即映射的文件），不再复制
+        df = table.to_pandas(split_blocks=True)
+        dataset_cache.put(file_path, df, version)
+    return df
+
+def file_version(path: str) -> Optional[Tuple[int, int, int]]:
+    """列式文件（或分片目录）的版本：文件被替换、目录中的分片增删后改变；不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def invalidate_dataset(file_path: str) -> None:
+    """数据集删除后清除它在各级缓存中的条目"""
+    dataset_cache.invalidate(file_path)
+    result_cache.invalidate(file_path)
+
+def convert_to_columnar(file_path: str, file_type: str) -> pd.DataFrame:
+    """解析原始文件并写出带类型的Parquet列式文件，返回解析得到的DataFrame"""
+    df = read_raw_file(file_path, file_type)
+    columnar_path = get_columnar_path(file_path)
+    write_columnar(df, columnar_path)
+    dataset_cache.put(file_path, df, file_version(columnar_path))
+    return df
+
+def convert_streaming(file_path: str, file_type: str, on_batch: Optional[Callable[[pa.RecordBatch], None]] = None) -> pa.Schema:
+    """逐块读取原始文件并写出Parquet列式文件，内存占用与块大小相当而与文件大小无关；
+    每块数据交给on_batch（用于增量统计）。后续块的列或类型与第一块不一致时抛出pa.ArrowInvalid"""
+    columnar_path = get_columnar_path(file_path)
+    tmp_path = f"{columnar_path}.{uuid.uuid4().hex}.tmp"
+    schema = None
+    writer = None
+    try:
+        # 攒够一个行组再写出，避免小块产生过多的小行组
+        pending, pending_rows = [], 0
+        for batch in timed_iter("ingest.parse", read_batches(file_path, file_type)):
+            if schema is None:
+                schema = batch.schema.remove_metadata()
+                writer = pq.ParquetWriter(tmp_path, schema)
+            batch = conform_batch(batch, schema)
+            if on_batch is not None:
+                on_batch(batch)
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            if pending_rows >= settings.COLUMNAR_ROW_GROUP_SIZE:
+                with span("ingest.write"):
+                    writer.write_table(pa.Table.from_batches(pending, schema), row_group_size=settings.COLUMNAR_ROW_GROUP_SIZE)
+                pending, pending_rows = [], 0
+        if schema is None:
+            raise ValueError("File contains no data")
+        if pending:
+            with span("ingest.write"):
+                writer.write_table(pa.Table.from_batches(pending, schema), row_group_size=settings.COLUMNAR_ROW_GROUP_SIZE)
+        writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, columnar_path)
+    return schema
+
+def rewrite_columnar(file_path: str, schema: pa.Schema) -> None:
+    """按新的列类型逐行组重写列式文件，内存占用与行组大小相当；类型不变时不重写"""
+    columnar_path = get_columnar_path(file_path)
+    if pq.read_schema(columnar_path).remove_metadata().equals(schema):
+        return
+    with span("ingest.rewrite"):
+        rewrite_parquet(columnar_path, columnar_path, schema)
+    # 进程内缓存中可能有按旧类型加载的DataFrame
+    dataset_cache.invalidate(file_path)
+
+def rewrite_parquet(source_path: str, dest_path: str, schema: pa.Schema) -> None:
+    """把Parquet文件逐行组转换为新的列类型写到dest_path（可以与source_path相同）"""
+    source = pq.ParquetFile(source_path)
+    tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for i in range(source.num_row_groups):
+                table = source.read_row_group(i)
+                columns = [cast_column(table[field.name], field.type) for field in schema]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+    os.replace(tmp_path, dest_path)
+
+def cast_column(column: pa.ChunkedArray, target: pa.DataType) -> pa.ChunkedArray:
+    if column.type.equals(target):
+        return column
+    if pa.types.is_dictionary(target):
+        # 已经是字典编码的列（来自pandas的category）只需转换索引类型
+        if not pa.types.is_dictionary(column.type):
+            column = column.dictionary_encode()
+        return column.cast(target)
+    if pa.types.is_timestamp(target) and not pa.types.is_timestamp(column.type):
+        # 文本解析为时间的格式比Arrow的cast宽松，使用pandas
+        return pa.chunked_array([pa.Array.from_pandas(pd.to_datetime(column.to_pandas()), type=target)])
+    return column.cast(target)
+
+def conform_batch(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    """把后续块转换为第一块的列类型，无法转换时抛出pa.ArrowInvalid"""
+    if batch.schema.names != schema.names:
+        raise pa.ArrowInvalid("Columns differ between chunks")
+    if batch.schema.equals(schema):
+        return batch
+    try:
+        return pa.Table.from_batches([batch]).cast(schema).combine_chunks().to_batches()[0]
+    except pa.ArrowException as e:
+        raise pa.ArrowInvalid(str(e))
+
+def read_raw_file(file_path: str, file_type: str) -> pd.DataFrame:
+    """整体解析原始上传文件，各块的类型不一致时由pandas统一"""
+    if file_type == 'csv':
+        delimiter = detect_delimiter(file_path)
+        with span("ingest.parse"):
+            df = pd.read_csv(file_path, sep=delimiter)
+    else:
+        with span("ingest.parse"):
+            df = pd.concat([batch.to_pandas(date_as_object=False) for batch in read_batches(file_path, file_type)], ignore_index=True)
+
+    # Parquet要求列名为字符串
+    df.columns = [str(col) for col in df.columns]
+    return df
+
+def write_columnar(df: pd.DataFrame, columnar_path: str) -> None:
+    """将DataFrame写为Parquet文件（先写临时文件再原子替换，避免读到半成品）"""
+    table = to_arrow_table(df)
+    tmp_path = f"{columnar_path}.{uuid.uuid4().hex}.tmp"
+    with span("ingest.write"):
+        pq.write_table(table, tmp_path, row_group_size=settings.COLUMNAR_ROW_GROUP_SIZE)
+    os.replace(tmp_path, columnar_path)
+
+def to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    """DataFrame转Arrow表，混合类型的object列退化为字符串列"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.select_dtypes(include='object').columns:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
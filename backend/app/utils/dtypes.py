@@ -0,0 +1,60 @@
+import numpy as np
+import pyarrow as pa
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.utils.profiler import ColumnProfiler, hll_estimate
+
+# 整数列按取值范围依次尝试的类型
+INTEGER_TYPES = [pa.int8(), pa.int16(), pa.int32()]
+
+# 低基数文本列使用的字典编码类型，加载为pandas的category
+CATEGORY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+def resolve_schema(schema: pa.Schema, profilers: Dict[str, ColumnProfiler]) -> pa.Schema:
+    """根据导入时的统计结果确定每列的存储类型：
+    - 整数列按最值缩小位宽（浮点列保持float64，避免展示时出现精度误差）
+    - 全部为日期格式的文本列解析为时间类型，日期列（date32/date64）同样存储为时间类型
+    - 不同取值占比不超过 CATEGORY_MAX_RATIO 的文本列使用字典编码
+    """
+    fields = []
+    for field in schema:
+        profiler = profilers.get(field.name)
+        fields.append(field.with_type(resolve_type(field.type, profiler)) if profiler else field)
+    return pa.schema(fields)
+
+def resolve_type(source: pa.DataType, profiler: ColumnProfiler) -> pa.DataType:
+    if pa.types.is_date(source):
+        # pandas把日期列加载为object列，无法按时间过滤和比较
+        return pa.timestamp("ns")
+
+    non_null_count = profiler.count - profiler.null_count
+    if not non_null_count:
+        return source
+
+    if pa.types.is_integer(source) and profiler.min is not None:
+        for candidate in INTEGER_TYPES:
+            if candidate.bit_width >= source.bit_width:
+                break
+            info = np.iinfo(candidate.to_pandas_dtype())
+            if info.min <= profiler.min and profiler.max <= info.max:
+                return candidate
+        return source
+
+    if pa.types.is_string(source) or pa.types.is_large_string(source):
+        if profiler.datetime_dtype is not None:
+            tz = getattr(profiler.datetime_dtype, "tz", None)
+            return pa.timestamp("ns", tz=str(tz) if tz is not None else None)
+        if hll_estimate(profiler.registers) <= settings.CATEGORY_MAX_RATIO * non_null_count:
+            return CATEGORY_TYPE
+    return source
+
+def widen_type(stored: pa.DataType, source: pa.DataType) -> Optional[pa.DataType]:
+    """追加的数据无法转换为已存储的类型时（如超出缩小后的整数位宽、整数列中出现小数），
+    返回能同时容纳两者的类型；不是数值列时返回None"""
+    numeric = (pa.types.is_integer, pa.types.is_floating)
+    if pa.types.is_integer(stored) and pa.types.is_integer(source):
+        return pa.int64()
+    if any(check(stored) for check in numeric) and any(check(source) for check in numeric):
+        return pa.float64()
+    return None
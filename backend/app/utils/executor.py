@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.exceptions import TooManyRequestsException
+from app.utils.tracing import traced_call, merge_trace, profiling
+
+class AdmissionController:
+    """限制同时执行的重任务数量：超出并发上限的任务排队等待，排队也满时直接拒绝"""
+
+    def __init__(self, limit: int, queue_size: int):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.pending = 0  # 正在执行和排队中的任务总数
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def running(self) -> int:
+        return min(self.pending, self.limit)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.pending - self.limit)
+
+    async def acquire(self, block: bool = False) -> None:
+        """获取执行名额；block为True时（后台任务）排队已满也继续等待而不是拒绝"""
+        if not block and self.pending >= self.limit + self.queue_size:
+            raise TooManyRequestsException()
+        # 信号量在事件循环中首次使用时创建，避免绑定到导入时的事件循环
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        self.pending += 1
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            self.pending -= 1
+            raise
+
+    def release(self) -> None:
+        self._semaphore.release()
+        self.pending -= 1
+
+heavy_jobs = AdmissionController(settings.HEAVY_JOB_LIMIT, settings.HEAVY_JOB_QUEUE_SIZE)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """按需创建进程池；PROCESS_POOL_WORKERS为0时不使用进程池"""
+    global _process_pool
+    if _process_pool is None and settings.PROCESS_POOL_WORKERS > 0:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.PROCESS_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+async def run_heavy(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """在进程池中执行CPU密集的解析和查询任务，受并发准入控制；func和返回值必须可以pickle"""
+    await heavy_jobs.acquire()
+    try:
+        return await run_in_pool(func, *args, **kwargs)
+    finally:
+        heavy_jobs.release()
+
+async def run_background(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """后台任务使用的run_heavy：与请求共享并发名额，但繁忙时等待而不是返回429"""
+    await heavy_jobs.acquire(block=True)
+    try:
+        return await run_in_pool(func, *args, **kwargs)
+    finally:
+        heavy_jobs.release()
+
+async def run_in_pool(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """执行任务并把任务中记录的阶段耗时、计数器和性能分析结果合并到当前请求"""
+    pool = get_process_pool()
+    call = functools.partial(traced_call, profiling(), func, *args, **kwargs)
+    if pool is None:
+        result, trace = await run_in_threadpool(call)
+    else:
+        loop = asyncio.get_running_loop()
+        result, trace = await loop.run_in_executor(pool, call)
+    merge_trace(trace)
+    return result
@@ -1,56 +1,462 @@
+import hashlib
 import os
+import pickle
+import shutil
 import uuid
 import pandas as pd
 from fastapi import UploadFile
-from typing import Tuple, Dict, List, Any
+from starlette.concurrency import run_in_threadpool
+from typing import Tuple, Dict, List, Any, Callable, Optional
 import json
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from app.core.config import settings
-from app.utils.data_processor import execute_query
+from app.core.exceptions import FileTooLargeException
+from app.models.dataset import Dataset
+from app.models.job import IngestionJob
+from app.models.rollup import Rollup
+from app.schemas.dataset import RollupCreate
+from app.schemas.query import QuerySpec
+from app.utils.cache import dataset_cache, remove_file
+from app.utils.data_processor import (
+    convert_to_columnar, convert_streaming, rewrite_columnar, rewrite_parquet, cast_column, query_result,
+    query_dataframe, to_arrow_table, get_columnar_path, invalidate_dataset, is_fragmented, list_fragments,
+    FRAGMENTS_SUFFIX, COLUMNAR_SUFFIX
+)
+from app.utils.dtypes import resolve_schema, widen_type
+from app.utils.joins import JoinSource
+from app.utils.query_engine import QueryError, parse_query
+from app.utils.readers import read_batches, split_sheet, SHEET_SEPARATOR
+from app.utils.profiler import profile_column, ColumnProfiler
+from app.utils.rollups import (
+    build_rollup, rollup_digest, rollup_path, rollup_files, source_columns, measure_name, invalidate_rollups,
+    DEFINITION_KEY
+)
+from app.utils.sampling import write_samples, sample_files
+from app.utils.tracing import span, timed_iter
+
+# 分片目录中保存增量统计状态的文件（以_开头，扫描分片时会被忽略）
+PROFILE_STATE_FILE = "_profile.pkl"
+
+# 由查询结果生成的数据集没有原始文件，只有Parquet分片
+DERIVED_FILE_TYPE = "parquet"
 
 def validate_file_extension(filename: str) -> bool:
     """验证文件扩展名是否允许上传"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in settings.ALLOWED_EXTENSIONS
 
-async def save_upload_file(file: UploadFile) -> str:
-    """保存上传的文件，返回文件路径"""
+async def save_upload_file(file: UploadFile) -> Tuple[str, str]:
+    """保存上传的文件，返回文件路径和内容哈希；内容相同的文件只保存一份"""
     # 确保上传目录存在
     os.makedirs(settings.UPLOAD_FOLDER, exist_ok=True)
     
-    # 生成唯一文件名
-    unique_filename = f"{uuid.uuid4()}.{file.filename}"
-    file_path = os.path.join(settings.UPLOAD_FOLDER, unique_filename)
+    # 先写入临时文件，写入的同时计算内容哈希
+    tmp_path = os.path.join(settings.UPLOAD_FOLDER, f"{uuid.uuid4()}.upload.tmp")
     
-    # 保存文件
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
+    # 分块保存文件，内存占用与文件大小无关；超出大小上限时立即中止并删除已写入的部分
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(settings.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > settings.MAX_CONTENT_LENGTH:
+                    raise FileTooLargeException(settings.MAX_CONTENT_LENGTH)
+                digest.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+    except BaseException:
+        remove_file(tmp_path)
+        raise
+
+    # 按内容哈希命名，已有相同内容的文件时丢弃本次上传的副本
+    content_hash = digest.hexdigest()
+    file_path = get_blob_path(content_hash, file.filename.rsplit('.', 1)[1].lower())
+    if os.path.exists(file_path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(tmp_path, file_path)
     
-    return file_path
+    return file_path, content_hash
 
-def get_file_info(file_path: str, file_extension: str) -> Tuple[int, str]:
-    """获取文件信息，返回行数和列信息"""
-    result = execute_query(file_path,file_extension)
+def get_blob_path(content_hash: str, file_type: str) -> str:
+    """内容寻址的存储路径，按哈希前两位分目录；扩展名决定解析方式，因此也是路径的一部分"""
+    return os.path.join(settings.UPLOAD_FOLDER, "blobs", content_hash[:2], f"{content_hash}.{file_type}")
 
-    row_count = result['row_count']
-    df = result['result']
-    
-    # 获取列信息
-    columns_info = []
+def get_version_path(dataset_id: int, version: int, job_id: int) -> str:
+    """追加数据后数据集新版本的分片目录，只属于这个数据集；包含任务ID，未完成的追加不会覆盖其他任务的结果"""
+    return os.path.join(
+        settings.UPLOAD_FOLDER, "datasets", str(dataset_id), f"v{version}-{job_id}{FRAGMENTS_SUFFIX}"
+    )
+
+def get_derived_path(dataset_id: int) -> str:
+    """由查询结果生成的数据集的分片目录（第一个版本），之后可以像上传的数据集一样追加"""
+    return os.path.join(settings.UPLOAD_FOLDER, "datasets", str(dataset_id), f"v1-derived{FRAGMENTS_SUFFIX}")
+
+def release_stored_file(db, file_path: str) -> None:
+    """文件由内容相同的数据集共享，最后一个引用（数据集或待执行的追加任务）删除后才删除文件并清除缓存"""
+    references = db.query(Dataset).filter(Dataset.file_path == file_path).count()
+    references += db.query(IngestionJob).filter(
+        IngestionJob.append_path == file_path, IngestionJob.finished_at.is_(None)
+    ).count()
+    if references:
+        return
+
+    # 同一文件的其他工作表仍被引用时只删除这个工作表的列式文件
+    blob_path, _ = split_sheet(file_path)
+    blob_references = db.query(Dataset).filter(
+        (Dataset.file_path == blob_path) | Dataset.file_path.startswith(blob_path + SHEET_SEPARATOR)
+    ).count()
+    blob_references += db.query(IngestionJob).filter(
+        (IngestionJob.append_path == blob_path) | IngestionJob.append_path.startswith(blob_path + SHEET_SEPARATOR),
+        IngestionJob.finished_at.is_(None)
+    ).count()
+    remove_stored_file(file_path, remove_blob=not blob_references)
+
+def remove_stored_file(file_path: str, remove_blob: bool = True) -> None:
+    """删除不再被任何数据集引用的列式文件和缓存；remove_blob为True时同时删除原始文件
+    （原始文件的其他工作表仍被引用时保留）"""
+    invalidate_dataset(file_path)
+    if is_fragmented(file_path):
+        # 分片目录没有原始文件，硬链接的分片不影响其他数据集共享的列式文件
+        shutil.rmtree(file_path, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(file_path))
+        except OSError:
+            pass
+        return
+    columnar_path = get_columnar_path(file_path)
+    invalidate_rollups(columnar_path)
+    paths = [columnar_path] + sample_files(columnar_path) + rollup_files(columnar_path)
+    if remove_blob:
+        paths.append(split_sheet(file_path)[0])
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def release_rollup(db, file_path: str, digest: str) -> None:
+    """预聚合文件由使用同一文件、定义相同的数据集共享，最后一个声明删除后才删除文件"""
+    references = db.query(Rollup).join(Dataset).filter(
+        Rollup.digest == digest, Dataset.file_path == file_path
+    ).count()
+    if references:
+        return
+    columnar_path = get_columnar_path(file_path)
+    path = rollup_path(columnar_path, digest)
+    dataset_cache.invalidate(path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    invalidate_rollups(columnar_path)
+
+def ingest_file(file_path: str, file_type: str, progress: Optional[Callable[[float], None]] = None) -> Tuple[int, str]:
+    """转换为列式存储并计算文件信息，在进程池中执行；progress用于报告0到1之间的进度"""
+    progress = progress or (lambda fraction: None)
+    try:
+        schema, profilers, samples = scan_streaming(file_path, file_type, progress)
+    except pa.ArrowInvalid:
+        # 后续块的列或类型与首块推断的不一致（如数值列中出现文本），退回整体解析
+        progress(0.0)
+        schema, profilers, samples = scan_whole(file_path, file_type)
+
+    # 按统计结果确定每列的存储类型并重写列式文件，之后加载时直接使用，不再推断类型
+    schema = resolve_schema(schema, profilers)
+    rewrite_columnar(file_path, schema)
+    # 预先计算抽样查询使用的样本
+    write_samples(get_columnar_path(file_path), list_fragments(file_path))
+    return describe_columns(schema, profilers, samples)
+
+def append_file(
+    file_path: str, append_path: str, append_type: str, target_path: str,
+    progress: Optional[Callable[[float], None]] = None, rollups: Tuple[RollupCreate, ...] = ()
+) -> Tuple[int, str]:
+    """把新文件的行追加为数据集的新分片，写出新版本的分片目录target_path，在进程池中执行：
+    已有分片通过硬链接复用，只解析和统计新增的行；统计状态保存在新目录中供下次追加继续累积；
+    rollups是数据集声明的预聚合，按新版本重新物化"""
+    progress = progress or (lambda fraction: None)
+    fragments = list_fragments(file_path)
+    schema = pq.read_schema(fragments[0]).remove_metadata()
+    state = load_profile_state(file_path)
+    if state is None:
+        with span("ingest.profile"):
+            state = profile_fragments(schema, fragments)
+    profilers, samples = state
+
+    tmp_dir = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_dir)
+    try:
+        schema, parts = write_appended_parts(
+            append_path, append_type, schema, tmp_dir, len(fragments), profilers, samples, progress
+        )
+        # 已有分片的类型不变时硬链接到新目录；有列的类型被放宽时按新类型重写
+        for index, fragment in enumerate(fragments):
+            link_fragment(fragment, fragment_path(tmp_dir, index), schema)
+        for part in parts:
+            if not pq.read_schema(part).remove_metadata().equals(schema):
+                rewrite_parquet(part, part, schema)
+        with open(os.path.join(tmp_dir, PROFILE_STATE_FILE), "wb") as f:
+            pickle.dump((profilers, samples), f)
+        # 样本按新版本的全部行重新计算
+        write_samples(tmp_dir, [fragment_path(tmp_dir, index) for index in range(len(fragments))] + parts)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # 上次中断的追加可能留下了同名目录，该目录尚未被数据集引用
+    shutil.rmtree(target_path, ignore_errors=True)
+    os.replace(tmp_dir, target_path)
+    for rollup in rollups:
+        try:
+            materialize_rollup(target_path, DERIVED_FILE_TYPE, rollup)
+        except QueryError:
+            # 无法物化的预聚合不影响追加，查询时回退为扫描数据集
+            pass
+    return describe_columns(schema, profilers, samples)
+
+def materialize_rollup(file_path: str, file_type: str, rollup: RollupCreate) -> int:
+    """按规范化的预聚合定义对数据集分组聚合，写成数据集文件旁边的小Parquet表，在进程池中执行；返回预聚合表的行数"""
+    df = query_dataframe(file_path, file_type, QuerySpec(select=source_columns(rollup)))
+    with span("rollup.build"):
+        try:
+            df = build_rollup(df, rollup)
+        except TypeError as e:
+            raise QueryError(f"Cannot aggregate rollup measures: {e}")
+    # 文本的求和是拼接，合并多个预聚合行后与直接求和的结果不同
+    for measure in rollup.measures:
+        if "sum" in measure.funcs and not pd.api.types.is_numeric_dtype(df[measure_name("sum", measure.column)]):
+            raise QueryError(f"Rollup sum requires a numeric column: {measure.column}")
+
+    table = to_arrow_table(df).replace_schema_metadata({DEFINITION_KEY: rollup.json().encode("utf-8")})
+    columnar_path = get_columnar_path(file_path)
+    path = rollup_path(columnar_path, rollup_digest(rollup))
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    invalidate_rollups(columnar_path)
+    return table.num_rows
+
+def derive_dataset(
+    file_path: str, file_type: str, query_string: str, join_sources: List[JoinSource], target_path: str
+) -> Tuple[int, str]:
+    """把查询（可以包含连接）的完整结果写成新数据集的分片目录target_path并计算列信息，在进程池中执行；
+    列类型的确定、统计状态和样本与上传导入的数据集相同"""
+    result = query_result(file_path, file_type, parse_query(query_string), join_sources)
+    # 列名中的"."（连接的别名前缀）保留，查询新数据集时按完整列名引用
+    table = to_arrow_table(result).replace_schema_metadata(None)
+
+    tmp_dir = f"{target_path}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(tmp_dir)
+    try:
+        part = fragment_path(tmp_dir, 0)
+        with span("ingest.write"):
+            pq.write_table(table, part, row_group_size=settings.COLUMNAR_ROW_GROUP_SIZE)
+        with span("ingest.profile"):
+            profilers, samples = profile_fragments(table.schema, [part])
+        schema = resolve_schema(table.schema, profilers)
+        if not schema.equals(table.schema):
+            with span("ingest.rewrite"):
+                rewrite_parquet(part, part, schema)
+        with open(os.path.join(tmp_dir, PROFILE_STATE_FILE), "wb") as f:
+            pickle.dump((profilers, samples), f)
+        write_samples(tmp_dir, [part])
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    shutil.rmtree(target_path, ignore_errors=True)
+    os.replace(tmp_dir, target_path)
+    return describe_columns(schema, profilers, samples)
+
+def write_appended_parts(
+    append_path: str, append_type: str, schema: pa.Schema, directory: str, first_index: int,
+    profilers: Dict[str, ColumnProfiler], samples: Dict[str, Any], progress: Callable[[float], None]
+) -> Tuple[pa.Schema, List[str]]:
+    """逐块读取追加的文件，转换为数据集的列类型后写成新分片，同时更新统计；
+    某列需要放宽类型时另起一个分片，返回最终的列类型和新分片列表"""
+    file_size = max(1, os.path.getsize(split_sheet(append_path)[0]))
+    parts: List[str] = []
+    writer = None
+    blocks = 0
+    try:
+        for batch in timed_iter("ingest.parse", read_batches(append_path, append_type)):
+            blocks += 1
+            if append_type == 'csv':
+                progress(min(0.99, blocks * settings.CSV_BLOCK_SIZE / file_size))
+            table, schema = align_batch(batch, schema)
+            if writer is None or not writer.schema.equals(schema):
+                if writer is not None:
+                    writer.close()
+                parts.append(fragment_path(directory, first_index + len(parts)))
+                writer = pq.ParquetWriter(parts[-1], schema)
+            with span("ingest.write"):
+                writer.write_table(table, row_group_size=settings.COLUMNAR_ROW_GROUP_SIZE)
+            with span("ingest.profile"):
+                update_profiles(profilers, samples, table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if not parts:
+        raise ValueError("File contains no data")
+    return schema, parts
+
+def align_batch(batch: pa.RecordBatch, schema: pa.Schema) -> Tuple[pa.Table, pa.Schema]:
+    """按数据集的列顺序和类型转换追加的数据块：缺少的列补空值，数据集中没有的列报错；
+    数值超出已存储类型的范围时放宽该列的类型，返回转换后的数据和（可能放宽后的）列类型"""
+    unknown = [name for name in batch.schema.names if name not in schema.names]
+    if unknown:
+        raise ValueError(f"Column not in dataset: {unknown[0]}")
+
+    columns = []
+    for field in schema:
+        if field.name in batch.schema.names:
+            column = pa.chunked_array([batch.column(field.name)])
+        else:
+            column = pa.chunked_array([pa.nulls(batch.num_rows)])
+        try:
+            column = cast_column(column, field.type)
+        except (pa.ArrowException, ValueError, TypeError):
+            target = widen_type(field.type, column.type)
+            if target is None:
+                raise ValueError(f"Values in column '{field.name}' do not match its type {field.type}")
+            column = cast_column(column, target)
+            schema = schema.set(schema.get_field_index(field.name), field.with_type(target))
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema), schema
+
+def fragment_path(directory: str, index: int) -> str:
+    return os.path.join(directory, f"part-{index:05d}{COLUMNAR_SUFFIX}")
+
+def link_fragment(source: str, dest: str, schema: pa.Schema) -> None:
+    if not pq.read_schema(source).remove_metadata().equals(schema):
+        rewrite_parquet(source, dest, schema)
+        return
+    try:
+        os.link(source, dest)
+    except OSError:
+        # 文件系统不支持硬链接时复制
+        shutil.copyfile(source, dest)
+
+def load_profile_state(file_path: str) -> Optional[Tuple[Dict[str, ColumnProfiler], Dict[str, Any]]]:
+    """读取上次追加时保存的统计状态；首次追加的数据集没有保存"""
+    if not is_fragmented(file_path):
+        return None
+    try:
+        with open(os.path.join(file_path, PROFILE_STATE_FILE), "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+def profile_fragments(
+    schema: pa.Schema, fragments: List[str]
+) -> Tuple[Dict[str, ColumnProfiler], Dict[str, Any]]:
+    """逐行组统计已有的分片，重建统计状态（只在首次追加时执行一次）"""
+    profilers = {name: ColumnProfiler() for name in schema.names}
+    samples: Dict[str, Any] = {}
+    for fragment in fragments:
+        source = pq.ParquetFile(fragment)
+        try:
+            for i in range(source.num_row_groups):
+                update_profiles(profilers, samples, source.read_row_group(i))
+        finally:
+            source.close()
+    return profilers, samples
+
+def update_profiles(profilers: Dict[str, ColumnProfiler], samples: Dict[str, Any], table: pa.Table) -> None:
+    """用已转换为存储类型的数据更新统计；字典编码的列按文本统计，与导入时一致"""
+    df = table.to_pandas(date_as_object=False)
     for col in df.columns:
-        dtype_name = str(df[col].dtype)
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        profilers.setdefault(col, ColumnProfiler()).update(series)
+        if samples.get(col) is None and not df.empty:
+            samples[col] = convert_numpy_types(df[col].iloc[0])
+
+def scan_streaming(
+    file_path: str, file_type: str, progress: Callable[[float], None]
+) -> Tuple[pa.Schema, Dict[str, ColumnProfiler], Dict[str, Any]]:
+    """单次遍历原始文件：逐块写出列式文件的同时累积每列的统计信息和样例值"""
+    profilers: Dict[str, ColumnProfiler] = {}
+    samples: Dict[str, Any] = {}
+    file_size = max(1, os.path.getsize(split_sheet(file_path)[0]))
+    blocks = 0
+
+    def on_batch(batch: pa.RecordBatch) -> None:
+        nonlocal blocks
+        # CSV每块约CSV_BLOCK_SIZE字节，按已解析的块数估算进度
+        blocks += 1
+        if file_type == 'csv':
+            progress(min(0.99, blocks * settings.CSV_BLOCK_SIZE / file_size))
+        with span("ingest.profile"):
+            # 日期列按时间统计，与存储类型一致
+            df = batch.to_pandas(date_as_object=False)
+            for col in df.columns:
+                profilers.setdefault(col, ColumnProfiler()).update(df[col])
+                if col not in samples and not df.empty:
+                    samples[col] = convert_numpy_types(df[col].iloc[0])
+
+    schema = convert_streaming(file_path, file_type, on_batch)
+    return schema, profilers, samples
+
+def scan_whole(file_path: str, file_extension: str) -> Tuple[pa.Schema, Dict[str, ColumnProfiler], Dict[str, Any]]:
+    """整体解析原始文件并转换为列式存储，再计算每列的统计信息和样例值"""
+    df = convert_to_columnar(file_path, file_extension)
+    profilers: Dict[str, ColumnProfiler] = {}
+    samples: Dict[str, Any] = {}
+    with span("ingest.profile"):
+        for col in df.columns:
+            profilers[col] = ColumnProfiler()
+            profilers[col].update(df[col])
+            samples[col] = convert_numpy_types(df[col].iloc[0]) if not df.empty else None
+    return pq.read_schema(get_columnar_path(file_path)).remove_metadata(), profilers, samples
+
+def describe_columns(
+    schema: pa.Schema, profilers: Dict[str, ColumnProfiler], samples: Dict[str, Any]
+) -> Tuple[int, str]:
+    """返回行数和列信息：加载后的类型、样例值和统计信息"""
+    dtypes = schema.empty_table().to_pandas().dtypes
+
+    columns_info = []
+    row_count = 0
+    for col in schema.names:
+        stats = profilers[col].finish() if col in profilers else profile_column(pd.Series([], dtype=dtypes[col]))
+        row_count = stats["count"]
         columns_info.append({
             "name": col,
-            "type": dtype_name,
-            "sample": convert_numpy_types(df[col].iloc[0]) if not df.empty else None
+            "type": loaded_dtype_name(dtypes[col], stats["null_count"]),
+            "sample": samples.get(col),
+            "stats": stats
         })
 
-    return row_count, json.dumps(columns_info)
+    # pyarrow把CSV中的日期列解析为date32，加载后样例值和高频值是datetime.date，按ISO格式保存
+    return row_count, json.dumps(columns_info, default=str)
+
+def loaded_dtype_name(dtype: np.dtype, null_count: int) -> str:
+    """列式文件加载为DataFrame后的类型名：含缺失值的整数列变为float64，布尔列变为object"""
+    if null_count and pd.api.types.is_integer_dtype(dtype):
+        return "float64"
+    if null_count and pd.api.types.is_bool_dtype(dtype):
+        return "object"
+    return str(dtype)
 
 def convert_numpy_types(value):
     if isinstance(value, (np.integer)):
         return int(value)
     elif isinstance(value, (np.floating)):
         return float(value)
+    elif isinstance(value, (np.bool_)):
+        return bool(value)
+    elif value is pd.NaT:
+        return None
+    elif isinstance(value, pd.Timestamp):
+        return value.isoformat()
     return value
\ No newline at end of file
@@ -0,0 +1,298 @@
+import asyncio
+import functools
+import logging
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.dataset import Dataset
+from app.models.job import IngestionJob
+from app.schemas.dataset import IngestionJobResponse, RollupCreate
+from app.utils.data_processor import invalidate_dataset
+from app.utils.executor import run_background
+from app.utils.file_handler import (
+    ingest_file, append_file, get_version_path, release_stored_file, release_rollup,
+    remove_stored_file
+)
+from app.utils.rollups import stored_rollup
+
+logger = logging.getLogger(__name__)
+
+# 导入任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_FINISHED = (JOB_COMPLETED, JOB_FAILED)
+
+# 数据集状态
+DATASET_PENDING = "pending"
+DATASET_PROCESSING = "processing"
+DATASET_READY = "ready"
+DATASET_FAILED = "failed"
+
+class ClaimedJob(NamedTuple):
+    """已领取的任务：首次导入时只有file_path和file_type；追加时把append_path的数据追加到file_path，写出target_path，
+    并按新版本物化数据集声明的预聚合rollups"""
+    file_path: str
+    file_type: str
+    append_path: Optional[str] = None
+    append_type: Optional[str] = None
+    target_path: Optional[str] = None
+    rollups: Tuple[RollupCreate, ...] = ()
+
+class IngestionQueue:
+    """进程内的导入任务队列：任务持久化在ingestion_jobs表中，由若干协程依次领取，
+    解析、转换和统计在进程池中执行；服务重启后继续处理未完成的任务"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        """等待处理的任务数"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        for job_id in await run_in_threadpool(recover_jobs):
+            self._queue.put_nowait(job_id)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """停止领取任务；执行中的任务保持running状态，下次启动时重新执行"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, job_id: int) -> None:
+        # 队列未启动时任务仍在数据库中，启动时会被领取
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await process_job(job_id)
+            except Exception:
+                logger.exception("Ingestion job %s crashed", job_id)
+            finally:
+                self._queue.task_done()
+
+ingestion_queue = IngestionQueue(settings.INGESTION_WORKERS)
+
+def create_job(db, dataset: Dataset) -> IngestionJob:
+    """为新上传的数据集创建导入任务（由调用方提交事务后再submit）"""
+    dataset.status = DATASET_PENDING
+    job = IngestionJob(dataset=dataset, status=JOB_PENDING)
+    db.add(job)
+    return job
+
+def create_completed_job(db, dataset: Dataset) -> IngestionJob:
+    """内容相同的文件已经导入过、直接复用结果时，记录一个已完成的任务，任务状态的查询与正常导入一致"""
+    now = utcnow()
+    job = IngestionJob(dataset=dataset, status=JOB_COMPLETED, progress=1.0, started_at=now, finished_at=now)
+    db.add(job)
+    return job
+
+def create_append_job(db, dataset: Dataset, append_path: str, append_type: str) -> IngestionJob:
+    """为已导入的数据集创建追加任务，追加完成前数据集仍可按当前版本查询"""
+    job = IngestionJob(dataset=dataset, status=JOB_PENDING, append_path=append_path, append_type=append_type)
+    db.add(job)
+    return job
+
+async def process_job(job_id: int) -> None:
+    claimed = await run_in_threadpool(claim_job, job_id)
+    if claimed is None:
+        return
+
+    progress = functools.partial(report_progress, job_id)
+    try:
+        if claimed.append_path is not None:
+            row_count, columns_info = await run_background(
+                append_file, claimed.file_path, claimed.append_path, claimed.append_type, claimed.target_path, progress,
+                claimed.rollups
+            )
+        else:
+            row_count, columns_info = await run_background(ingest_file, claimed.file_path, claimed.file_type, progress)
+    except Exception as e:
+        logger.warning("Ingestion job %s failed: %s", job_id, e)
+        await run_in_threadpool(finish_job, job_id, error=str(e) or e.__class__.__name__, claimed=claimed)
+        return
+    await run_in_threadpool(finish_job, job_id, row_count=row_count, columns_info=columns_info, claimed=claimed)
+
+def claim_job(job_id: int) -> Optional[ClaimedJob]:
+    """把任务标记为执行中，返回要处理的文件；任务已被其他进程领取、已删除或无需再导入时返回None"""
+    with SessionLocal() as db:
+        claimed = db.query(IngestionJob).filter(
+            IngestionJob.id == job_id, IngestionJob.status == JOB_PENDING
+        ).update({
+            IngestionJob.status: JOB_RUNNING,
+            IngestionJob.attempts: IngestionJob.attempts + 1,
+            IngestionJob.started_at: utcnow(),
+        }, synchronize_session=False)
+        if not claimed:
+            return None
+        job = db.query(IngestionJob).get(job_id)
+        dataset = job.dataset
+
+        if job.append_path is not None:
+            db.commit()
+            return ClaimedJob(
+                dataset.file_path, dataset.file_type.lower(), job.append_path, job.append_type,
+                get_version_path(dataset.id, dataset.version + 1, job.id),
+                tuple(stored_rollup(rollup) for rollup in dataset.rollups)
+            )
+
+        # 排队期间相同内容的文件已由其他任务导入完成，直接复用结果
+        imported = db.query(Dataset).filter(
+            Dataset.file_path == dataset.file_path, Dataset.status == DATASET_READY
+        ).first()
+        if imported is not None:
+            job.status = JOB_COMPLETED
+            job.progress = 1.0
+            job.finished_at = utcnow()
+            dataset.row_count = imported.row_count
+            dataset.columns_info = imported.columns_info
+            dataset.status = DATASET_READY
+            db.commit()
+            return None
+
+        dataset.status = DATASET_PROCESSING
+        db.commit()
+        return ClaimedJob(dataset.file_path, dataset.file_type.lower())
+
+def report_progress(job_id: int, progress: float) -> None:
+    """更新任务进度，在执行导入的进程中调用"""
+    with SessionLocal() as db:
+        db.query(IngestionJob).filter(
+            IngestionJob.id == job_id, IngestionJob.status == JOB_RUNNING
+        ).update({IngestionJob.progress: progress}, synchronize_session=False)
+        db.commit()
+
+def finish_job(
+    job_id: int, row_count: Optional[int] = None, columns_info: Optional[str] = None, error: Optional[str] = None,
+    claimed: Optional[ClaimedJob] = None
+) -> None:
+    """记录任务结果并更新数据集状态"""
+    with SessionLocal() as db:
+        job = db.query(IngestionJob).get(job_id)
+        if job is None:
+            # 导入过程中数据集已被删除：删除数据集时释放过的文件在此之后才写出，需要再次释放
+            if claimed is not None and claimed.target_path is not None:
+                release_stored_file(db, claimed.target_path)
+                release_stored_file(db, claimed.append_path)
+            elif claimed is not None:
+                release_stored_file(db, claimed.file_path)
+            return
+        if job.append_path is not None:
+            finish_append(db, job, row_count, columns_info, error, claimed)
+            return
+        dataset = job.dataset
+        job.finished_at = utcnow()
+        if error is None:
+            job.status = JOB_COMPLETED
+            job.progress = 1.0
+            dataset.row_count = row_count
+            dataset.columns_info = columns_info
+            dataset.status = DATASET_READY
+        else:
+            job.status = JOB_FAILED
+            job.error = error
+            dataset.status = DATASET_FAILED
+        db.commit()
+        if error is not None:
+            discard_failed_import(db, dataset)
+
+def discard_failed_import(db, dataset: Dataset) -> None:
+    """首次导入失败时删除已写出的列式文件和样本；原始文件仍由失败的数据集引用，删除数据集时才释放。
+    其他数据集已导入或正在导入同一文件时保留（列式文件由它们共享）"""
+    others = db.query(Dataset).filter(
+        Dataset.file_path == dataset.file_path, Dataset.id != dataset.id,
+        Dataset.status.in_((DATASET_PROCESSING, DATASET_READY))
+    ).count()
+    if others:
+        invalidate_dataset(dataset.file_path)
+        return
+    remove_stored_file(dataset.file_path, remove_blob=False)
+
+def finish_append(
+    db, job: IngestionJob, row_count: Optional[int], columns_info: Optional[str], error: Optional[str],
+    claimed: ClaimedJob
+) -> None:
+    """追加成功时切换到新版本：版本号加1，只清除旧版本文件的缓存（旧文件仍被其他数据集共享时保留）；
+    失败时数据集保持原版本"""
+    dataset = job.dataset
+    job.finished_at = utcnow()
+    if error is None and dataset.file_path != claimed.file_path:
+        error = "Dataset changed while appending"
+    if error is None:
+        job.status = JOB_COMPLETED
+        job.progress = 1.0
+        dataset.file_path = claimed.target_path
+        dataset.version += 1
+        dataset.content_hash = None
+        dataset.row_count = row_count
+        dataset.columns_info = columns_info
+    else:
+        job.status = JOB_FAILED
+        job.error = error
+    db.commit()
+
+    if error is None:
+        # 旧版本文件仍被其他数据集共享时，只删除这个数据集在旧版本上的预聚合
+        for rollup in dataset.rollups:
+            release_rollup(db, claimed.file_path, rollup.digest)
+        release_stored_file(db, claimed.file_path)
+    else:
+        release_stored_file(db, claimed.target_path)
+    release_stored_file(db, claimed.append_path)
+
+def recover_jobs() -> List[int]:
+    """上次退出时执行中的任务重新置为待处理，返回全部待处理任务"""
+    with SessionLocal() as db:
+        interrupted = db.query(IngestionJob).filter(IngestionJob.status == JOB_RUNNING).all()
+        for job in interrupted:
+            job.status = JOB_PENDING
+            job.progress = 0.0
+            if job.append_path is None:
+                job.dataset.status = DATASET_PENDING
+        db.commit()
+        if interrupted:
+            logger.info("Resuming %d interrupted ingestion jobs", len(interrupted))
+
+        pending = db.query(IngestionJob.id).filter(IngestionJob.status == JOB_PENDING).order_by(IngestionJob.id)
+        return [job_id for job_id, in pending]
+
+def get_latest_job(dataset_id: int) -> Optional[IngestionJobResponse]:
+    with SessionLocal() as db:
+        job = db.query(IngestionJob).filter(
+            IngestionJob.dataset_id == dataset_id
+        ).order_by(IngestionJob.id.desc()).first()
+        return IngestionJobResponse.from_orm(job) if job is not None else None
+
+async def iter_job_events(dataset_id: int) -> AsyncIterator[str]:
+    """以Server-Sent Events格式推送任务状态，状态变化时发送一次，任务结束后关闭"""
+    last = None
+    while True:
+        job = await run_in_threadpool(get_latest_job, dataset_id)
+        if job is None:
+            yield "event: error\ndata: {\"detail\": \"Ingestion job not found\"}\n\n"
+            return
+        if job != last:
+            yield f"event: {job.status}\ndata: {job.json()}\n\n"
+            last = job
+        if job.status in JOB_FINISHED:
+            return
+        await asyncio.sleep(settings.INGESTION_EVENT_INTERVAL)
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.schemas.query import QueryFilter, QuerySpec
+from app.utils.query_engine import QueryError, referenced_columns
+
+class JoinSource(NamedTuple):
+    """连接的数据集在存储中的位置，由路由层检查权限后解析，顺序与QuerySpec.joins一致"""
+    file_path: str
+    file_type: str
+
+def split_column(name: str, aliases: set) -> Tuple[Optional[str], str]:
+    """把连接后的列名拆分为 (别名, 原列名)，主数据集的列别名为None"""
+    alias, sep, column = name.partition(".")
+    if sep and alias in aliases:
+        return alias, column
+    return None, name
+
+def side_columns(spec: QuerySpec) -> Optional[Dict[Optional[str], List[str]]]:
+    """每个数据集需要读取的列（原列名），键为None表示主数据集，其余为连接的别名；None表示需要全部列"""
+    columns = referenced_columns(spec)
+    if columns is None:
+        return None
+    aliases = {join.alias for join in spec.joins}
+    sides: Dict[Optional[str], List[str]] = {None: [], **{alias: [] for alias in aliases}}
+    for name in columns + [column for join in spec.joins for column in join.left_on]:
+        alias, column = split_column(name, aliases)
+        sides[alias].append(column)
+    for join in spec.joins:
+        sides[join.alias] += join.right_on
+    return {alias: list(dict.fromkeys(names)) for alias, names in sides.items()}
+
+def side_filters(spec: QuerySpec) -> Tuple[Dict[Optional[str], List[QueryFilter]], List[QueryFilter]]:
+    """拆分为连接前在单个数据集上计算的过滤条件（列名为原列名）和连接后才能计算的条件：
+    主数据集和内连接数据集的条件可以先计算；左连接数据集的条件要在补空值之后计算"""
+    inner = {join.alias for join in spec.joins if join.how == "inner"}
+    aliases = {join.alias for join in spec.joins}
+    pushed: Dict[Optional[str], List[QueryFilter]] = {None: [], **{alias: [] for alias in aliases}}
+    remaining = []
+    for f in spec.filters:
+        alias, column = split_column(f.column, aliases)
+        if alias is None or alias in inner:
+            pushed[alias].append(f.copy(update={"column": column}))
+        else:
+            remaining.append(f)
+    return pushed, remaining
+
+def hash_join(
+    left: pd.DataFrame, right: pd.DataFrame, left_on: List[str], right_on: List[str], how: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    """等值连接，返回两侧匹配的行号，按左侧行的顺序排列；左连接中没有匹配的左侧行对应的右侧行号为-1。
+    在行数较少的一侧建哈希表（键 -> 同键的行），另一侧整列向量化探测；任一连接键为空的行不匹配"""
+    for columns, df in ((left_on, left), (right_on, right)):
+        missing = [col for col in columns if col not in df.columns]
+        if missing:
+            raise QueryError(f"Unknown join column: {missing[0]}")
+
+    left_keys, left_valid = join_keys(left, left_on)
+    right_keys, right_valid = join_keys(right, right_on)
+    if len(left) <= len(right):
+        left_rows, right_rows = probe(left_keys, left_valid, right_keys, right_valid)
+    else:
+        right_rows, left_rows = probe(right_keys, right_valid, left_keys, left_valid)
+
+    if how == "left":
+        unmatched = np.flatnonzero(np.bincount(left_rows, minlength=len(left)) == 0)
+        left_rows = np.concatenate([left_rows, unmatched])
+        right_rows = np.concatenate([right_rows, np.full(len(unmatched), -1, dtype=np.int64)])
+    order = np.argsort(left_rows, kind="stable")
+    return left_rows[order], right_rows[order]
+
+def join_keys(df: pd.DataFrame, columns: List[str]) -> Tuple[pd.Index, np.ndarray]:
+    """连接键（多列时为MultiIndex）和键是否完整（没有空值）；类别列按取值比较"""
+    series = [df[col].astype(object) if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col] for col in columns]
+    valid = np.logical_and.reduce([s.notna().to_numpy() for s in series])
+    if len(series) == 1:
+        return pd.Index(series[0]), valid
+    return pd.MultiIndex.from_arrays(series), valid
+
+def probe(
+    build_keys: pd.Index, build_valid: np.ndarray, probe_keys: pd.Index, probe_valid: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """返回 (建表侧行号, 探测侧行号) 的全部匹配对"""
+    build_rows = np.flatnonzero(build_valid)
+    codes, uniques = build_keys[build_rows].factorize()
+    # 同一键的行按code相邻排列，starts和counts给出每个键的行所在的区间
+    grouped = build_rows[np.argsort(codes, kind="stable")]
+    counts = np.bincount(codes, minlength=len(uniques))
+    starts = np.cumsum(counts) - counts
+
+    probe_rows = np.flatnonzero(probe_valid)
+    probe_codes = uniques.get_indexer(probe_keys[probe_rows])
+    hit = probe_codes >= 0
+    probe_rows, probe_codes = probe_rows[hit], probe_codes[hit]
+
+    # 每个探测行按匹配数重复，再展开为建表侧区间内的各行
+    repeats = counts[probe_codes]
+    offsets = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    matched = grouped[np.repeat(starts[probe_codes], repeats) + offsets]
+    return matched, np.repeat(probe_rows, repeats)
+
+def take_columns(df: pd.DataFrame, rows: np.ndarray, prefix: str = "") -> Dict[str, Any]:
+    """按行号取出各列，行号为-1的位置为空值（整数列因此变为浮点数）"""
+    fill = bool(len(rows)) and bool((rows < 0).any())
+    columns = {}
+    for col in df.columns:
+        values = df[col].array
+        if isinstance(values, pd.api.extensions.ExtensionArray) and not isinstance(values, pd.arrays.PandasArray):
+            columns[f"{prefix}{col}"] = values.take(rows, allow_fill=fill)
+        else:
+            columns[f"{prefix}{col}"] = pd.api.extensions.take(df[col].to_numpy(), rows, allow_fill=fill)
+    return columns
+
+def join_frames(
+    left: pd.DataFrame, right: pd.DataFrame, left_on: List[str], right_on: List[str], how: str, alias: str
+) -> pd.DataFrame:
+    """连接两个DataFrame，右侧的列名加上 "{alias}." 前缀"""
+    left_rows, right_rows = hash_join(left, right, left_on, right_on, how)
+    columns = take_columns(left, left_rows)
+    columns.update(take_columns(right, right_rows, f"{alias}."))
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(left_rows)))
@@ -0,0 +1,162 @@
+import math
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# 标签值元组，顺序与指标的labelnames一致
+LabelValues = Tuple[str, ...]
+
+# 延迟直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Metric:
+    """Prometheus文本格式的指标，samples返回 (名称后缀, 标签, 值)"""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, value: float = 1.0, **labels: Any) -> None:
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "_total", dict(zip(self.labelnames, key)), value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # 标签 -> (各分桶计数（不累加）, 总和, 总数)
+        self._values: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self.label_values(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield "_bucket", {**labels, "le": format_value(bound)}, cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+class CallbackMetric(Metric):
+    """采集时调用collect读取当前值，用于缓存统计、队列长度等已在别处维护的数据；
+    collect返回 (标签字典, 值) 列表"""
+
+    def __init__(
+        self, name: str, documentation: str, type: str,
+        collect: Callable[[], Iterable[Tuple[Dict[str, Any], float]]], labelnames: Sequence[str] = ()
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        suffix = "_total" if self.type == "counter" else ""
+        for labels, value in self.collect():
+            yield suffix, {key: str(value) for key, value in labels.items()}, value
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """Prometheus文本格式（0.0.4）"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = (
+        '{}="{}"'.format(key, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(pairs) + "}"
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "numina_http_request_duration_seconds", "HTTP request latency by route", ["method", "route"]
+))
+REQUESTS = registry.register(Counter(
+    "numina_http_requests", "HTTP requests by route and status code", ["method", "route", "status"]
+))
+RESPONSE_BYTES = registry.register(Counter(
+    "numina_http_response_bytes", "Response body bytes served by route", ["route"]
+))
+SPAN_LATENCY = registry.register(Histogram(
+    "numina_span_duration_seconds", "Time spent in a named stage per request or background job", ["span"]
+))
+ROWS_SCANNED = registry.register(Counter(
+    "numina_rows_scanned", "Rows read from datasets to answer queries and charts"
+))
+ROLLUP_QUERIES = registry.register(Counter(
+    "numina_rollup_queries", "Queries and charts answered from pre-aggregated rollups instead of the dataset"
+))
+DATASET_CACHE_REQUESTS = registry.register(Counter(
+    "numina_dataset_cache_requests", "Dataset loads by cache outcome (hit, shared_hit, miss)", ["result"]
+))
+
+def render_metrics() -> str:
+    return registry.render()
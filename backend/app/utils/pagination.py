@@ -0,0 +1,22 @@
+from typing import Any, Dict, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Query
+
+def keyset_page(query: Query, model: Any, cursor: Optional[int], limit: int) -> Dict[str, Any]:
+    """按主键做keyset分页：返回id大于cursor的一页记录、满足筛选条件的总数和下一页的游标（本页最后一条的id）；
+    总数作为标量子查询与当前页在同一条SQL中返回，翻页时不需要OFFSET扫描"""
+    # 子查询与外层查询同一张表，需要关闭自动关联，否则会变成逐行的相关子查询
+    total = query.with_entities(func.count()).statement.correlate(None).scalar_subquery()
+
+    page = query
+    if cursor is not None:
+        page = page.filter(model.id > cursor)
+    rows = page.add_columns(total.label("total")).order_by(model.id).limit(limit + 1).all()
+
+    items = [row[0] for row in rows[:limit]]
+    return {
+        "items": items,
+        # 游标之后没有记录时无法从结果行中得到总数，单独计数
+        "total": rows[0].total if rows else query.count(),
+        "next_cursor": items[-1].id if len(rows) > limit else None,
+    }
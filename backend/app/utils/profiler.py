@@ -0,0 +1,190 @@
+import re
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+# HyperLogLog精度：2^14个寄存器，基数估计的标准误差约0.8%
+HLL_PRECISION = 14
+HLL_REGISTERS = 1 << HLL_PRECISION
+
+# 数值列保存的分位点
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+# 可以解析为时间的文本格式：2021-01-31、2021/1/31 08:00:00、01/31/2021 等
+DATE_PATTERN = re.compile(
+    r"^(\d{4}[-/]\d{1,2}[-/]\d{1,2}|\d{1,2}[-/]\d{1,2}[-/]\d{4})"
+    r"([ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?$"
+)
+
+def profile_column(series: pd.Series) -> Dict[str, Any]:
+    """计算单列的统计信息：行数、空值数、基数估计、最值、分位数、直方图或高频值"""
+    profiler = ColumnProfiler()
+    profiler.update(series)
+    return profiler.finish()
+
+class ColumnProfiler:
+    """逐批累积单列统计信息，内存占用与数据量无关：
+    - 行数、空值数、最值、总和精确累积
+    - 基数用HyperLogLog寄存器估计
+    - 分位数和直方图基于固定大小的均匀抽样（数据量不超过抽样大小时是精确值）
+    - 高频值在不同取值超过 PROFILE_MAX_CATEGORIES 后停止统计
+    - 文本列检查是否全部为可解析的日期时间（datetime_dtype为解析后的类型）
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.null_count = 0
+        self.kind: Optional[str] = None
+        self.min: Any = None
+        self.max: Any = None
+        self.sum = 0.0
+        self.registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+        self.sample = np.empty(0, dtype=np.float64)
+        self.sample_keys = np.empty(0, dtype=np.float64)
+        self.value_counts: Optional[pd.Series] = pd.Series(dtype="int64")
+        self.datetime_dtype: Any = None
+        self._date_like = True
+        self._rng = np.random.default_rng(0)
+
+    def update(self, series: pd.Series) -> None:
+        non_null = series.dropna()
+        self.count += len(series)
+        self.null_count += len(series) - len(non_null)
+        np.maximum(self.registers, hll_registers(non_null), out=self.registers)
+        if non_null.empty:
+            return
+
+        if self.kind is None:
+            self.kind = column_kind(non_null)
+        if self.kind == "numeric":
+            values = non_null.to_numpy(dtype="float64")
+            self._update_range(values.min(), values.max())
+            self.sum += float(values.sum())
+            self._update_sample(values)
+        elif self.kind == "datetime":
+            self._update_range(non_null.min(), non_null.max())
+        else:
+            if self.kind == "other" and self._date_like:
+                self._check_dates(non_null)
+            if self.value_counts is not None:
+                self.value_counts = self.value_counts.add(non_null.value_counts(), fill_value=0)
+                if len(self.value_counts) > settings.PROFILE_MAX_CATEGORIES:
+                    # 接近唯一的列（如ID、时间字符串）不保存高频值
+                    self.value_counts = None
+
+    def _check_dates(self, values: pd.Series) -> None:
+        """先用首个值快速排除，再检查整块是否都是日期格式且能解析，各块解析出的类型须一致"""
+        first = values.iloc[0]
+        if not isinstance(first, str) or not DATE_PATTERN.match(first):
+            self._date_like = False
+        elif not values.astype(str).str.match(DATE_PATTERN).all():
+            self._date_like = False
+        else:
+            try:
+                parsed = pd.to_datetime(values)
+            except (ValueError, TypeError, OverflowError):
+                parsed = None
+            if parsed is None or not pd.api.types.is_datetime64_any_dtype(parsed) \
+                    or (self.datetime_dtype is not None and parsed.dtype != self.datetime_dtype):
+                self._date_like = False
+            else:
+                self.datetime_dtype = parsed.dtype
+                self._update_range(parsed.min(), parsed.max())
+        if not self._date_like:
+            self.datetime_dtype = None
+            self.min = self.max = None
+
+    def _update_range(self, low: Any, high: Any) -> None:
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def _update_sample(self, values: np.ndarray) -> None:
+        """给每个值分配随机优先级，保留优先级最高的 PROFILE_SAMPLE_SIZE 个值，即无放回均匀抽样"""
+        keys = self._rng.random(len(values))
+        sample = np.concatenate([self.sample, values])
+        sample_keys = np.concatenate([self.sample_keys, keys])
+        size = settings.PROFILE_SAMPLE_SIZE
+        if len(sample) > size:
+            keep = np.argpartition(sample_keys, len(sample) - size)[-size:]
+            sample, sample_keys = sample[keep], sample_keys[keep]
+        self.sample, self.sample_keys = sample, sample_keys
+
+    def finish(self) -> Dict[str, Any]:
+        stats = {
+            "count": int(self.count),
+            "null_count": int(self.null_count),
+            "distinct_estimate": hll_estimate(self.registers),
+        }
+        non_null_count = self.count - self.null_count
+        if not non_null_count:
+            return stats
+
+        if self.kind == "numeric":
+            stats["min"] = float(self.min)
+            stats["max"] = float(self.max)
+            stats["mean"] = self.sum / non_null_count
+            stats["quantiles"] = dict(zip(
+                [str(q) for q in QUANTILES], np.quantile(self.sample, QUANTILES).tolist()
+            ))
+            counts, edges = np.histogram(
+                self.sample, bins=settings.PROFILE_HISTOGRAM_BINS, range=(self.min, self.max)
+            )
+            # 抽样时按总行数等比例放大
+            scale = non_null_count / len(self.sample)
+            stats["histogram"] = {
+                "edges": edges.tolist(),
+                "counts": np.rint(counts * scale).astype(np.int64).tolist(),
+            }
+        elif self.kind == "datetime" or self.datetime_dtype is not None:
+            stats["min"] = self.min.isoformat()
+            stats["max"] = self.max.isoformat()
+        elif self.value_counts is not None:
+            stats["top_values"] = top_values(self.value_counts)
+        return stats
+
+def column_kind(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(series):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    return "other"
+
+def top_values(value_counts: pd.Series) -> List[Dict[str, Any]]:
+    """出现次数最多的值，用于筛选下拉框"""
+    counts = value_counts.sort_values(ascending=False, kind="stable").head(settings.PROFILE_TOP_VALUES)
+    return [
+        {"value": value.item() if isinstance(value, np.generic) else value, "count": int(count)}
+        for value, count in counts.items()
+    ]
+
+def hll_registers(series: pd.Series) -> np.ndarray:
+    """向量化计算HyperLogLog寄存器：64位哈希的高位选寄存器，其余位的前导零个数+1为rank"""
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    if series.empty:
+        return registers
+
+    hashes = pd.util.hash_pandas_object(series, index=False).to_numpy()
+    remaining_bits = 64 - HLL_PRECISION
+    index = (hashes >> np.uint64(remaining_bits)).astype(np.int64)
+    rest = hashes & np.uint64((1 << remaining_bits) - 1)
+    # rest不超过2^50，可以精确转换为浮点数，frexp的指数即为二进制位数
+    _, bit_length = np.frexp(rest.astype(np.float64))
+    rank = (remaining_bits - bit_length + 1).astype(np.uint8)
+
+    maxima = pd.Series(rank).groupby(index).max()
+    registers[maxima.index.to_numpy()] = maxima.to_numpy()
+    return registers
+
+def hll_estimate(registers: np.ndarray) -> int:
+    """根据寄存器估计基数，小基数时使用线性计数修正"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -registers.astype(np.float64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
@@ -0,0 +1,261 @@
+import json
+import pandas as pd
+import pyarrow.dataset as ds
+from pydantic import ValidationError
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.schemas.query import QuerySpec, QueryFilter, QueryAggregate
+
+class QueryError(ValueError):
+    """查询语句无法解析或引用了不存在的列"""
+
+# 可以下推到Parquet读取层的运算符（对应pyarrow的filters写法）
+COMPARISON_OPS = {"==", "=", "!=", ">", ">=", "<", "<="}
+SET_OPS = {"in", "not in"}
+PUSHDOWN_OPS = COMPARISON_OPS | SET_OPS
+# 只能在内存中计算的运算符
+NULL_OPS = {"is_null", "not_null"}
+
+# 聚合函数别名 -> pandas聚合函数名
+AGGREGATE_FUNCS = {
+    "count": "count",
+    "sum": "sum",
+    "mean": "mean",
+    "avg": "mean",
+    "min": "min",
+    "max": "max",
+    "median": "median",
+    "nunique": "nunique",
+    "count_distinct": "nunique",
+}
+
+# 依赖取值大小顺序的聚合函数
+ORDERED_FUNCS = {"min", "max", "median"}
+
+# 支持的连接方式
+JOIN_TYPES = {"inner", "left"}
+
+def parse_query(query_string: Optional[str]) -> QuerySpec:
+    """将JSON格式的query_string解析为QuerySpec，空字符串表示查询全部数据"""
+    if not query_string or not query_string.strip():
+        return QuerySpec()
+
+    try:
+        raw = json.loads(query_string)
+    except ValueError:
+        raise QueryError("query_string must be a JSON object")
+    if not isinstance(raw, dict):
+        raise QueryError("query_string must be a JSON object")
+
+    try:
+        spec = QuerySpec.parse_obj(raw)
+    except ValidationError as e:
+        raise QueryError(f"Invalid query: {e.errors()[0]['loc']} {e.errors()[0]['msg']}")
+
+    check_spec(spec)
+    return spec
+
+def check_spec(spec: QuerySpec) -> None:
+    """检查运算符、聚合函数和limit是否合法"""
+    for f in spec.filters:
+        if f.op not in PUSHDOWN_OPS | NULL_OPS:
+            raise QueryError(f"Unsupported filter operator: {f.op}")
+        if f.op in SET_OPS and not isinstance(f.value, list):
+            raise QueryError(f"Operator '{f.op}' requires a list value")
+    for agg in spec.aggregates:
+        if agg.func not in AGGREGATE_FUNCS:
+            raise QueryError(f"Unsupported aggregate function: {agg.func}")
+        if agg.column is None and agg.func != "count":
+            raise QueryError(f"Aggregate '{agg.func}' requires a column")
+    if spec.limit is not None and spec.limit < 0:
+        raise QueryError("limit must be non-negative")
+    aliases = set()
+    for join in spec.joins:
+        if join.how not in JOIN_TYPES:
+            raise QueryError(f"Unsupported join type: {join.how}")
+        if not join.alias or "." in join.alias or join.alias in aliases:
+            raise QueryError(f"Join alias must be unique and must not contain '.': {join.alias!r}")
+        aliases.add(join.alias)
+        if not join.left_on or len(join.left_on) != len(join.right_on):
+            raise QueryError("Join requires left_on and right_on with the same number of columns")
+
+def normalize_query(spec: QuerySpec) -> Dict[str, Any]:
+    """规范化的查询结构，用作结果缓存的键：过滤条件之间是"与"关系，按内容排序；操作符别名统一"""
+    normalized = spec.dict()
+    filters = [
+        {**f, "op": "==" if f["op"] == "=" else f["op"]}
+        for f in normalized["filters"]
+    ]
+    normalized["filters"] = sorted(filters, key=lambda f: json.dumps(f, sort_keys=True, default=str))
+    return normalized
+
+def aggregate_name(agg: QueryAggregate) -> str:
+    """聚合结果列名：优先使用alias"""
+    if agg.alias:
+        return agg.alias
+    return f"{agg.func}_{agg.column}" if agg.column else agg.func
+
+def output_columns(spec: QuerySpec, columns: Iterable[str]) -> List[str]:
+    """查询结果包含的列"""
+    if spec.group_by or spec.aggregates:
+        return list(spec.group_by) + [aggregate_name(agg) for agg in spec.aggregates]
+    return list(spec.select) if spec.select else list(columns)
+
+def referenced_columns(spec: QuerySpec) -> Optional[List[str]]:
+    """查询需要从存储层读取的列，None表示需要全部列"""
+    if not spec.select and not spec.group_by and not spec.aggregates:
+        return None
+
+    aliases = {aggregate_name(agg) for agg in spec.aggregates}
+    columns = list(spec.select) + [f.column for f in spec.filters] + list(spec.group_by)
+    columns += [agg.column for agg in spec.aggregates if agg.column]
+    columns += [o.column for o in spec.order_by if o.column not in aliases]
+    return list(dict.fromkeys(columns))
+
+def validate_query(spec: QuerySpec, columns: Iterable[str]) -> None:
+    """检查查询是否合法以及引用的列是否存在"""
+    check_spec(spec)
+    available = set(columns)
+    missing = [col for col in referenced_columns(spec) or [] if col not in available]
+    missing += [f.column for f in spec.filters if f.column not in available]
+    if missing:
+        raise QueryError(f"Unknown column: {missing[0]}")
+
+    result_columns = set(output_columns(spec, columns))
+    for order in spec.order_by:
+        if order.column not in result_columns:
+            raise QueryError(f"Cannot order by column not in result: {order.column}")
+
+def split_filters(filters: List[QueryFilter]) -> Tuple[List[QueryFilter], List[QueryFilter]]:
+    """拆分为可下推到Parquet的过滤条件和只能在内存中计算的过滤条件"""
+    pushed = [f for f in filters if f.op in PUSHDOWN_OPS]
+    remaining = [f for f in filters if f.op not in PUSHDOWN_OPS]
+    return pushed, remaining
+
+def to_arrow_expression(filters: List[QueryFilter]) -> ds.Expression:
+    """转换为pyarrow.dataset的过滤表达式（多个条件之间为AND）。
+    与build_mask一致：!=和not in保留该列为空值的行（Arrow的比较结果为空值，会丢弃这些行）"""
+    expression = None
+    for f in filters:
+        field = ds.field(f.column)
+        if f.op in ("==", "="):
+            cond = field == f.value
+        elif f.op == "!=":
+            cond = (field != f.value) | field.is_null(nan_is_null=True)
+        elif f.op == ">":
+            cond = field > f.value
+        elif f.op == ">=":
+            cond = field >= f.value
+        elif f.op == "<":
+            cond = field < f.value
+        elif f.op == "<=":
+            cond = field <= f.value
+        elif f.op == "in":
+            cond = field.isin(f.value)
+        else:
+            cond = ~field.isin(f.value) | field.is_null(nan_is_null=True)
+        expression = cond if expression is None else expression & cond
+    return expression
+
+def build_mask(df: pd.DataFrame, filters: List[QueryFilter]) -> pd.Series:
+    """向量化计算过滤条件，返回布尔掩码"""
+    mask = pd.Series(True, index=df.index)
+    for f in filters:
+        series = df[f.column]
+        try:
+            if f.op in ("==", "="):
+                cond = series == f.value
+            elif f.op == "!=":
+                cond = series != f.value
+            elif f.op == ">":
+                cond = comparable(series) > f.value
+            elif f.op == ">=":
+                cond = comparable(series) >= f.value
+            elif f.op == "<":
+                cond = comparable(series) < f.value
+            elif f.op == "<=":
+                cond = comparable(series) <= f.value
+            elif f.op == "in":
+                cond = series.isin(f.value)
+            elif f.op == "not in":
+                cond = ~series.isin(f.value)
+            elif f.op == "is_null":
+                cond = series.isna()
+            else:
+                cond = series.notna()
+        except TypeError:
+            raise QueryError(f"Cannot compare column '{f.column}' with {f.value!r}")
+        mask &= cond
+    return mask
+
+def apply_query(df: pd.DataFrame, spec: QuerySpec, filters: Optional[List[QueryFilter]] = None) -> pd.DataFrame:
+    """在DataFrame上执行查询；filters为None时计算spec中的全部过滤条件"""
+    filters = spec.filters if filters is None else filters
+    if filters:
+        df = df[build_mask(df, filters)]
+
+    if spec.group_by or spec.aggregates:
+        df = aggregate(df, spec)
+    elif spec.select:
+        df = df[spec.select]
+
+    if spec.order_by:
+        df = df.sort_values(
+            by=[o.column for o in spec.order_by],
+            ascending=[not o.desc for o in spec.order_by],
+            kind="stable",
+            key=comparable,
+        )
+    if spec.limit is not None:
+        df = df.head(spec.limit)
+    return df.reset_index(drop=True)
+
+def aggregate(df: pd.DataFrame, spec: QuerySpec) -> pd.DataFrame:
+    """分组聚合；没有group_by时对整个表聚合为一行"""
+    if not spec.group_by:
+        row = {}
+        for agg in spec.aggregates:
+            if agg.column is None:
+                row[aggregate_name(agg)] = len(df)
+            else:
+                series = df[agg.column]
+                if AGGREGATE_FUNCS[agg.func] in ORDERED_FUNCS:
+                    series = comparable(series)
+                row[aggregate_name(agg)] = getattr(series, AGGREGATE_FUNCS[agg.func])()
+        return pd.DataFrame([row])
+
+    # 类别列的最值按取值本身计算
+    ordered = {
+        agg.column for agg in spec.aggregates
+        if agg.column and AGGREGATE_FUNCS[agg.func] in ORDERED_FUNCS and is_categorical(df[agg.column])
+    }
+    if ordered:
+        df = df.assign(**{col: comparable(df[col]) for col in ordered})
+
+    # pandas按类别列分组时会丢弃该列为空值的行（dropna=False对类别列无效），改按类别编码分组：
+    # 空值的编码为-1，自成一组，分组后再由编码还原为类别
+    categorical = {col: df[col].dtype for col in spec.group_by if is_categorical(df[col])}
+    keys = [df[col].cat.codes.rename(col) if col in categorical else df[col] for col in spec.group_by]
+    grouped = df.groupby(keys, sort=False, observed=True, dropna=False)
+    if not spec.aggregates:
+        result = grouped.size().reset_index()[spec.group_by]
+    else:
+        named = {}
+        for agg in spec.aggregates:
+            if agg.column is None:
+                named[aggregate_name(agg)] = (spec.group_by[0], "size")
+            else:
+                named[aggregate_name(agg)] = (agg.column, AGGREGATE_FUNCS[agg.func])
+        result = grouped.agg(**named).reset_index()
+    for col, dtype in categorical.items():
+        result[col] = pd.Categorical.from_codes(result[col], dtype=dtype)
+    return result
+
+def is_categorical(series: pd.Series) -> bool:
+    return isinstance(series.dtype, pd.CategoricalDtype)
+
+def comparable(series: pd.Series) -> pd.Series:
+    """类别列（导入时字典编码的文本列）的类别顺序是出现顺序，比较、排序和求最值时按取值本身计算"""
+    if is_categorical(series):
+        return series.astype(object)
+    return series
@@ -0,0 +1,197 @@
+import csv
+import hashlib
+import io
+import itertools
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.tracing import span
+
+# 数据集文件路径中表示所选工作表的分隔符：{文件路径}#sheet={工作表名}
+SHEET_SEPARATOR = "#sheet="
+
+# 文件类型 -> 流式读取函数；读取函数逐块返回pyarrow.RecordBatch，各块的列名和顺序相同
+Reader = Callable[[str, Optional[str]], Iterator[pa.RecordBatch]]
+READERS: Dict[str, Reader] = {}
+
+def register_reader(*file_types: str) -> Callable[[Reader], Reader]:
+    """注册文件类型的读取函数"""
+    def decorator(reader: Reader) -> Reader:
+        for file_type in file_types:
+            READERS[file_type] = reader
+        return reader
+    return decorator
+
+def read_batches(file_path: str, file_type: str) -> Iterator[pa.RecordBatch]:
+    """按文件类型选择读取函数，逐块读取数据集文件"""
+    reader = READERS.get(file_type)
+    if reader is None:
+        raise ValueError(f"Unsupported file type: {file_type}")
+    raw_path, sheet = split_sheet(file_path)
+    return reader(raw_path, sheet)
+
+def with_sheet(file_path: str, sheet: Optional[str]) -> str:
+    """在文件路径后附加所选工作表，同一文件的不同工作表作为不同数据源缓存"""
+    return f"{file_path}{SHEET_SEPARATOR}{sheet}" if sheet else file_path
+
+def split_sheet(file_path: str) -> Tuple[str, Optional[str]]:
+    """拆分出原始文件路径和所选工作表"""
+    raw_path, _, sheet = file_path.partition(SHEET_SEPARATOR)
+    return raw_path, sheet or None
+
+def source_suffix(file_path: str) -> str:
+    """列式文件名中区分工作表的后缀（工作表名可能含有路径字符，因此取哈希）"""
+    _, sheet = split_sheet(file_path)
+    if sheet is None:
+        return ""
+    return "." + hashlib.sha1(sheet.encode("utf-8")).hexdigest()[:16]
+
+@register_reader("csv")
+def read_csv_batches(file_path: str, sheet: Optional[str] = None) -> Iterator[pa.RecordBatch]:
+    """用pyarrow逐块解析CSV，每块约CSV_BLOCK_SIZE字节；列类型由第一块推断"""
+    reader = pa_csv.open_csv(
+        file_path,
+        read_options=pa_csv.ReadOptions(block_size=settings.CSV_BLOCK_SIZE),
+        parse_options=pa_csv.ParseOptions(delimiter=detect_delimiter(file_path)),
+        # 与pandas一致，空字符串视为缺失值
+        convert_options=pa_csv.ConvertOptions(strings_can_be_null=True),
+    )
+    names = dedupe_column_names(reader.schema.names)
+    for batch in reader:
+        yield pa.RecordBatch.from_arrays(batch.columns, names=names)
+
+@register_reader("xlsx")
+def read_xlsx_batches(file_path: str, sheet: Optional[str] = None) -> Iterator[pa.RecordBatch]:
+    """用openpyxl的只读模式逐行读取工作表，不在内存中构建整个工作簿；第一行为表头"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = select_worksheet(workbook, sheet).iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        names = dedupe_column_names([str(name) if name is not None else "" for name in header])
+        while True:
+            chunk = list(itertools.islice(rows, settings.READER_CHUNK_ROWS))
+            if not chunk:
+                break
+            # 行的长度可能与表头不同，统一截断或补齐
+            chunk = [row[:len(names)] + (None,) * (len(names) - len(row)) for row in chunk]
+            yield dataframe_batch(pd.DataFrame.from_records(chunk, columns=names))
+    finally:
+        workbook.close()
+
+def select_worksheet(workbook, sheet: Optional[str]):
+    """按名称或从0开始的序号选择工作表，未指定时为第一个工作表"""
+    if sheet is None:
+        return workbook.worksheets[0]
+    if sheet in workbook.sheetnames:
+        return workbook[sheet]
+    if sheet.isdigit() and int(sheet) < len(workbook.worksheets):
+        return workbook.worksheets[int(sheet)]
+    raise ValueError(f"Worksheet not found: {sheet}")
+
+@register_reader("xls")
+def read_xls_batches(file_path: str, sheet: Optional[str] = None) -> Iterator[pa.RecordBatch]:
+    """旧版xls格式没有流式接口，通过pandas（xlrd引擎）整表读取后分块"""
+    try:
+        df = pd.read_excel(file_path, sheet_name=int(sheet) if sheet and sheet.isdigit() else (sheet or 0))
+    except ImportError:
+        raise ValueError("Reading .xls files requires the xlrd package")
+    df.columns = dedupe_column_names([str(col) for col in df.columns])
+    for start in range(0, len(df), settings.READER_CHUNK_ROWS):
+        yield dataframe_batch(df.iloc[start:start + settings.READER_CHUNK_ROWS])
+
+@register_reader("json")
+def read_json_batches(file_path: str, sheet: Optional[str] = None) -> Iterator[pa.RecordBatch]:
+    """读取JSON：每行一个对象的NDJSON逐行流式解析，其余格式（记录数组、单个对象）整体解析；
+    嵌套对象用json_normalize展开为"a.b"形式的列"""
+    with open(file_path, "rb") as f:
+        if is_ndjson(f):
+            records = (orjson.loads(line) for line in f if line.strip())
+        else:
+            records = iter(json_records(orjson.loads(f.read())))
+
+        columns: Optional[List[str]] = None
+        while True:
+            chunk = list(itertools.islice(records, settings.READER_CHUNK_ROWS))
+            if not chunk:
+                break
+            df = pd.json_normalize(chunk)
+            df.columns = [str(col) for col in df.columns]
+            # json_normalize不展开数组，数组值保存为JSON字符串
+            for col in df.columns[df.dtypes == object]:
+                df[col] = df[col].map(json_text)
+            # 缺少字段的块补齐为空列；出现新字段时列与第一块不同，由调用方退回整体解析
+            columns = columns or df.columns.tolist()
+            if set(df.columns) <= set(columns):
+                df = df.reindex(columns=columns)
+            yield dataframe_batch(df)
+
+def is_ndjson(f: io.BufferedReader) -> bool:
+    """有多行且第一行本身是完整的JSON对象时视为NDJSON"""
+    first_line = f.readline()
+    has_more = bool(f.readline().strip())
+    f.seek(0)
+    if not has_more or not first_line.lstrip().startswith(b"{"):
+        return False
+    try:
+        return isinstance(orjson.loads(first_line), dict)
+    except orjson.JSONDecodeError:
+        return False
+
+def json_text(value: Any) -> Any:
+    if isinstance(value, (list, dict)):
+        return orjson.dumps(value).decode("utf-8")
+    return value
+
+def json_records(document: Any) -> List[Any]:
+    """JSON文档中的记录列表：记录数组、{"data": [...]}这类只有一个数组字段的对象，或单个对象"""
+    if isinstance(document, list):
+        return document
+    if isinstance(document, dict):
+        arrays = [value for value in document.values() if isinstance(value, list)]
+        if len(document) == 1 and len(arrays) == 1:
+            return arrays[0]
+        return [document]
+    raise ValueError("JSON file must contain an object or an array of objects")
+
+def dataframe_batch(df: pd.DataFrame) -> pa.RecordBatch:
+    """DataFrame块转为RecordBatch，混合类型的object列退化为字符串列"""
+    try:
+        return pa.RecordBatch.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.select_dtypes(include='object').columns:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pa.RecordBatch.from_pandas(df, preserve_index=False)
+
+def dedupe_column_names(names: List[str]) -> List[str]:
+    """与pandas.read_csv的列名规则一致：空列名为"Unnamed: i"，重复列名依次加".1"、".2"后缀"""
+    result = []
+    seen = set()
+    for i, name in enumerate(names):
+        name = name or f"Unnamed: {i}"
+        candidate, suffix = name, 0
+        while candidate in seen:
+            suffix += 1
+            candidate = f"{name}.{suffix}"
+        seen.add(candidate)
+        result.append(candidate)
+    return result
+
+def detect_delimiter(file_path, sample_lines=5):
+    with span("csv.sniff"):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            # 读取前几行内容（跳过可能的注释行）
+            sample = ''.join([f.readline() for _ in range(sample_lines)])
+
+        # 使用 csv.Sniffer 检测分隔符
+        sniffer = csv.Sniffer()
+        delimiter = sniffer.sniff(sample).delimiter
+    return delimiter
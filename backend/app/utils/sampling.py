@@ -0,0 +1,228 @@
+import glob
+import hashlib
+import os
+import uuid
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.schemas.query import SamplingSpec
+from app.utils.query_engine import QueryError
+from app.utils.tracing import span
+
+SAMPLE_METHODS = {"uniform", "reservoir", "stratified"}
+
+# 样本文件的schema元数据中记录数据集的总行数
+SOURCE_ROWS_KEY = b"numina.source_rows"
+
+# 分层样本中记录每行所在层在数据集中的总行数的列
+STRATUM_ROWS_COLUMN = "_numina_stratum_rows"
+
+def check_sampling(sampling: SamplingSpec) -> None:
+    """检查抽样方式及其参数是否完整"""
+    if sampling.method not in SAMPLE_METHODS:
+        raise QueryError(f"Unsupported sampling method: {sampling.method}")
+    if sampling.method == "uniform" and sampling.fraction is None:
+        raise QueryError("Uniform sampling requires fraction")
+    if sampling.method != "uniform" and sampling.size is None:
+        raise QueryError(f"Sampling method '{sampling.method}' requires size")
+    if sampling.method == "stratified" and not sampling.column:
+        raise QueryError("Stratified sampling requires column")
+
+def sample_rows(sampling: SamplingSpec, total: int) -> int:
+    """抽样结果的（最大）行数，据此选择足够大的预计算样本"""
+    if sampling.method == "uniform":
+        return int(np.ceil(sampling.fraction * total))
+    return min(sampling.size, total)
+
+def sample_path(columnar_path: str, size: int) -> str:
+    """预计算样本的路径：单个列式文件旁边的 *.sample-{size}.parquet；分片目录中以_开头，扫描分片时会被忽略"""
+    if os.path.isdir(columnar_path):
+        return os.path.join(columnar_path, f"_sample-{size}.parquet")
+    root, ext = os.path.splitext(columnar_path)
+    return f"{root}.sample-{size}{ext}"
+
+def strata_sample_path(columnar_path: str, column: str) -> str:
+    """按column分层的样本路径，与均匀样本同名前缀（sample_files一并列出）"""
+    digest = hashlib.sha1(column.encode("utf-8")).hexdigest()[:16]
+    return sample_path(columnar_path, f"strata-{digest}")
+
+def sample_files(columnar_path: str) -> List[str]:
+    """已生成的全部样本文件（包括按旧的 SAMPLE_SIZES 生成的和分层样本）"""
+    if os.path.isdir(columnar_path):
+        return glob.glob(os.path.join(glob.escape(columnar_path), "_sample-*.parquet"))
+    root, ext = os.path.splitext(columnar_path)
+    return glob.glob(f"{glob.escape(root)}.sample-*{ext}")
+
+def count_rows(sources: List[str]) -> int:
+    """从Parquet元数据读取总行数，不读取数据"""
+    return sum(pq.read_metadata(source).num_rows for source in sources)
+
+class BottomK:
+    """bottom-k抽样：为每行生成随机键，只保留键最小的keep行，内存占用与keep相当"""
+
+    def __init__(self, keep: int):
+        self.keep = keep
+        self.rows = 0
+        self._table: Optional[pa.Table] = None
+        self._keys: Optional[np.ndarray] = None
+
+    def offer(self, table: pa.Table, keys: np.ndarray) -> None:
+        self.rows += table.num_rows
+        if self._keys is not None and len(self._keys) >= self.keep:
+            # 候选已满，只有键小于当前第keep小的行才可能进入样本
+            mask = keys < self._keys.max()
+            table, keys = table.filter(pa.array(mask)), keys[mask]
+        if self._table is not None:
+            table = pa.concat_tables([self._table, table])
+            keys = np.concatenate([self._keys, keys])
+        if len(keys) > self.keep:
+            index = np.argpartition(keys, self.keep)[:self.keep]
+            table, keys = table.take(pa.array(index)), keys[index]
+        self._table, self._keys = table.combine_chunks(), keys
+
+    def result(self) -> pa.Table:
+        """按键排序的样本，任意前缀都是均匀样本"""
+        return self._table.take(pa.array(np.argsort(self._keys, kind="stable")))
+
+def iter_row_groups(sources: List[str]):
+    for source in sources:
+        parquet_file = pq.ParquetFile(source)
+        try:
+            for i in range(parquet_file.num_row_groups):
+                yield parquet_file.read_row_group(i)
+        finally:
+            parquet_file.close()
+
+def write_sample_file(path: str, table: pa.Table, total: int) -> None:
+    table = table.replace_schema_metadata({SOURCE_ROWS_KEY: str(total).encode()})
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=settings.COLUMNAR_ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+def write_samples(columnar_path: str, sources: List[str]) -> None:
+    """按 SAMPLE_SIZES 预先计算均匀样本并写成Parquet文件：逐行组做bottom-k抽样，
+    按键排序后各尺寸的样本都是同一序列的前缀"""
+    total = count_rows(sources)
+    sizes = sorted(size for size in set(settings.SAMPLE_SIZES) if size < total)
+    if not sizes:
+        return
+    sampler = BottomK(sizes[-1])
+    rng = np.random.default_rng(settings.SAMPLE_SEED)
+
+    with span("ingest.sample"):
+        for table in iter_row_groups(sources):
+            sampler.offer(table, rng.random(table.num_rows))
+        candidates = sampler.result()
+        for size in sizes:
+            write_sample_file(sample_path(columnar_path, size), candidates.slice(0, size), total)
+
+def write_strata_sample(columnar_path: str, sources: List[str], column: str) -> str:
+    """计算按column分层的样本：每层各自做bottom-k抽样保留 STRATIFIED_SAMPLE_ROWS 行，样本中包含所有的层，
+    STRATUM_ROWS_COLUMN 列记录每层在数据集中的总行数。在均匀样本上再分层会漏掉稀有的层，因此单独计算；
+    不同取值超过 STRATIFIED_MAX_STRATA 时抛出QueryError"""
+    strata: Dict[object, BottomK] = {}
+    rng = np.random.default_rng(settings.SAMPLE_SEED)
+    total = 0
+    with span("sample.stratify"):
+        for table in iter_row_groups(sources):
+            if column not in table.column_names:
+                raise QueryError(f"Unknown column: {column}")
+            total += table.num_rows
+            keys = rng.random(table.num_rows)
+            codes, uniques = pd.factorize(table.column(column).to_pandas())
+            # 按层排序后切片，每层只取一次
+            order = np.argsort(codes, kind="stable")
+            starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+            for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+                code = codes[order[start]]
+                # 空值（code为-1）自成一层
+                value = uniques[code] if code >= 0 else None
+                if value not in strata:
+                    if len(strata) >= settings.STRATIFIED_MAX_STRATA:
+                        raise QueryError(
+                            f"Column '{column}' has more than {settings.STRATIFIED_MAX_STRATA} distinct values "
+                            "and cannot be used for stratified sampling"
+                        )
+                    strata[value] = BottomK(settings.STRATIFIED_SAMPLE_ROWS)
+                rows = pa.array(order[start:end])
+                strata[value].offer(table.take(rows), keys[order[start:end]])
+
+        parts = []
+        for sampler in strata.values():
+            part = sampler.result()
+            parts.append(part.append_column(STRATUM_ROWS_COLUMN, pa.array(np.full(part.num_rows, sampler.rows))))
+        path = strata_sample_path(columnar_path, column)
+        write_sample_file(path, pa.concat_tables(parts).combine_chunks(), total)
+    return path
+
+def read_sample(path: str, columns: Optional[List[str]]) -> pd.DataFrame:
+    """读取样本文件中查询引用的列（None表示全部列）"""
+    with span("sample.load"):
+        if columns is None:
+            return pq.read_table(path).to_pandas()
+        available = set(pq.read_schema(path).names)
+        table = pq.read_table(path, columns=[col for col in columns if col in available])
+        if not table.num_columns:
+            # 只计数时没有需要读取的列，保留行数
+            return pd.DataFrame(index=pd.RangeIndex(table.num_rows))
+        return table.to_pandas()
+
+def draw_strata_sample(df: pd.DataFrame, sampling: SamplingSpec) -> Optional[pd.DataFrame]:
+    """从分层样本中按各层在数据集中的行数分配并抽取；某层需要的行数超过样本中该层保留的行数时返回None"""
+    rng = np.random.default_rng(sampling.seed)
+    with span("sample.draw"):
+        codes = pd.factorize(df[sampling.column])[0]
+        order = np.argsort(codes, kind="stable")
+        _, starts, available = np.unique(codes[order], return_index=True, return_counts=True)
+        counts = df[STRATUM_ROWS_COLUMN].to_numpy()[order[starts]]
+        allocation = allocate(counts, sampling.size)
+        if np.any((allocation > available) & (available < counts)):
+            return None
+        index = [
+            rng.choice(order[start:start + rows], count, replace=False)
+            for start, rows, count in zip(starts, available, allocation) if count
+        ]
+        index = np.sort(np.concatenate(index)) if index else np.array([], dtype=np.int64)
+        return df.drop(columns=STRATUM_ROWS_COLUMN).iloc[index].reset_index(drop=True)
+
+def draw_sample(df: pd.DataFrame, sampling: SamplingSpec, total: int) -> pd.DataFrame:
+    """从df（数据集的均匀样本或全部数据，总行数为total）中按抽样方式和seed再抽样，保持原有的行顺序"""
+    rng = np.random.default_rng(sampling.seed)
+    rows = len(df)
+    with span("sample.draw"):
+        if sampling.method == "uniform":
+            # 均匀样本的均匀子样本仍是数据集的均匀样本，按比例换算到df的行数
+            probability = min(1.0, sampling.fraction * total / rows) if rows else 0.0
+            index = np.flatnonzero(rng.random(rows) < probability)
+        elif sampling.method == "reservoir":
+            index = np.sort(rng.choice(rows, min(sampling.size, rows), replace=False))
+        else:
+            if sampling.column not in df.columns:
+                raise QueryError(f"Unknown column: {sampling.column}")
+            index = stratified_index(pd.factorize(df[sampling.column])[0], sampling.size, rng)
+        return df.iloc[index].reset_index(drop=True)
+
+def stratified_index(codes: np.ndarray, size: int, rng: np.random.Generator) -> np.ndarray:
+    """分层抽样的行号：按allocate分配各层的行数，层内均匀抽取"""
+    order = np.argsort(codes, kind="stable")
+    _, counts = np.unique(codes, return_counts=True)
+    groups = np.split(order, np.cumsum(counts)[:-1])
+    allocation = allocate(counts, size)
+    index = [rng.choice(group, count, replace=False) for group, count in zip(groups, allocation) if count]
+    return np.sort(np.concatenate(index)) if index else np.array([], dtype=np.int64)
+
+def allocate(counts: np.ndarray, size: int) -> np.ndarray:
+    """各层（行数为counts）抽取的行数：行数足够时每层至少1行，其余按各层行数比例分配（最大余数法）"""
+    size = min(size, int(counts.sum()))
+    allocation = np.minimum(counts, 1) if size >= len(counts) else np.zeros_like(counts)
+    rest = counts - allocation
+    share = (size - allocation.sum()) * rest / max(1, rest.sum())
+    allocation += np.floor(share).astype(allocation.dtype)
+    shortfall = size - allocation.sum()
+    if shortfall > 0:
+        allocation[np.argsort(-(share - np.floor(share)), kind="stable")[:shortfall]] += 1
+    return np.minimum(allocation, counts)
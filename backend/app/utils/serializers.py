@@ -0,0 +1,242 @@
+import contextlib
+import numpy as np
+import orjson
+import pandas as pd
+import pyarrow as pa
+from fastapi.responses import Response
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from app.core.config import settings
+from app.schemas.query import QuerySpec, SamplingSpec
+from app.utils.cache import CachedResult, result_cache
+from app.utils.chart_data import render_chart_data, chart_columns, chart_query
+from app.utils.codecs import accepts_encoding, cache_encoding, compress, decompress
+from app.utils.data_processor import to_arrow_table, execute_query, shared_scan, get_columnar_path
+from app.utils.joins import JoinSource
+from app.utils.query_engine import QueryError, parse_query, referenced_columns, normalize_query
+from app.utils.rollups import match_rollup
+from app.utils.tracing import span
+
+# 查询结果支持的输出格式（通过Accept请求头协商）
+ROWS_JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.numina.columnar+json"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """根据Accept请求头选择输出格式，默认返回按行组织的JSON"""
+    if not accept:
+        return ROWS_JSON_MEDIA_TYPE
+
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        if "q=0" in params.replace(" ", "").split(";"):
+            continue
+        media_type = media_type.strip().lower()
+        if media_type in (COLUMNAR_JSON_MEDIA_TYPE, ARROW_STREAM_MEDIA_TYPE):
+            return media_type
+    return ROWS_JSON_MEDIA_TYPE
+
+def render_query(
+    file_path: str, file_type: str, query_string: str, offset: int, page_size: Optional[int], result_format: str,
+    sampling: Optional[SamplingSpec] = None, join_sources: Optional[List[JoinSource]] = None
+) -> CachedResult:
+    """执行查询并按输出格式编码当前页，在进程池中执行，返回可直接缓存的响应"""
+    result = execute_query(
+        file_path, file_type, query_string, offset=offset, page_size=page_size, as_records=False,
+        sampling=sampling, join_sources=join_sources
+    )
+    page = result['page']
+    if result_format == ARROW_STREAM_MEDIA_TYPE:
+        # 分页和抽样信息放在响应头中
+        headers = {"X-Row-Count": str(result['row_count'])}
+        if result['next_offset'] is not None:
+            headers["X-Next-Offset"] = str(result['next_offset'])
+        if result['sampling_ratio'] is not None:
+            headers.update(sampling_headers(result['sampling_ratio']))
+        with span("encode.arrow"):
+            content = to_arrow_ipc(page)
+        return precompress(CachedResult(content, result_format, headers))
+
+    extra = {
+        "row_count": result['row_count'],
+        "offset": result['offset'],
+        "next_offset": result['next_offset']
+    }
+    if result['sampling_ratio'] is not None:
+        extra.update({"sampled": True, "sampling_ratio": result['sampling_ratio']})
+    with span("encode.json"):
+        if result_format == COLUMNAR_JSON_MEDIA_TYPE:
+            entry = CachedResult(to_columnar_json(page, extra), result_format, {})
+        else:
+            entry = CachedResult(to_rows_json(page, extra), ROWS_JSON_MEDIA_TYPE, {})
+    return precompress(entry)
+
+def render_chart(
+    file_path: str, file_type: str, visualization_id: int, visualization_type: str,
+    config_str: str, width: Optional[int]
+) -> CachedResult:
+    """计算图表数据并编码为JSON，在进程池中执行"""
+    with span("chart.compute"):
+        chart = render_chart_data(file_path, file_type, visualization_type, config_str, width)
+    df = chart['result']
+    with span("encode.json"):
+        content = to_rows_json(df, {
+            "visualization_id": visualization_id,
+            "visualization_type": visualization_type,
+            "point_count": len(df),
+            "source_row_count": chart['source_row_count']
+        })
+    return precompress(CachedResult(content, ROWS_JSON_MEDIA_TYPE, {}))
+
+def precompress(entry: CachedResult) -> CachedResult:
+    """按 RESULT_CACHE_ENCODING 压缩结果后再缓存，之后命中时直接发送压缩后的字节，不再重新序列化和压缩；
+    小于 COMPRESSION_MIN_SIZE 的结果不压缩"""
+    encoding = cache_encoding()
+    if encoding is None or len(entry.content) < settings.COMPRESSION_MIN_SIZE:
+        return entry
+    with span("encode.compress"):
+        return entry._replace(content=compress(entry.content, encoding), encoding=encoding)
+
+def result_bytes(entry: CachedResult) -> bytes:
+    """结果的原始（未压缩）字节"""
+    if entry.encoding is None:
+        return entry.content
+    return decompress(entry.content, entry.encoding)
+
+def sampling_headers(sampling_ratio: float) -> Dict[str, str]:
+    """Arrow和NDJSON响应没有放置抽样信息的字段，通过响应头说明"""
+    return {"X-Sampled": "true", "X-Sampling-Ratio": repr(sampling_ratio)}
+
+class BatchTask(NamedTuple):
+    """批量计算中的一项：kind为"query"时args是render_query的参数，为"chart"时是render_chart的参数（均不含文件路径和类型）"""
+    kind: str
+    args: Tuple
+
+def render_batch(file_path: str, file_type: str, tasks: List[BatchTask]) -> List[Union[CachedResult, QueryError]]:
+    """计算同一数据集上的多个查询和图表：各项引用列的并集只读取一次，再分别在内存中计算；
+    抽样查询和能由预聚合表回答的项不参与读取；单项出错时在对应位置返回QueryError，不影响其他项"""
+    columnar_path = get_columnar_path(file_path)
+    columns: Optional[List[str]] = []
+    scanned = False
+    for task in tasks:
+        if task.kind == "chart":
+            spec = chart_query(task.args[1], task.args[2])
+            task_columns = chart_columns(task.args[1], task.args[2])
+        elif task.args[4] is not None:
+            # 抽样查询只读取预先计算的样本，不参与读取数据集
+            continue
+        else:
+            try:
+                spec = parse_query(task.args[0])
+                task_columns = referenced_columns(spec)
+            except QueryError:
+                spec, task_columns = None, []
+        if spec is not None and match_rollup(columnar_path, spec) is not None:
+            continue
+        scanned = True
+        columns = None if columns is None or task_columns is None else columns + task_columns
+
+    results = []
+    scan = shared_scan(file_path, file_type, list(dict.fromkeys(columns)) if columns is not None else None)
+    with scan if scanned else contextlib.nullcontext():
+        for task in tasks:
+            render = render_chart if task.kind == "chart" else render_query
+            try:
+                results.append(render(file_path, file_type, *task.args))
+            except QueryError as e:
+                results.append(e)
+    return results
+
+def batch_result(entry: CachedResult) -> bytes:
+    """批量响应中成功的一项，直接拼接已编码的结果，不再重新序列化"""
+    return b'{"status":200,"result":' + result_bytes(entry) + b'}'
+
+def batch_error(status_code: int, detail: Any) -> bytes:
+    return orjson.dumps({"status": status_code, "detail": detail})
+
+def query_key(
+    file_path: str, spec: QuerySpec, offset: int, page_size: Optional[int], result_format: str,
+    sampling: Optional[SamplingSpec] = None, join_sources: Optional[List[JoinSource]] = None
+) -> Tuple[str, str]:
+    """查询结果的缓存键，单个查询和批量请求共用；抽样查询的键包含抽样方式和seed，
+    连接查询的键包含连接的数据集的文件路径（内容寻址，数据变化时路径随之变化）"""
+    page_size = min(page_size or settings.QUERY_DEFAULT_PAGE_SIZE, settings.QUERY_MAX_PAGE_SIZE)
+    parts = [normalize_query(spec), offset, page_size, result_format]
+    if sampling is not None:
+        parts.append(sampling.dict())
+    if join_sources:
+        parts.append([source.file_path for source in join_sources])
+    return result_cache.make_key(file_path, "query", *parts)
+
+def chart_key(file_path: str, visualization_id: int, visualization_type: str, config_str: str, width: Optional[int]) -> Tuple[str, str]:
+    """图表数据的缓存键，单个图表和批量请求共用"""
+    return result_cache.make_key(file_path, "chart", visualization_id, visualization_type, config_str, width)
+
+def make_etag(key: Tuple[str, str]) -> str:
+    """结果缓存键决定了响应内容，直接用作强ETag"""
+    return f'"{key[1]}"'
+
+def cached_response(entry: Optional[CachedResult], etag: str, accept_encoding: Optional[str] = None) -> Response:
+    """返回缓存的结果；entry为None时返回304（客户端已有该版本）。浏览器每次都需携带ETag重新验证。
+    客户端接受结果的压缩编码时直接发送压缩后的字节（弱ETag），否则解压后发送"""
+    headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding", "Cache-Control": "private, no-cache"}
+    if entry is None:
+        return Response(status_code=304, headers=headers)
+    if entry.encoding is None:
+        return Response(entry.content, media_type=entry.media_type, headers={**entry.headers, **headers})
+    if accepts_encoding(accept_encoding, entry.encoding):
+        headers.update({"ETag": f"W/{etag}", "Content-Encoding": entry.encoding})
+        return Response(entry.content, media_type=entry.media_type, headers={**entry.headers, **headers})
+    return Response(result_bytes(entry), media_type=entry.media_type, headers={**entry.headers, **headers})
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match中是否包含当前ETag（比较时忽略弱校验前缀W/）"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag[2:] == etag if tag.startswith("W/") else tag == etag for tag in candidates)
+
+def to_arrow_ipc(df: pd.DataFrame) -> bytes:
+    """编码为Arrow IPC流格式"""
+    table = to_arrow_table(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def to_columnar_json(df: pd.DataFrame, extra: Optional[Dict[str, Any]] = None) -> bytes:
+    """编码为按列组织的JSON：{columns, arrays, ...}，数值列直接序列化NumPy缓冲区"""
+    content = {
+        "columns": df.columns.tolist(),
+        "arrays": [column_array(df[col]) for col in df.columns],
+    }
+    content.update(extra or {})
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY, default=json_default)
+
+def to_rows_json(df: pd.DataFrame, extra: Optional[Dict[str, Any]] = None) -> bytes:
+    """编码为按行组织的JSON：{columns, data, ...}，缺失值输出为null"""
+    content = {
+        "columns": df.columns.tolist(),
+        "data": df.to_dict(orient="records"),
+    }
+    content.update(extra or {})
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY, default=json_default)
+
+def column_array(series: pd.Series) -> Any:
+    """单列转换为可序列化的数组：数值和布尔列保留NumPy数组，其余列转换为列表并把缺失值转为null"""
+    values = series.to_numpy()
+    if values.dtype.kind in "biuf":
+        return np.ascontiguousarray(values)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = series.dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return series.astype(object).where(series.notna(), None).tolist()
+
+def json_default(value: Any) -> Any:
+    """orjson无法直接序列化的类型"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return str(value)
@@ -0,0 +1,134 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.utils.metrics import SPAN_LATENCY, registry
+
+# 导出的追踪数据：(阶段耗时 {名称: [次数, 总秒数]}, 计数器 [(指标名, 标签, 增量)], 性能分析摘要)
+ExportedTrace = Tuple[Dict[str, List[float]], List[Tuple[str, Dict[str, Any], float]], List[str]]
+
+class Trace:
+    """一次请求或一次进程池任务的追踪：按名称累计各阶段的次数和耗时，以及计数器增量。
+    remote为True表示在进程池中收集，由主进程合并后再计入指标"""
+
+    def __init__(self, profile: bool = False, remote: bool = False):
+        self.profile = profile
+        self.remote = remote
+        self.spans: Dict[str, List[float]] = {}
+        self.counters: List[Tuple[str, Dict[str, Any], float]] = []
+        self.profiles: List[str] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, count: float, seconds: float) -> None:
+        with self._lock:
+            total = self.spans.setdefault(name, [0, 0.0])
+            total[0] += count
+            total[1] += seconds
+
+    def add_counter(self, metric: str, labels: Dict[str, Any], value: float) -> None:
+        with self._lock:
+            self.counters.append((metric, labels, value))
+
+    def add_profiles(self, profiles: List[str]) -> None:
+        with self._lock:
+            self.profiles.extend(profiles)
+
+    def export(self) -> ExportedTrace:
+        with self._lock:
+            return dict(self.spans), list(self.counters), list(self.profiles)
+
+    def server_timing(self, total: float) -> str:
+        """Server-Timing响应头：总耗时和各阶段累计耗时（毫秒）"""
+        with self._lock:
+            spans = list(self.spans.items())
+        parts = [f"total;dur={total * 1000:.1f}"]
+        parts += [f'{name};dur={seconds * 1000:.1f};desc="x{int(count)}"' for name, (count, seconds) in spans]
+        return ", ".join(parts)
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+def start_trace(trace: Trace):
+    return _current_trace.set(trace)
+
+def end_trace(token) -> None:
+    _current_trace.reset(token)
+
+def profiling() -> bool:
+    trace = _current_trace.get()
+    return trace is not None and trace.profile
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """记录一个命名阶段的耗时：计入当前请求的追踪（Server-Timing和慢请求日志）和阶段耗时直方图"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, 1, time.perf_counter() - started)
+
+def timed_iter(name: str, iterable: Iterable[Any]) -> Iterator[Any]:
+    """逐项迭代并把每次取下一项的耗时计入同一阶段，用于统计逐块解析等生成器的耗时"""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            record_span(name, 1, time.perf_counter() - started)
+        yield item
+
+def record_span(name: str, count: float, seconds: float) -> None:
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, count, seconds)
+    if trace is None or not trace.remote:
+        SPAN_LATENCY.observe(seconds, span=name)
+
+def add(metric: str, value: float = 1.0, **labels: Any) -> None:
+    """计数器加value；在进程池中执行时先记在追踪中，任务返回后由主进程计入"""
+    trace = _current_trace.get()
+    if trace is not None and trace.remote:
+        trace.add_counter(metric, labels, value)
+    else:
+        registry.get(metric).inc(value, **labels)
+
+def traced_call(profile: bool, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Tuple[Any, ExportedTrace]:
+    """在进程池（或线程池）中执行func并收集追踪数据，profile为True时同时用cProfile分析"""
+    trace = Trace(profile=profile, remote=True)
+    token = _current_trace.set(trace)
+    try:
+        if profile:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(func, *args, **kwargs)
+            trace.add_profiles([f"{getattr(func, '__name__', func)}\n{profile_summary(profiler)}"])
+        else:
+            result = func(*args, **kwargs)
+    finally:
+        _current_trace.reset(token)
+    return result, trace.export()
+
+def merge_trace(exported: ExportedTrace) -> None:
+    """把进程池任务的追踪数据合并到当前请求，并计入指标"""
+    spans, counters, profiles = exported
+    for name, (count, seconds) in spans.items():
+        record_span(name, count, seconds)
+    for metric, labels, value in counters:
+        add(metric, value, **labels)
+    trace = _current_trace.get()
+    if trace is not None and profiles:
+        trace.add_profiles(profiles)
+
+def profile_summary(profiler: cProfile.Profile) -> str:
+    """按累计耗时排序的前 REQUEST_PROFILE_TOP_FUNCTIONS 个函数"""
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(settings.REQUEST_PROFILE_TOP_FUNCTIONS)
+    return stream.getvalue()
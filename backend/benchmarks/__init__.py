@@ -0,0 +1 @@
+# 导入、查询和响应编码等热点路径的基准测试，运行方法见README.md
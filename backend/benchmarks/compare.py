@@ -0,0 +1,87 @@
+"""比较两次基准测试的结果：python -m benchmarks.compare 当前结果.json 基线.json"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, TextIO
+
+# 指标后缀 -> 忽略的绝对差值；差值小于它时视为测量噪声。全部指标都是越小越好
+NOISE_FLOORS = {
+    "_ms": 2.0,
+    "_s": 0.05,
+    "_mb": 5.0,
+    "bytes": 0,
+}
+
+# 这些环境信息不同时，两次结果不可直接比较
+ENVIRONMENT_KEYS = ("platform", "cpu_count", "process_workers", "repeat", "seed")
+
+def noise_floor(metric: str) -> Optional[float]:
+    for suffix, floor in NOISE_FLOORS.items():
+        if metric.endswith(suffix):
+            return floor
+    return None
+
+def index_results(report: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    return {result["case"]: result.get("metrics", {}) for result in report.get("results", [])}
+
+def environment_mismatch(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    current, previous = report.get("environment", {}), baseline.get("environment", {})
+    return [key for key in ENVIRONMENT_KEYS if current.get(key) != previous.get(key)]
+
+def compare_results(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """逐个比较两边都有的用例和指标，相对变化超过tolerance且超过噪声下限时记为退化"""
+    current, previous = index_results(report), index_results(baseline)
+    rows = []
+    for case in sorted(current.keys() & previous.keys()):
+        for metric in sorted(current[case].keys() & previous[case].keys()):
+            new, old = current[case][metric], previous[case][metric]
+            floor = noise_floor(metric)
+            if new is None or old is None or floor is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+            rows.append({
+                "case": case,
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change": change,
+                "regressed": change > tolerance and new - old > floor,
+                "improved": change < -tolerance and old - new > floor,
+            })
+    return rows
+
+def print_comparison(rows: List[Dict[str, Any]], file: TextIO = sys.stdout, show_all: bool = False) -> None:
+    """默认只列出退化和改进的指标"""
+    for row in rows:
+        if not show_all and not (row["regressed"] or row["improved"]):
+            continue
+        mark = "REGRESSED" if row["regressed"] else ("improved" if row["improved"] else "")
+        print(
+            f"{row['case']:<24} {row['metric']:<32} {row['baseline']:>12} -> {row['current']:>12} "
+            f"{row['change']:>+8.1%} {mark}",
+            file=file,
+        )
+    regressed = sum(row["regressed"] for row in rows)
+    improved = sum(row["improved"] for row in rows)
+    print(f"{len(rows)} metrics compared, {regressed} regressed, {improved} improved", file=file)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare benchmark results against a baseline")
+    parser.add_argument("current")
+    parser.add_argument("baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="允许的相对退化比例")
+    parser.add_argument("--all", action="store_true", help="列出全部指标")
+    args = parser.parse_args(argv)
+
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    for key in environment_mismatch(current, baseline):
+        print(f"warning: {key} differs from the baseline", file=sys.stderr)
+    rows = compare_results(current, baseline, args.tolerance)
+    print_comparison(rows, show_all=args.all)
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import os
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+# 生成数据时每次写出的行数
+CHUNK_ROWS = 100000
+
+# xlsx工作表的最大行数（含表头）
+XLSX_MAX_ROWS = 1048576 - 1
+
+CATEGORIES = [f"category_{i:02d}" for i in range(20)]
+REGIONS = ["north", "south", "east", "west", "central"]
+
+# 宽表在窄表基础上增加的列
+WIDE_METRIC_COLUMNS = [f"metric_{i:02d}" for i in range(30)]
+WIDE_CODE_COLUMNS = [f"code_{i:02d}" for i in range(14)]
+
+SHAPES = ("narrow", "wide")
+FORMATS = ("csv", "json", "xlsx")
+
+def dataset_columns(shape: str) -> List[str]:
+    columns = ["id", "category", "region", "value", "quantity", "date"]
+    if shape == "wide":
+        columns += WIDE_METRIC_COLUMNS + WIDE_CODE_COLUMNS
+    return columns
+
+def make_chunk(shape: str, start: int, rows: int, seed: int) -> pd.DataFrame:
+    """生成一块确定的数据：同样的shape、起始行和种子总是得到相同的内容"""
+    rng = np.random.default_rng([seed, start])
+    ids = np.arange(start, start + rows, dtype=np.int64)
+    data: Dict[str, object] = {
+        "id": ids,
+        "category": np.array(CATEGORIES)[rng.integers(0, len(CATEGORIES), rows)],
+        "region": np.array(REGIONS)[rng.integers(0, len(REGIONS), rows)],
+        "value": np.round(rng.normal(100.0, 25.0, rows), 4),
+        "quantity": rng.integers(0, 1000, rows),
+        "date": (pd.Timestamp("2020-01-01") + pd.to_timedelta(ids % 1461, unit="D")).strftime("%Y-%m-%d"),
+    }
+    if shape == "wide":
+        for column in WIDE_METRIC_COLUMNS:
+            data[column] = np.round(rng.random(rows) * 1000, 3)
+        for i, column in enumerate(WIDE_CODE_COLUMNS):
+            # 各列取值个数不同，覆盖低基数和高基数的文本列
+            cardinality = 10 ** (1 + i % 4)
+            data[column] = np.char.add(f"c{i}_", rng.integers(0, cardinality, rows).astype(str))
+    return pd.DataFrame(data)
+
+def iter_chunks(shape: str, rows: int, seed: int):
+    for start in range(0, rows, CHUNK_ROWS):
+        yield make_chunk(shape, start, min(CHUNK_ROWS, rows - start), seed)
+
+def write_csv(path: str, shape: str, rows: int, seed: int) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for i, chunk in enumerate(iter_chunks(shape, rows, seed)):
+            chunk.to_csv(f, index=False, header=i == 0)
+
+def write_json(path: str, shape: str, rows: int, seed: int) -> None:
+    """每行一个对象（NDJSON），导入时可以流式解析"""
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in iter_chunks(shape, rows, seed):
+            f.write(chunk.to_json(orient="records", lines=True))
+            f.write("\n")
+
+def write_xlsx(path: str, shape: str, rows: int, seed: int) -> None:
+    from openpyxl import Workbook
+
+    if rows > XLSX_MAX_ROWS:
+        raise ValueError(f"xlsx supports at most {XLSX_MAX_ROWS} rows")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("data")
+    sheet.append(dataset_columns(shape))
+    for chunk in iter_chunks(shape, rows, seed):
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append([value.item() if isinstance(value, np.generic) else value for value in row])
+    workbook.save(path)
+
+WRITERS: Dict[str, Callable[[str, str, int, int], None]] = {
+    "csv": write_csv,
+    "json": write_json,
+    "xlsx": write_xlsx,
+}
+
+def generate_dataset(directory: str, file_format: str, shape: str, rows: int, seed: int = 0) -> str:
+    """生成合成数据文件并返回路径；文件名包含全部参数，已存在时直接复用"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{shape}-{rows}-s{seed}.{file_format}")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.tmp"
+        WRITERS[file_format](tmp_path, shape, rows, seed)
+        os.replace(tmp_path, path)
+    return path
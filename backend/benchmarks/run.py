@@ -0,0 +1,342 @@
+"""基准测试：生成合成数据集，通过TestClient走完整的HTTP路径，测量
+- 上传到导入完成（ready）的时间和导入期间的峰值内存
+- 各接口的冷/热延迟、响应字节数和峰值内存
+
+结果以JSON输出，可以用 --baseline 与保存的基线比较。用法见 benchmarks/README.md
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.compare import compare_results, environment_mismatch, print_comparison
+from benchmarks.datasets import FORMATS, SHAPES, XLSX_MAX_ROWS, generate_dataset
+
+PRESETS = {
+    "quick": [10000, 100000],
+    "full": [10000, 100000, 1000000, 10000000],
+}
+
+# 等待导入完成时查询数据集状态的间隔（秒）
+POLL_INTERVAL = 0.02
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Numina backend benchmarks")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick", help="数据规模预设")
+    parser.add_argument("--sizes", help="逗号分隔的行数，指定时覆盖--preset")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="逗号分隔的文件格式")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help="逗号分隔的表形状：narrow（6列）、wide（50列）")
+    parser.add_argument("--repeat", type=int, default=5, help="热请求的重复次数，取中位数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--process-workers", type=int, default=0,
+                        help="PROCESS_POOL_WORKERS；默认0，在本进程中执行，冷请求前可以清空全部缓存")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "numina-benchmarks"),
+                        help="合成数据文件目录，已生成的文件会复用")
+    parser.add_argument("--output", help="结果JSON的写出路径，默认输出到标准输出")
+    parser.add_argument("--baseline", help="与该基线结果比较，有退化时退出码为1")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="允许的相对退化比例")
+    return parser.parse_args(argv)
+
+def configure_environment(work_dir: str, args: argparse.Namespace) -> None:
+    """数据库、上传目录和缓存目录都放在临时目录中，必须在导入app之前调用"""
+    os.environ.update({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(work_dir, 'app.db')}",
+        "UPLOAD_FOLDER": os.path.join(work_dir, "uploads"),
+        "SHARED_CACHE_DIR": os.path.join(work_dir, "cache"),
+        "RESULT_CACHE_DIR": os.path.join(work_dir, "cache", "results"),
+        "PROCESS_POOL_WORKERS": str(args.process_workers),
+        "MAX_CONTENT_LENGTH": str(64 * 1024 ** 3),
+        "SECRET_KEY": "benchmark",
+    })
+
+def process_tree_rss() -> int:
+    """当前进程及其全部子进程（进程池）的常驻内存字节数"""
+    if not os.path.exists("/proc/self/statm"):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # 只能取到历史峰值；macOS单位为字节，Linux为KB
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total, pending = 0, [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            # 进程已退出
+            continue
+    return total
+
+class RssSampler:
+    """在后台线程中定时采样常驻内存，记录with块执行期间的峰值"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process_tree_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self.peak = process_tree_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, process_tree_rss())
+
+    @property
+    def peak_mb(self) -> float:
+        return round(self.peak / 1024 ** 2, 1)
+
+class Benchmark:
+    def __init__(self, client, headers: Dict[str, str], repeat: int):
+        self.client = client
+        self.headers = headers
+        self.repeat = repeat
+
+    def upload(self, path: str) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        """上传文件并等待导入完成，返回数据集和导入指标"""
+        with RssSampler() as sampler:
+            started = time.perf_counter()
+            with open(path, "rb") as f:
+                response = self.client.post(
+                    "/api/datasets", headers=self.headers,
+                    data={"dataset_in": json.dumps({"name": os.path.basename(path)})},
+                    files={"file": (os.path.basename(path), f)},
+                )
+            uploaded = time.perf_counter()
+            check_response(response, "upload")
+            dataset = response.json()
+            while dataset["status"] not in ("ready", "failed"):
+                time.sleep(POLL_INTERVAL)
+                dataset = self.client.get(f"/api/datasets/{dataset['id']}", headers=self.headers).json()
+            ready = time.perf_counter()
+        if dataset["status"] != "ready":
+            job = self.client.get(f"/api/datasets/{dataset['id']}/job", headers=self.headers).json()
+            raise RuntimeError(f"ingestion failed: {job.get('error')}")
+        return dataset, {
+            "upload_s": round(uploaded - started, 4),
+            "ready_s": round(ready - started, 4),
+            "ingest_peak_rss_mb": sampler.peak_mb,
+        }
+
+    def measure(self, name: str, send: Callable[[], Any], reset: Callable[[], None]) -> Dict[str, float]:
+        """先清空缓存测一次冷请求，再重复测热请求，热延迟取中位数"""
+        reset()
+        gc.collect()
+        with RssSampler() as sampler:
+            started = time.perf_counter()
+            response = send()
+            cold = time.perf_counter() - started
+        check_response(response, name)
+
+        warm = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            check_response(send(), name)
+            warm.append(time.perf_counter() - started)
+        return {
+            f"{name}.cold_ms": round(cold * 1000, 3),
+            f"{name}.warm_ms": round(statistics.median(warm) * 1000, 3) if warm else None,
+            f"{name}.bytes": len(response.content),
+            f"{name}.peak_rss_mb": sampler.peak_mb,
+        }
+
+def check_response(response, name: str) -> None:
+    if response.status_code != 200:
+        raise RuntimeError(f"{name}: HTTP {response.status_code} {response.text[:200]}")
+
+# 分组聚合查询，也是预聚合用例声明的维度和度量
+GROUP_BY_QUERY = {
+    "group_by": ["category", "region"],
+    "aggregates": [
+        {"func": "count"},
+        {"func": "sum", "column": "value"},
+        {"func": "mean", "column": "quantity"},
+    ],
+}
+ROLLUP = {
+    "dimensions": ["category", "region"],
+    "measures": [{"column": "value", "funcs": ["sum"]}, {"column": "quantity", "funcs": ["sum", "count"]}],
+}
+
+def endpoint_requests(bench: Benchmark, dataset_id: int) -> Dict[str, Callable[[], Any]]:
+    """要测量的接口：名称 -> 发送请求的函数"""
+    client, headers = bench.client, bench.headers
+
+    def create_visualization(visualization_type: str, config: Dict[str, Any]) -> int:
+        response = client.post("/api/visualizations", headers=headers, json={
+            "name": f"benchmark {visualization_type}", "visualization_type": visualization_type,
+            "config": json.dumps(config), "dataset_id": dataset_id,
+        })
+        check_response(response, f"create {visualization_type} visualization")
+        return response.json()["id"]
+
+    bar_id = create_visualization("bar", {"xKey": "category", "yKey": "value", "aggregate": "mean"})
+    line_id = create_visualization("line", {"xKey": "id", "yKey": "value"})
+
+    def query(spec: Dict[str, Any], page_size: int = 1000, accept: Optional[str] = None) -> Callable[[], Any]:
+        body = {"dataset_id": dataset_id, "query_string": json.dumps(spec) if spec else "", "page_size": page_size}
+        request_headers = {**headers, "Accept": accept} if accept else headers
+        return lambda: client.post("/api/analytics/query", headers=request_headers, json=body)
+
+    group_by = GROUP_BY_QUERY
+    batch = {"items": [
+        {"visualization_id": bar_id},
+        {"visualization_id": line_id, "width": 1200},
+        {"dataset_id": dataset_id, "query_string": json.dumps(group_by)},
+    ]}
+    return {
+        "stats": lambda: client.get(f"/api/datasets/{dataset_id}/stats", headers=headers),
+        "query_page": query({}),
+        "query_page_arrow": query({}, accept=ARROW_MEDIA_TYPE),
+        "query_filter_sort": query({
+            "filters": [
+                {"column": "category", "op": "==", "value": "category_03"},
+                {"column": "value", "op": ">", "value": 100},
+            ],
+            "order_by": [{"column": "value", "desc": True}],
+        }),
+        "query_group_by": query(group_by),
+        "chart_bar": lambda: client.get(f"/api/visualizations/{bar_id}/data", headers=headers),
+        "chart_line": lambda: client.get(f"/api/visualizations/{line_id}/data?width=1200", headers=headers),
+        "batch": lambda: client.post("/api/analytics/batch", headers=headers, json=batch),
+    }
+
+def run_case(bench: Benchmark, path: str) -> Dict[str, Any]:
+    from app.db.session import SessionLocal
+    from app.models.dataset import Dataset
+    from app.utils.data_processor import invalidate_dataset
+
+    dataset, metrics = bench.upload(path)
+    with SessionLocal() as db:
+        file_path = db.query(Dataset.file_path).filter(Dataset.id == dataset["id"]).scalar()
+    try:
+        for name, send in endpoint_requests(bench, dataset["id"]).items():
+            metrics.update(bench.measure(name, send, lambda: invalidate_dataset(file_path)))
+        # 其他接口测完后再声明预聚合，避免影响它们的结果；同一个分组聚合查询改由预聚合表回答
+        started = time.perf_counter()
+        check_response(bench.client.post(
+            f"/api/datasets/{dataset['id']}/rollups", headers=bench.headers, json=ROLLUP
+        ), "create rollup")
+        metrics["rollup_build_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        body = {"dataset_id": dataset["id"], "query_string": json.dumps(GROUP_BY_QUERY), "page_size": 1000}
+        metrics.update(bench.measure(
+            "query_group_by_rollup",
+            lambda: bench.client.post("/api/analytics/query", headers=bench.headers, json=body),
+            lambda: invalidate_dataset(file_path),
+        ))
+    finally:
+        bench.client.delete(f"/api/datasets/{dataset['id']}", headers=bench.headers)
+        gc.collect()
+    return metrics
+
+def environment_info(args: argparse.Namespace) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "process_workers": args.process_workers,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")] if args.sizes else PRESETS[args.preset]
+    formats = [item for item in args.formats.split(",") if item]
+    shapes = [item for item in args.shapes.split(",") if item]
+
+    work_dir = tempfile.mkdtemp(prefix="numina-bench-")
+    configure_environment(work_dir, args)
+    from fastapi.testclient import TestClient
+    from app.core.config import settings
+    from app.main import app
+
+    results = []
+    try:
+        with TestClient(app) as client:
+            response = client.post("/api/auth/login", data={
+                "username": settings.FIRST_SUPERUSER, "password": settings.FIRST_SUPERUSER_PASSWORD,
+            })
+            check_response(response, "login")
+            bench = Benchmark(client, {"Authorization": f"Bearer {response.json()['access_token']}"}, args.repeat)
+
+            for rows in sizes:
+                for shape in shapes:
+                    for file_format in formats:
+                        case = f"{file_format}/{shape}/{rows}"
+                        if file_format == "xlsx" and rows > XLSX_MAX_ROWS:
+                            print(f"skip {case}: exceeds xlsx row limit", file=sys.stderr)
+                            continue
+                        print(f"generating {case}", file=sys.stderr)
+                        path = generate_dataset(args.data_dir, file_format, shape, rows, args.seed)
+                        print(f"running {case}", file=sys.stderr)
+                        result = {
+                            "case": case, "format": file_format, "shape": shape, "rows": rows,
+                            "file_bytes": os.path.getsize(path),
+                        }
+                        try:
+                            result["metrics"] = run_case(bench, path)
+                        except Exception as e:
+                            result["error"] = str(e)
+                            print(f"  failed: {e}", file=sys.stderr)
+                        results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"environment": environment_info(args), "results": results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    failed = any("error" in result for result in results)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        for key in environment_mismatch(report, baseline):
+            print(f"warning: {key} differs from the baseline", file=sys.stderr)
+        rows = compare_results(report, baseline, args.tolerance)
+        print_comparison(rows, file=sys.stderr)
+        failed = failed or any(row["regressed"] for row in rows)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+# 在导入应用之前把数据库、上传目录和缓存目录指向临时目录
+_tmp = tempfile.mkdtemp(prefix="numina-tests-")
+os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{_tmp}/app.db"
+os.environ["UPLOAD_FOLDER"] = os.path.join(_tmp, "uploads")
+os.environ["SHARED_CACHE_DIR"] = os.path.join(_tmp, "cache")
+os.environ["RESULT_CACHE_DIR"] = os.path.join(_tmp, "results")
+os.environ["PROCESS_POOL_WORKERS"] = "0"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.main import app  # noqa: E402
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as c:
+        yield c
+
+@pytest.fixture(scope="session")
+def headers(client):
+    response = client.post("/api/auth/login", data={
+        "username": settings.FIRST_SUPERUSER, "password": settings.FIRST_SUPERUSER_PASSWORD
+    })
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+@pytest.fixture
+def upload(client, headers):
+    """上传文件并等待导入完成，返回数据集；测试结束后删除"""
+    created = []
+
+    def _upload(name: str, content: bytes, wait: bool = True):
+        response = client.post(
+            "/api/datasets", headers=headers,
+            data={"dataset_in": json.dumps({"name": name})}, files={"file": (name, content)},
+        )
+        assert response.status_code == 200, response.text
+        dataset = response.json()
+        created.append(dataset["id"])
+        deadline = time.time() + 30
+        while wait and dataset["status"] not in ("ready", "failed") and time.time() < deadline:
+            time.sleep(0.05)
+            dataset = client.get(f"/api/datasets/{dataset['id']}", headers=headers).json()
+        return dataset
+
+    yield _upload
+    for dataset_id in created:
+        client.delete(f"/api/datasets/{dataset_id}", headers=headers)
+
+@pytest.fixture
+def query(client, headers):
+    """执行/analytics/query，返回响应"""
+    def _query(dataset_id: int, spec: dict, **body):
+        return client.post("/api/analytics/query", headers=headers, json={
+            "dataset_id": dataset_id, "query_string": json.dumps(spec), **body
+        })
+    return _query
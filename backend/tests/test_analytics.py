@@ -0,0 +1,35 @@
+import json
+
+def make_csv(rows: int = 200) -> bytes:
+    regions = ["north", "", "south", "east"]
+    lines = ["region,amount"] + [f"{regions[i % 4]},{i}" for i in range(rows)]
+    return ("\n".join(lines) + "\n").encode()
+
+def test_group_by_keeps_null_group(upload, query):
+    dataset = upload("sales.csv", make_csv())
+    assert dataset["status"] == "ready"
+    response = query(dataset["id"], {
+        "group_by": ["region"], "aggregates": [{"func": "count"}], "order_by": [{"column": "region"}],
+    })
+    assert response.status_code == 200, response.text
+    counts = {row["region"]: row["count"] for row in response.json()["data"]}
+    assert counts == {"east": 50, "north": 50, "south": 50, None: 50}
+
+def test_filter_date_column(client, headers, upload, query):
+    lines = ["day,amount"] + [f"2024-{month:02d}-01,{month}" for month in range(1, 13)]
+    dataset = upload("days.csv", ("\n".join(lines) + "\n").encode())
+    assert dataset["status"] == "ready"
+    response = query(dataset["id"], {
+        "filters": [{"column": "day", "op": ">=", "value": "2024-06-01"}],
+        "aggregates": [{"func": "count"}, {"func": "min", "column": "day"}],
+    })
+    assert response.status_code == 200, response.text
+    row = response.json()["data"][0]
+    assert row["count"] == 7
+    assert row["min_day"].startswith("2024-06-01")
+
+    columns = json.loads(client.get(f"/api/datasets/{dataset['id']}", headers=headers).json()["columns_info"])
+    day = next(column for column in columns if column["name"] == "day")
+    assert day["type"] == "datetime64[ns]"
+    assert day["stats"]["min"] == "2024-01-01T00:00:00"
+    assert day["stats"]["max"] == "2024-12-01T00:00:00"
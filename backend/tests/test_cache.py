@@ -0,0 +1,28 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.utils.cache import DatasetCache
+from app.utils.data_processor import get_columnar_path, load_dataframe
+
+def test_dataset_cache_discards_other_versions(tmp_path):
+    cache = DatasetCache(max_bytes=1 << 20, shared_dir=str(tmp_path), shared_max_bytes=1 << 20)
+    df = pd.DataFrame({"a": [1, 2]})
+    cache.put("key", df, version=1)
+    assert cache.get("key", 1) is df
+    assert cache.get("key", 2) is None
+    assert cache.get("key", 1) is None
+
+def test_reload_after_columnar_file_replaced(tmp_path):
+    raw = tmp_path / "data.csv"
+    raw.write_text("a,b\n1,2\n3,4\n")
+    df = load_dataframe(str(raw), "csv")
+    assert load_dataframe(str(raw), "csv") is df
+
+    # 其他进程重写了列式文件，本进程没有收到invalidate
+    columnar_path = get_columnar_path(str(raw))
+    pq.write_table(pa.table({"a": [5, 6, 7], "b": [8, 9, 10]}), f"{columnar_path}.tmp")
+    os.replace(f"{columnar_path}.tmp", columnar_path)
+    assert load_dataframe(str(raw), "csv")["a"].tolist() == [5, 6, 7]
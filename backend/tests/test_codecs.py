@@ -0,0 +1,22 @@
+import gzip
+
+import pytest
+
+from app.utils.codecs import CODECS, StreamCompressor, negotiate_encoding
+
+def test_stream_compressor_is_abstract():
+    with pytest.raises(TypeError):
+        StreamCompressor()
+
+@pytest.mark.parametrize("encoding", list(CODECS))
+def test_stream_round_trip(encoding):
+    codec = CODECS[encoding]
+    stream = codec.stream()
+    chunks = [b'{"a":1}\n' * 100, b'{"b":2}\n' * 100]
+    body = b"".join(stream.compress(chunk) for chunk in chunks) + stream.finish()
+    assert codec.decompress(body) == b"".join(chunks)
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip;q=0.5, identity") == "gzip"
+    assert negotiate_encoding("identity") is None
+    assert gzip.decompress(CODECS["gzip"].compress(b"x")) == b"x"
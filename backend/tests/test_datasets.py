@@ -0,0 +1,85 @@
+import json
+import time
+
+from app.utils.ingestion import JOB_COMPLETED, JOB_FAILED
+
+CSV = b"region,amount\n" + b"".join(f"{r},{i}\n".encode() for i, r in enumerate(["north", "south"] * 50))
+
+def wait_job(client, headers, dataset_id: int) -> dict:
+    deadline = time.time() + 30
+    while True:
+        job = client.get(f"/api/datasets/{dataset_id}/job", headers=headers).json()
+        if job["status"] in (JOB_COMPLETED, JOB_FAILED) or time.time() > deadline:
+            return job
+        time.sleep(0.05)
+
+def test_append_dataset(client, headers, upload):
+    dataset = upload("append.csv", CSV)
+    response = client.post(
+        f"/api/datasets/{dataset['id']}/append", headers=headers, files={"file": ("more.csv", CSV)}
+    )
+    assert response.status_code == 200, response.text
+    assert wait_job(client, headers, dataset["id"])["status"] == JOB_COMPLETED
+    assert client.get(f"/api/datasets/{dataset['id']}", headers=headers).json()["row_count"] == 200
+
+def test_append_requires_ready_dataset(client, headers):
+    response = client.post("/api/datasets/999999/append", headers=headers, files={"file": ("more.csv", CSV)})
+    assert response.status_code == 404
+
+def test_create_derived_dataset(client, headers, upload, query):
+    dataset = upload("derive.csv", CSV)
+    spec = {"group_by": ["region"], "aggregates": [{"func": "sum", "column": "amount"}]}
+    response = client.post("/api/datasets/derived", headers=headers, json={
+        "name": "totals", "dataset_id": dataset["id"], "query_string": json.dumps(spec),
+    })
+    assert response.status_code == 200, response.text
+    derived = response.json()
+    try:
+        assert derived["status"] == "ready" and derived["row_count"] == 2
+        rows = query(derived["id"], {"order_by": [{"column": "region"}]}).json()["data"]
+        assert rows == [{"region": "north", "sum_amount": 2450}, {"region": "south", "sum_amount": 2500}]
+    finally:
+        client.delete(f"/api/datasets/{derived['id']}", headers=headers)
+
+def test_derived_dataset_with_invalid_query_is_discarded(client, headers, upload):
+    dataset = upload("invalid.csv", CSV)
+    before = client.get("/api/datasets", headers=headers).json()["total"]
+    response = client.post("/api/datasets/derived", headers=headers, json={
+        "name": "broken", "dataset_id": dataset["id"], "query_string": json.dumps({"select": ["missing"]}),
+    })
+    assert response.status_code == 400
+    assert client.get("/api/datasets", headers=headers).json()["total"] == before
+
+def test_create_rollup(client, headers, upload):
+    dataset = upload("rollup.csv", CSV)
+    body = {"dimensions": ["region"], "measures": [{"column": "amount", "funcs": ["sum"]}]}
+    first = client.post(f"/api/datasets/{dataset['id']}/rollups", headers=headers, json=body)
+    assert first.status_code == 200, first.text
+    assert first.json()["row_count"] == 2
+    second = client.post(f"/api/datasets/{dataset['id']}/rollups", headers=headers, json=body)
+    assert second.json()["id"] == first.json()["id"]
+
+def test_batch(client, headers, upload):
+    dataset = upload("batch.csv", CSV)
+    count = json.dumps({"aggregates": [{"func": "count"}]})
+    response = client.post("/api/analytics/batch", headers=headers, json={"items": [
+        {"dataset_id": dataset["id"], "query_string": count},
+        {"dataset_id": 999999, "query_string": count},
+    ]})
+    assert response.status_code == 200, response.text
+    first, second = response.json()["results"]
+    assert first["status"] == 200 and first["result"]["data"] == [{"count": 100}]
+    assert second["status"] == 404
+
+def test_deduplicated_upload_has_completed_job(client, headers, upload):
+    first = upload("dedup.csv", CSV)
+    second = upload("dedup-copy.csv", CSV, wait=False)
+    assert second["status"] == "ready"
+    assert second["file_path"] == first["file_path"]
+
+    job = client.get(f"/api/datasets/{second['id']}/job", headers=headers)
+    assert job.status_code == 200, job.text
+    assert job.json()["status"] == JOB_COMPLETED and job.json()["progress"] == 1.0
+
+    events = client.get(f"/api/datasets/{second['id']}/job/events", headers=headers)
+    assert events.text.startswith(f"event: {JOB_COMPLETED}\n")
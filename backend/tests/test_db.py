@@ -0,0 +1,22 @@
+from sqlalchemy import inspect
+
+from app.db.init_db import add_missing_columns, add_missing_indexes
+from app.db.session import create_db_engine, engine
+
+def test_add_missing_indexes_to_existing_tables(tmp_path):
+    old = create_db_engine(f"sqlite:///{tmp_path}/old.db")
+    with old.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE datasets (id INTEGER PRIMARY KEY, owner_id INTEGER)")
+    add_missing_columns(old)
+    add_missing_indexes(old)
+    indexes = {index["name"]: index["column_names"] for index in inspect(old).get_indexes("datasets")}
+    assert indexes["ix_datasets_owner_id_key"] == ["owner_id", "id"]
+    old.dispose()
+
+def test_list_datasets_uses_owner_id_index(client):
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT * FROM datasets WHERE owner_id = 1 AND id > 0 ORDER BY id LIMIT 20"
+        ).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert "ix_datasets_owner_id_key" in details and "TEMP B-TREE" not in details
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from app.schemas.query import QuerySpec
+from app.utils.query_engine import aggregate
+
+def test_group_by_categorical_keeps_null_group():
+    df = pd.DataFrame({"c": pd.Categorical(["a", None, "b", None]), "v": [1, 2, 3, 4]})
+    spec = QuerySpec.parse_obj({
+        "group_by": ["c"],
+        "aggregates": [{"func": "sum", "column": "v", "alias": "n"}, {"func": "count"}],
+    })
+    result = aggregate(df, spec)
+    assert result["c"].tolist()[::2] == ["a", "b"]
+    assert pd.isna(result["c"][1])
+    assert result["n"].tolist() == [1, 6, 3]
+    assert result["count"].tolist() == [1, 2, 1]
+    assert isinstance(result["c"].dtype, pd.CategoricalDtype)
+
+def test_group_by_categorical_matches_object_keys():
+    values = ["a", None, "b", "c", None, "a"] * 50
+    df = pd.DataFrame({"c": pd.Categorical(values), "d": [None, "x"] * 150, "v": range(300)})
+    spec = QuerySpec.parse_obj({"group_by": ["c", "d"], "aggregates": [{"func": "sum", "column": "v"}]})
+    categorical = aggregate(df, spec)
+    plain = aggregate(df.assign(c=df["c"].astype(object)), spec)
+    assert categorical["sum_v"].sum() == df["v"].sum()
+    pd.testing.assert_frame_equal(categorical.assign(c=categorical["c"].astype(object)), plain)
+
+def test_group_by_without_aggregates_keeps_null_group():
+    df = pd.DataFrame({"c": pd.Categorical(["a", None, "a"])})
+    result = aggregate(df, QuerySpec(group_by=["c"]))
+    assert len(result) == 2 and result["c"].isna().sum() == 1
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from app.schemas.dataset import RollupCreate
+from app.schemas.query import QuerySpec
+from app.utils.query_engine import apply_query
+from app.utils.rollups import apply_rollup, build_rollup, normalize_rollup
+
+def make_frame(rows: int = 1000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    region = pd.Categorical(rng.choice(["N", "S", "E", None], rows))
+    product = rng.choice(["p1", "p2", None], rows).astype(object)
+    return pd.DataFrame({"region": region, "product": product, "amount": rng.integers(0, 100, rows)})
+
+ROLLUP = normalize_rollup(RollupCreate.parse_obj({
+    "dimensions": ["region", "product"],
+    "measures": [{"column": "amount", "funcs": ["sum", "count", "min", "max"]}],
+}))
+
+def check(df: pd.DataFrame, spec: dict) -> None:
+    spec = QuerySpec.parse_obj(spec)
+    expected = apply_query(df, spec)
+    actual = apply_rollup(build_rollup(df, ROLLUP), spec)
+    pd.testing.assert_frame_equal(
+        actual.astype(object).reset_index(drop=True), expected.astype(object).reset_index(drop=True), check_dtype=False
+    )
+
+def test_rollup_keeps_null_dimension_group():
+    df = make_frame()
+    check(df, {"group_by": ["region"], "aggregates": [{"func": "count"}, {"func": "sum", "column": "amount"}]})
+    check(df, {"group_by": ["region", "product"], "aggregates": [{"func": "mean", "column": "amount"}]})
+
+def test_rollup_filters_and_global_aggregates():
+    df = make_frame()
+    check(df, {"aggregates": [{"func": "count"}, {"func": "max", "column": "amount"}]})
+    check(df, {
+        "filters": [{"column": "region", "op": "is_null"}],
+        "group_by": ["product"], "aggregates": [{"func": "min", "column": "amount"}],
+    })
@@ -0,0 +1,32 @@
+import json
+import os
+
+from app.core.config import settings
+from app.core.limits import FORM_OVERHEAD
+
+def post_file(client, headers, content: bytes):
+    return client.post(
+        "/api/datasets", headers=headers,
+        data={"dataset_in": json.dumps({"name": "big.csv"})}, files={"file": ("big.csv", content)},
+    )
+
+def leftover_uploads():
+    return [name for name in os.listdir(settings.UPLOAD_FOLDER) if name.endswith(".upload.tmp")]
+
+def test_reject_oversized_request_before_reading_body(client, headers, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONTENT_LENGTH", 1000)
+    response = post_file(client, headers, b"a,b\n" + b"1,2\n" * FORM_OVERHEAD)
+    assert response.status_code == 413
+    assert "1000 bytes" in response.json()["detail"]
+    assert response.headers["connection"] == "close"
+
+def test_reject_oversized_file_while_saving(client, headers, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONTENT_LENGTH", 1000)
+    response = post_file(client, headers, b"a,b\n" + b"1,2\n" * 500)
+    assert response.status_code == 413
+    assert leftover_uploads() == []
+
+def test_accept_file_within_limit(upload, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_CONTENT_LENGTH", 1000)
+    dataset = upload("small.csv", b"a,b\n" + b"1,2\n" * 100)
+    assert dataset["status"] == "ready"